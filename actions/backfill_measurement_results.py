@@ -0,0 +1,189 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+from concurrent import futures
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from ripe.atlas.cousteau import AtlasResultsRequest
+
+from st2common.runners.base_action import Action
+
+from lib.result_stream import iter_results
+
+__all__ = [
+    'AtlasBackfillMeasurementResults'
+]
+
+DEFAULT_CACHE_DIR = "/var/tmp/stackstorm-atlas"
+DEFAULT_MAX_CONCURRENT_FETCHES = 8
+DEFAULT_FETCH_TIMEOUT = 30
+# length, in seconds, of the time windows fetched by a single request
+DEFAULT_WINDOW = 86400
+DEFAULT_RETRIES = 3
+# size, in bytes, of the chunks a results body is read in
+READ_CHUNK_SIZE = 65536
+
+
+class ChunkManifest(object):
+    """The windows of a backfill already written to their chunk file, saved
+       after every window so an interrupted backfill resumes where it stopped
+    """
+
+    def __init__(self, path, request):
+        self.path = path
+        self._lock = threading.Lock()
+        self.chunks = {}
+        self.complete = False
+        self.request = request
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        saved = manifest.get("request") or {}
+        # without a stop, the backfill resumed goes up to the stop resolved
+        # by its first run
+        if request.get("stop") is None:
+            request = dict(request, stop=saved.get("stop"))
+        # the chunks of another backfill are of no use
+        if saved == request:
+            self.request = request
+            self.chunks = manifest["chunks"]
+            self.complete = manifest.get("complete", False)
+
+    def done(self, window_start):
+        return str(window_start) in self.chunks
+
+    def add(self, window_start, results):
+        with self._lock:
+            self.chunks[str(window_start)] = results
+            self.save()
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"request": self.request, "chunks": self.chunks, "complete": self.complete}, f)
+        os.rename(self.path + ".tmp", self.path)
+
+
+class AtlasBackfillMeasurementResults(Action):
+    def run(self, measurement_id, start, stop=None, probe_ids=None, output=None, window=DEFAULT_WINDOW,
+            max_concurrency=None, retries=DEFAULT_RETRIES):
+        """
+        Download the results of a measurement between `start` and `stop` to
+        a gzipped NDJSON file, one result per line. The range is fetched in
+        windows of `window` seconds, concurrently; each window is streamed to
+        its own chunk file as its body comes in, and the chunks are
+        joined in time order once all of them are done. Running the action
+        again with the same parameters resumes an interrupted backfill; when
+        `stop` is not given, the range ends at the time of the first run.
+        """
+        output = output or os.path.join(self.config.get("cache_dir", DEFAULT_CACHE_DIR), "backfill",
+                                        "{}-{}-{}.ndjson.gz".format(measurement_id, start, stop or "now"))
+        chunks_dir = output + ".chunks"
+        manifest = ChunkManifest(output + ".manifest.json", {
+            "measurement_id": measurement_id, "start": start, "stop": stop,
+            "probe_ids": probe_ids, "window": window,
+        })
+        if manifest.request["stop"] is None:
+            manifest.request["stop"] = int(time.time())
+        stop = manifest.request["stop"]
+        windows = [(window_start, min(window_start + window, stop)) for window_start in range(start, stop, window)]
+        if manifest.complete and os.path.exists(output):
+            return (True, self._summary(output, manifest, windows, resumed=len(windows)))
+        if not os.path.isdir(chunks_dir):
+            os.makedirs(chunks_dir)
+
+        max_workers = max_concurrency or self.config.get("max_concurrent_fetches", DEFAULT_MAX_CONCURRENT_FETCHES)
+        timeout = self.config.get("fetch_timeout", DEFAULT_FETCH_TIMEOUT)
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+
+        pending = [(window_start, window_stop) for window_start, window_stop in windows
+                   if not manifest.done(window_start)]
+        failed = []
+        try:
+            with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetches = dict((executor.submit(self._backfill_window, session, timeout, retries, measurement_id,
+                                                probe_ids, window_start, window_stop, chunks_dir, manifest),
+                                window_start)
+                               for window_start, window_stop in pending)
+                for fetch in futures.as_completed(fetches):
+                    try:
+                        fetch.result()
+                    except Exception as e:
+                        self.logger.error("Backfilling measurement %s from %s failed: %s",
+                                          measurement_id, fetches[fetch], e)
+                        failed.append(fetches[fetch])
+        finally:
+            session.close()
+
+        if failed:
+            summary = self._summary(output, manifest, windows, resumed=len(windows) - len(pending))
+            summary["failed_windows"] = sorted(failed)
+            return (False, summary)
+
+        self._join_chunks(output, chunks_dir, windows)
+        manifest.complete = True
+        manifest.save()
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+        return (True, self._summary(output, manifest, windows, resumed=len(windows) - len(pending)))
+
+    def _backfill_window(self, session, timeout, retries, measurement_id, probe_ids, window_start, window_stop,
+                         chunks_dir, manifest):
+        path = os.path.join(chunks_dir, "{}.ndjson.gz".format(window_start))
+        delay = 1
+        for attempt in range(retries + 1):
+            try:
+                count = self._write_window(session, timeout, measurement_id, probe_ids, window_start, window_stop,
+                                           path + ".tmp")
+                break
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                self.logger.warning("Fetching measurement %s from %s failed, retrying in %ss: %s",
+                                    measurement_id, window_start, delay, e)
+                time.sleep(delay)
+                delay *= 2
+        os.rename(path + ".tmp", path)
+        manifest.add(window_start, count)
+
+    def _write_window(self, session, timeout, measurement_id, probe_ids, window_start, window_stop, path):
+        """Write the results of a window to `path` as they are parsed from
+           the response body, in the order of the API; returns how many
+        """
+        request = AtlasResultsRequest(msm_id=measurement_id, start=window_start,
+                                      # the stop of the API is inclusive
+                                      stop=window_stop - 1, probe_ids=probe_ids)
+        request.build_url()
+        count = 0
+        with session.get(request.url, stream=True, timeout=timeout, **request.http_method_args) as response:
+            if not response.ok:
+                raise RuntimeError("{} {}".format(response.status_code, response.text[:200]))
+            with gzip.open(path, "wt") as f:
+                for result in iter_results(response.iter_content(READ_CHUNK_SIZE)):
+                    f.write(json.dumps(result, separators=(",", ":")))
+                    f.write("\n")
+                    count += 1
+        return count
+
+    def _join_chunks(self, output, chunks_dir, windows):
+        # concatenated gzip members make a valid gzip file
+        with open(output + ".tmp", "wb") as out:
+            for window_start, _ in windows:
+                with open(os.path.join(chunks_dir, "{}.ndjson.gz".format(window_start)), "rb") as chunk:
+                    shutil.copyfileobj(chunk, out)
+        os.rename(output + ".tmp", output)
+
+    def _summary(self, output, manifest, windows, resumed):
+        return {
+            "output": output,
+            "results": sum(manifest.chunks.values()),
+            "windows": len(windows),
+            "resumed_windows": resumed,
+        }
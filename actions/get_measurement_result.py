@@ -1,29 +1,76 @@
-from datetime import datetime
-from ripe.atlas.cousteau import AtlasResultsRequest
+import os
+import time
+
+from ripe.atlas.cousteau import AtlasLatestRequest, AtlasResultsRequest, Measurement
 
 from st2common.runners.base_action import Action
 
+from lib.result_cache import ResultCache
+
 __all__ = [
     'AtlasGetMeasurementResult'
 ]
 
+DEFAULT_CACHE_DIR = "/var/tmp/stackstorm-atlas"
+# ttl, in seconds, of the results of measurements without an interval
+DEFAULT_CACHE_TTL = 300
+# the cached result of a probe is at least kept that long, e.g. when its
+# next result is late
+MIN_CACHE_TTL = 30
+# how long, in seconds, the interval of a measurement is cached
+MEASUREMENT_CACHE_TTL = 86400
+
 
 class AtlasGetMeasurementResult(Action):
-    def run(self, measurement_id, probe_id):
+    def run(self, measurement_id, probe_id, start=None, stop=None, use_cache=True):
         """
-        # self.config['<key>'] is useful for retrieving API keys, etc.
-        # not needed for this action, so everything is a parameter
+        Without `start` and `stop`, only the latest result of the probe is
+        fetched, and it is cached until the next result of the probe is due.
+        With them, the last result of the probe in that time window.
         """
+        if start is not None or stop is not None:
+            is_success, m_results = AtlasResultsRequest(
+                msm_id=measurement_id,
+                start=start,
+                stop=stop,
+                probe_ids=[probe_id]
+            ).create()
+            return self._last_result(measurement_id, probe_id, is_success, m_results)
 
-        is_success, m_results = AtlasResultsRequest(
-            msm_id=measurement_id,
-            # start=start,
-            # stop=stop,
-            probe_ids=[probe_id]
-        ).create()
+        cache = ResultCache(os.path.join(self.config.get("cache_dir", DEFAULT_CACHE_DIR), "results"))
+        if use_cache:
+            last_result = cache.get((measurement_id, probe_id))
+            if last_result is not None:
+                return (True, {"last_result": last_result})
 
+        is_success, m_results = AtlasLatestRequest(msm_id=measurement_id, probe_ids=[probe_id]).create()
+        is_success, action_results = self._last_result(measurement_id, probe_id, is_success, m_results)
+        if is_success:
+            last_result = action_results["last_result"]
+            cache.put((measurement_id, probe_id), last_result, self._result_ttl(cache, measurement_id, last_result))
+        return (is_success, action_results)
+
+    def _last_result(self, measurement_id, probe_id, is_success, m_results):
+        if not is_success:
+            return (False, m_results)
+        if not m_results:
+            return (False, "No results of measurement {} from probe {}".format(measurement_id, probe_id))
         action_results = {
-            "last_result": m_results[-1]
+            "last_result": max(m_results, key=lambda result: result.get("timestamp", 0))
         }
+        return (True, action_results)
 
-        return (is_success, action_results)
+    def _result_ttl(self, cache, measurement_id, result):
+        """Seconds until the next result of the probe is due"""
+        interval = cache.get(("measurement", measurement_id))
+        if interval is None:
+            try:
+                interval = Measurement(id=measurement_id).interval or 0
+            except Exception:
+                self.logger.warning("Could not get the interval of measurement %s", measurement_id)
+                return DEFAULT_CACHE_TTL
+            cache.put(("measurement", measurement_id), interval, MEASUREMENT_CACHE_TTL)
+        if not interval:
+            return DEFAULT_CACHE_TTL
+        next_result = result.get("timestamp", 0) + interval
+        return min(interval, max(MIN_CACHE_TTL, next_result - time.time()))
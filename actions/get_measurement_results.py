@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from concurrent import futures
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from ripe.atlas.cousteau import AtlasLatestRequest
+
+from st2common.runners.base_action import Action
+
+__all__ = [
+    'AtlasGetMeasurementResults'
+]
+
+DEFAULT_MAX_CONCURRENT_FETCHES = 8
+DEFAULT_FETCH_TIMEOUT = 30
+# the probes of a measurement are asked in requests of at most that many
+MAX_PROBES_PER_REQUEST = 500
+
+
+def pair_key(measurement_id, probe_id):
+    return "{}:{}".format(measurement_id, probe_id)
+
+
+class AtlasGetMeasurementResults(Action):
+    def run(self, pairs, max_concurrency=None):
+        """
+        Latest result of many (measurement, probe) pairs: the probes of a
+        measurement are fetched with a single request, the measurements
+        concurrently. Returns, keyed by "<measurement_id>:<probe_id>", the
+        `last_result` of every pair or its `error`.
+        """
+        probes_by_msm = OrderedDict()
+        for pair in pairs:
+            probe_ids = probes_by_msm.setdefault(int(pair["measurement_id"]), [])
+            if int(pair["probe_id"]) not in probe_ids:
+                probe_ids.append(int(pair["probe_id"]))
+        requests_probes = [(msm_id, probe_ids[i:i + MAX_PROBES_PER_REQUEST])
+                           for msm_id, probe_ids in probes_by_msm.items()
+                           for i in range(0, len(probe_ids), MAX_PROBES_PER_REQUEST)]
+
+        max_workers = max_concurrency or self.config.get("max_concurrent_fetches", DEFAULT_MAX_CONCURRENT_FETCHES)
+        timeout = self.config.get("fetch_timeout", DEFAULT_FETCH_TIMEOUT)
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+
+        results = {}
+        try:
+            with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetches = dict((executor.submit(self._fetch, session, timeout, msm_id, probe_ids), (msm_id, probe_ids))
+                               for msm_id, probe_ids in requests_probes)
+                for fetch in futures.as_completed(fetches):
+                    msm_id, probe_ids = fetches[fetch]
+                    for prb_id, result in self._results_by_probe(fetch, msm_id, probe_ids).items():
+                        results[(msm_id, prb_id)] = result
+        finally:
+            session.close()
+
+        action_results = OrderedDict(
+            (pair_key(pair["measurement_id"], pair["probe_id"]),
+             results[(int(pair["measurement_id"]), int(pair["probe_id"]))])
+            for pair in pairs)
+        succeeded = any("last_result" in result for result in action_results.values())
+        return (succeeded or not pairs, action_results)
+
+    def _fetch(self, session, timeout, msm_id, probe_ids):
+        request = AtlasLatestRequest(msm_id=msm_id, probe_ids=probe_ids)
+        request.http_methods = {"GET": session.get}
+        request.http_method_args["timeout"] = timeout
+        return request.create()
+
+    def _results_by_probe(self, fetch, msm_id, probe_ids):
+        """The result, or error, of every probe of a fetch"""
+        try:
+            is_success, m_results = fetch.result()
+        except Exception as e:
+            is_success, m_results = False, str(e)
+        if not is_success:
+            self.logger.warning("Fetching the latest results of measurement %s failed: %s", msm_id, m_results)
+            return dict((prb_id, {"error": "Fetching measurement {} failed: {}".format(msm_id, m_results)})
+                        for prb_id in probe_ids)
+
+        last_results = {}
+        for result in m_results:
+            last_result = last_results.get(result["prb_id"])
+            if last_result is None or result.get("timestamp", 0) > last_result.get("timestamp", 0):
+                last_results[result["prb_id"]] = result
+        return dict((prb_id, {"last_result": last_results[prb_id]} if prb_id in last_results else
+                     {"error": "No results of measurement {} from probe {}".format(msm_id, prb_id)})
+                    for prb_id in probe_ids)
@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+
+class ResultCache(object):
+    """Small on-disk cache of JSON values, one file per key, each with its
+       own expiry. Past `max_entries` files, the least recently written ones
+       are removed.
+    """
+
+    def __init__(self, directory, max_entries=1000, clock=time.time):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._clock = clock
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.json".format("-".join(str(part) for part in key)))
+
+    def get(self, key):
+        """The value of `key`, None if it is missing or expired"""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= self._clock():
+            return None
+        return entry.get("value")
+
+    def put(self, key, value, ttl):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = self._path(key)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"expires_at": self._clock() + ttl, "value": value}, f)
+            os.rename(path + ".tmp", path)
+            self._prune()
+        except (IOError, OSError):
+            # the cache only saves API calls, a read-only or full disk is no error
+            pass
+
+    def _prune(self):
+        names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        if len(names) <= self.max_entries:
+            return
+        paths = sorted((os.path.join(self.directory, name) for name in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,47 @@
+import codecs
+import json
+
+# The actions only see the actions directory and the sensors only theirs,
+# so this is a copy of the parser of sensors/json_stream.py for a body that
+# is the array itself: keep both in sync, tests/test_result_stream.py and
+# tests/test_json_stream.py cover them alike.
+
+WHITESPACE = " \t\n\r"
+
+
+def iter_results(chunks, encoding="utf-8"):
+    """Items of the JSON array of a results body, parsed as the chunks of the
+       body come in instead of once the whole body is loaded. Raises
+       ValueError if the body is not an array or ends before the array does.
+    """
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder(encoding)().decode
+    buffer = ""
+    position = None
+    for chunk in chunks:
+        if position is None:
+            buffer = (buffer + decode(chunk)).lstrip(WHITESPACE)
+            if not buffer:
+                continue
+            if buffer[0] != "[":
+                raise ValueError("Expected a JSON array of results, got {!r}".format(buffer[:64]))
+            position = 1
+        else:
+            buffer = buffer[position:] + decode(chunk)
+            position = 0
+        length = len(buffer)
+        while True:
+            while position < length and (buffer[position] in WHITESPACE or buffer[position] == ","):
+                position += 1
+            if position == length:
+                break
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # the item is not complete yet
+                break
+            yield item
+            position = end
+    raise ValueError("The results body ended before its array")
@@ -0,0 +1,112 @@
+"""Compare the array backed ProbeFleet of ProbesDiscoSensor with the per probe
+dicts and per ASN sets it replaced, on a synthetic fleet and status events.
+
+    python benchmarks/bench_probe_fleet.py --probes 100000 --events 1000000
+
+The sliding window of the last disconnected probes is left out of both
+paths, only the fleet state and the connection percentages are compared.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sensors"))
+
+from probe_fleet import EVENT_STATUS, ProbeFleet  # noqa: E402
+from synthetic import probe_rows, probe_status_events  # noqa: E402
+
+STATUS_MAP = {
+    1: "Connected",
+    2: "Disconnected",
+    3: "Abandoned",
+    4: "NeverSeen"
+}
+
+
+def _percentage(vstate):
+    connected = len(vstate.get("Connected", []))
+    total = connected + len(vstate.get("Disconnected", []))
+    vstate["connection_percentage"] = 100.0 * connected / total if total else None
+    return vstate["connection_percentage"]
+
+
+def legacy_state(probes):
+    """The state of ProbesDiscoSensor._create_state_dicts before ProbeFleet"""
+    probes_state, ases_v4, ases_v6 = {}, {}, {}
+    for p in probes:
+        status = STATUS_MAP[p[12]]
+        probes_state[p[0]] = {"prb_id": p[0], "asn_v4": p[1], "asn_v6": p[2], "status": status}
+        if p[1]:
+            ases_v4.setdefault(p[1], {}).setdefault(status, set()).add(p[0])
+        if p[2]:
+            ases_v6.setdefault(p[2], {}).setdefault(status, set()).add(p[0])
+    for vstate in list(ases_v4.values()) + list(ases_v6.values()):
+        _percentage(vstate)
+    return probes_state, ases_v4, ases_v6
+
+
+def legacy_update(state, event):
+    probes_state, ases_v4, ases_v6 = state
+    status = "Connected" if event["event"] == "connect" else "Disconnected"
+    other = "Disconnected" if status == "Connected" else "Connected"
+    probes_state[event["prb_id"]]["status"] = status
+    percentages = []
+    for ases, asn in ((ases_v4, event["probe"]["asn_v4"]), (ases_v6, event["probe"]["asn_v6"])):
+        if asn:
+            vstate = ases.setdefault(asn, {})
+            vstate.setdefault(other, set()).discard(event["prb_id"])
+            vstate.setdefault(status, set()).add(event["prb_id"])
+            percentages.append(_percentage(vstate))
+    return percentages
+
+
+def fleet_update(fleet, event):
+    changes = fleet.update(event["prb_id"], EVENT_STATUS[event["event"]],
+                           asn_v4=event["probe"]["asn_v4"], asn_v6=event["probe"]["asn_v6"])
+    return [change.after for change in changes]
+
+
+def measure(build, update, probes, events):
+    gc.collect()
+    tracemalloc.start()
+    state = build(probes)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.time()
+    last = None
+    for event in events:
+        last = update(state, event)
+    return memory, time.time() - started, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--probes", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=1000000)
+    args = parser.parse_args()
+
+    probes = probe_rows(args.probes)
+    events = list(probe_status_events(probes, args.events))
+    results = {
+        "legacy": measure(legacy_state, legacy_update, probes, events),
+        "fleet": measure(lambda rows: ProbeFleet.from_rows(rows, dimensions=("asn_v4", "asn_v6")),
+                         fleet_update, probes, events),
+    }
+
+    print("probes: {}, events: {}".format(args.probes, args.events))
+    for name, (memory, elapsed, _) in sorted(results.items()):
+        print("{:<8} {:8.1f} MB {:8.2f} s {:6.2f} us/event".format(
+            name, memory / 1e6, elapsed, elapsed * 1e6 / args.events))
+    print("memory:  {:8.1f}x less".format(results["legacy"][0] / float(results["fleet"][0])))
+    print("speedup: {:8.1f}x".format(results["legacy"][1] / results["fleet"][1]))
+    if results["legacy"][2] != results["fleet"][2]:
+        print("MISMATCH between the percentages of the two paths")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
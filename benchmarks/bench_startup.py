@@ -0,0 +1,142 @@
+"""Startup cost of every sensor: time to import its module, to set it up and
+until its first event is processed, each sensor in a fresh interpreter.
+
+    python benchmarks/bench_startup.py --probes 100000
+
+The probes disco sensor starts from a fleet snapshot of `--probes` synthetic
+probes, as it does after a restart; the first event of the polling sensor is
+its first poll, answered from memory.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "sensors"))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_sensor_service import FakeSensorService, ensure_st2reactor  # noqa: E402
+
+SENSORS = ("ping", "disco", "polling")
+
+
+def _wait_processed(sensor, count=1):
+    while sensor.metrics()["processed"] < count:
+        time.sleep(0.0005)
+
+
+def start_ping(config):
+    from ping_streaming_sensor import PERCENTILE_TRIGGER, PingStreamingSensor
+    imported = time.perf_counter()
+    sensor = PingStreamingSensor(FakeSensorService(), config)
+    sensor.setup()
+    sensor.add_trigger({"id": "startup", "ref": PERCENTILE_TRIGGER, "parameters": {"msm_id": 5001}})
+    ready = time.perf_counter()
+
+    from synthetic import ping_results
+    sensor.start_workers()
+    sensor.on_stream_message(next(ping_results([5001], 10, 1)))
+    _wait_processed(sensor)
+    return sensor, imported, ready
+
+
+def start_disco(config):
+    from probes_disco_sensor import ProbesDiscoSensor
+    imported = time.perf_counter()
+    sensor = ProbesDiscoSensor(FakeSensorService(), config)
+    sensor.setup()
+    ready = time.perf_counter()
+
+    from synthetic import probe_rows, probe_status_events
+    sensor.start_workers()
+    sensor.on_stream_message(next(probe_status_events(probe_rows(10), 1)))
+    _wait_processed(sensor)
+    return sensor, imported, ready
+
+
+def start_polling(config):
+    from ripe_atlas_polling import RIPEAtlasPolling
+    imported = time.perf_counter()
+    sensor = RIPEAtlasPolling(FakeSensorService(), dict(config, measurements=[{"measurement_id": 5001}]))
+    sensor.setup()
+    ready = time.perf_counter()
+
+    from replay import ReplayFetcher
+    from synthetic import traceroute_rounds
+    sensor._fetcher = ReplayFetcher({5001: 900})
+    sensor._fetcher.pending[5001] = traceroute_rounds(100, rounds=1)[0]
+    sensor._poll_measurement(sensor._watches[0])
+    return sensor, imported, ready
+
+
+def child(sensor_name, cache_dir):
+    ensure_st2reactor()
+    started = time.perf_counter()
+    sensor, imported, ready = globals()["start_" + sensor_name]({"cache_dir": cache_dir})
+    first_event = time.perf_counter()
+    sensor.cleanup()
+    print(json.dumps({
+        "interpreter": started - STARTED,
+        "import": imported - started,
+        "setup": ready - imported,
+        "first_event": first_event - started,
+        "first_event_at": time.time() - (time.perf_counter() - first_event),
+    }))
+
+
+def write_snapshot(cache_dir, probes):
+    from fleet_snapshot import FleetSnapshot
+    from probe_fleet import ProbeFleet
+    from synthetic import probe_rows
+
+    FleetSnapshot(os.path.join(cache_dir, "probes_fleet")).save(ProbeFleet.from_rows(probe_rows(probes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sensors", nargs="*", help="sensors to start, among {}, all by default".format(", ".join(SENSORS)))
+    parser.add_argument("--probes", type=int, default=100000, help="probes of the fleet snapshot")
+    parser.add_argument("--runs", type=int, default=3, help="runs per sensor, the fastest is reported")
+    parser.add_argument("--child", choices=SENSORS, help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = set(args.sensors).difference(SENSORS)
+    if unknown:
+        parser.error("unknown sensors {}".format(", ".join(sorted(unknown))))
+    if args.child:
+        child(args.child, args.cache_dir)
+        return 0
+
+    cache_dir = tempfile.mkdtemp(prefix="atlas-startup-")
+    try:
+        write_snapshot(cache_dir, args.probes)
+        print("{:<8} {:>10} {:>10} {:>10} {:>14} {:>16}".format(
+            "sensor", "python ms", "import ms", "setup ms", "1st event ms", "process to 1st"))
+        for sensor_name in args.sensors or SENSORS:
+            runs = []
+            for _ in range(args.runs):
+                spawned = time.time()
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                  "--child", sensor_name, "--cache-dir", cache_dir])
+                timings = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+                timings["process"] = timings["first_event_at"] - spawned
+                runs.append(timings)
+            best = min(runs, key=lambda timings: timings["process"])
+            print("{:<8} {:>10.1f} {:>10.1f} {:>10.1f} {:>14.1f} {:>16.1f}".format(
+                sensor_name, best["interpreter"] * 1000, best["import"] * 1000, best["setup"] * 1000,
+                best["first_event"] * 1000, best["process"] * 1000))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Compare the columnar traceroute analysis of the polling sensor with the
+per probe analysis it replaced, on synthetic results.
+
+    python benchmarks/bench_traceroute_analysis.py --probes 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sensors"))
+
+from synthetic import traceroute_rounds  # noqa: E402
+from traceroute_analysis import AddressTable, PreviousColumns, TracerouteBatch, median  # noqa: E402
+
+INTERVAL = 900
+DELAY_TOLERANCE = 10
+RTT_TOLERANCE = 10
+
+
+def _host_unreachable(hops):
+    return any([{"x": "*"} in hop["result"] for hop in hops])
+
+
+def _rtts(probe_result):
+    return [attempt["rtt"] for hop in probe_result["result"] for attempt in hop["result"]]
+
+
+def per_probe_analysis(previous_measurement, results, triggers):
+    """The per probe path of RIPEAtlasPolling before the columnar engine"""
+    now = int(time.time())
+    for new in results:
+        old = previous_measurement.get(new["prb_id"])
+        if old is not None:
+            stale_deadline = new["stored_timestamp"] + INTERVAL + DELAY_TOLERANCE
+            if not (new["stored_timestamp"] == old["stored_timestamp"] and stale_deadline > now):
+                if len(old["result"]) != len(new["result"]):
+                    triggers[("HopsNumberChanged", new["prb_id"])] += 1
+                if _host_unreachable(old["result"]) or _host_unreachable(new["result"]):
+                    if _host_unreachable(new["result"]) and not _host_unreachable(old["result"]):
+                        triggers[("HostPartiallyReachable", new["prb_id"])] += 1
+                    if _host_unreachable(old["result"]) and not _host_unreachable(new["result"]):
+                        triggers[("HostPartiallyUnreachable", new["prb_id"])] += 1
+                else:
+                    old_median = old.get("__rtt_median", median(_rtts(old)))
+                    new_median = median(_rtts(new))
+                    new["__rtt_median"] = new_median
+                    if not old_median - RTT_TOLERANCE <= new_median <= old_median + RTT_TOLERANCE:
+                        triggers[("RTTMedianChanged", new["prb_id"])] += 1
+        if not _host_unreachable(new["result"]):
+            froms = set([attempt["from"] for hop in new["result"] for attempt in hop["result"]])
+            if len(froms) != 1:
+                triggers[("FromFieldDifferentInAttempts", new["prb_id"])] += 1
+            if len(froms.difference({new["dst_addr"]})) != 0:
+                triggers[("FromFieldDifferentThanGeneral", new["prb_id"])] += 1
+        previous_measurement[new["prb_id"]] = new
+
+
+def columnar_analysis(previous_summaries, results, addresses, triggers):
+    """The analysis of RIPEAtlasPolling._handle_results, without the dispatching.
+       Returns the time spent building the columns out of the results.
+    """
+    started = time.time()
+    batch = TracerouteBatch(results, addresses)
+    parsing = time.time() - started
+    previous = [previous_summaries.get(prb_id) for prb_id in batch.prb_ids.tolist()]
+    columns = PreviousColumns(known=[p is not None for p in previous],
+                              stored_timestamp=[p[0] if p else 0 for p in previous],
+                              hop_count=[p[1] if p else 0 for p in previous],
+                              unreachable=[p[2] if p else False for p in previous],
+                              rtt_median=[p[3] if p else np.nan for p in previous])
+    changes = batch.compare(columns, rtt_tolerance=RTT_TOLERANCE,
+                            stale_after=INTERVAL + DELAY_TOLERANCE, now=int(time.time()))
+    for name, mask in (("HopsNumberChanged", changes.hops_changed),
+                       ("HostPartiallyReachable", changes.became_unreachable),
+                       ("HostPartiallyUnreachable", changes.became_reachable),
+                       ("RTTMedianChanged", changes.rtt_changed),
+                       ("FromFieldDifferentInAttempts", changes.from_differs_in_attempts),
+                       ("FromFieldDifferentThanGeneral", changes.from_differs_from_dst)):
+        for prb_id in batch.prb_ids[mask].tolist():
+            triggers[(name, prb_id)] += 1
+    previous_summaries.update(zip(batch.prb_ids.tolist(),
+                                  zip(batch.stored_timestamp.tolist(), batch.hop_count.tolist(),
+                                      batch.unreachable.tolist(), batch.rtt_median.tolist())))
+    return parsing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--probes", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    first, second = traceroute_rounds(args.probes, rounds=2, interval=INTERVAL)
+    timings = {}
+    triggers = {}
+    parsing = None
+    for name in ("per_probe", "columnar"):
+        best = None
+        for _ in range(args.repeat):
+            found = Counter()
+            if name == "per_probe":
+                state, results = {}, [dict(r) for r in second]
+                per_probe_analysis(state, [dict(r) for r in first], Counter())
+                started = time.time()
+                per_probe_analysis(state, results, found)
+            else:
+                state, addresses = {}, AddressTable()
+                columnar_analysis(state, first, addresses, Counter())
+                started = time.time()
+                parsed = columnar_analysis(state, second, addresses, found)
+                parsing = parsed if parsing is None else min(parsing, parsed)
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        triggers[name] = found
+
+    print("probes: {}".format(args.probes))
+    for name, elapsed in sorted(timings.items()):
+        print("{:<10} {:8.1f} ms  {:>8} triggers".format(name, elapsed * 1000, sum(triggers[name].values())))
+    print("speedup:   {:8.1f}x".format(timings["per_probe"] / timings["columnar"]))
+    print("columnar time spent reading the result dicts: {:.1f} ms".format(parsing * 1000))
+    if triggers["per_probe"] != triggers["columnar"]:
+        print("MISMATCH between the triggers of the two paths")
+        return 1
+    print("same triggers on both paths")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
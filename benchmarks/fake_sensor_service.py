@@ -0,0 +1,73 @@
+"""In memory stand-in of the st2 sensor service, for running the sensors
+offline: it counts the dispatched triggers instead of sending them."""
+import logging
+import sys
+import types
+
+from collections import Counter
+
+
+class FakeSensorService(object):
+
+    def __init__(self, log_level=logging.WARNING, keep_payloads=False):
+        logging.basicConfig(level=log_level)
+        self.dispatch_counts = Counter()
+        self.dispatched = []
+        self._keep_payloads = keep_payloads
+        self._datastore = {}
+
+    def get_logger(self, name):
+        return logging.getLogger(name)
+
+    def dispatch(self, trigger, payload=None, trace_tag=None):
+        self.dispatch_counts[trigger] += 1
+        if self._keep_payloads:
+            self.dispatched.append((trigger, payload, trace_tag))
+
+    def get_value(self, name, local=True, scope=None, decrypt=False):
+        return self._datastore.get(name)
+
+    def set_value(self, name, value, ttl=None, local=True, scope=None, encrypt=False):
+        self._datastore[name] = value
+        return True
+
+    def delete_value(self, name, local=True, scope=None):
+        return self._datastore.pop(name, None) is not None
+
+    def list_values(self, local=True, prefix=None):
+        return [name for name in self._datastore if prefix is None or name.startswith(prefix)]
+
+
+def ensure_st2reactor():
+    """Register minimal Sensor and PollingSensor base classes in place of
+       st2, when it is not installed
+    """
+    try:
+        import st2reactor.sensor.base  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class Sensor(object):
+        def __init__(self, sensor_service, config=None):
+            self._sensor_service = sensor_service
+            self.sensor_service = sensor_service
+            self._config = config or {}
+
+    class PollingSensor(Sensor):
+        def __init__(self, sensor_service, config=None, poll_interval=5):
+            super(PollingSensor, self).__init__(sensor_service=sensor_service, config=config)
+            self._poll_interval = poll_interval
+
+        def get_poll_interval(self):
+            return self._poll_interval
+
+        def set_poll_interval(self, poll_interval):
+            self._poll_interval = poll_interval
+
+    base = types.ModuleType("st2reactor.sensor.base")
+    base.Sensor = Sensor
+    base.PollingSensor = PollingSensor
+    for name in ("st2reactor", "st2reactor.sensor"):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules["st2reactor.sensor.base"] = base
@@ -0,0 +1,104 @@
+"""Record RIPE Atlas stream messages and latest results to gzipped NDJSON,
+for replaying them offline with benchmarks/replay.py.
+
+    python benchmarks/recorder.py stream --msm 5001 --probestatus --seconds 600 -o atlas.ndjson.gz
+    python benchmarks/recorder.py latest --msm 14682099 --polls 4 --every 900 -o polling.ndjson.gz
+
+Every line is a record {"channel": ..., "received": ..., "payload": ...};
+channel is atlas_result or atlas_probestatus for stream messages, and
+latest for the results of an AtlasLatestRequest, which also carry msm_id.
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+
+RESULT_CHANNEL = "atlas_result"
+PROBESTATUS_CHANNEL = "atlas_probestatus"
+LATEST_CHANNEL = "latest"
+
+
+class Recorder(object):
+
+    def __init__(self, path):
+        self._file = gzip.open(path, "wt")
+        self.count = 0
+
+    def record(self, channel, payload, **fields):
+        record = dict(fields, channel=channel, received=time.time(), payload=payload)
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_recording(path):
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_stream(args, recorder):
+    from ripe.atlas.cousteau import AtlasStream
+
+    stream = AtlasStream()
+    stream.connect()
+    stream.bind_channel(RESULT_CHANNEL, lambda payload: recorder.record(RESULT_CHANNEL, payload))
+    stream.bind_channel(PROBESTATUS_CHANNEL, lambda payload: recorder.record(PROBESTATUS_CHANNEL, payload))
+    for msm_id in args.msm:
+        stream.start_stream(stream_type="result", msm=msm_id)
+    if args.probestatus:
+        stream.start_stream(stream_type="probestatus", enrichProbes=True)
+    try:
+        stream.timeout(seconds=args.seconds)
+    finally:
+        stream.disconnect()
+
+
+def record_latest(args, recorder):
+    from ripe.atlas.cousteau import AtlasLatestRequest, Measurement
+
+    for number in range(args.polls):
+        for msm_id in args.msm:
+            is_success, results = AtlasLatestRequest(msm_id=msm_id).create()
+            if not is_success:
+                print("latest results of measurement {} failed: {}".format(msm_id, results), file=sys.stderr)
+                continue
+            interval = Measurement(id=msm_id).interval if number == 0 else None
+            recorder.record(LATEST_CHANNEL, results, msm_id=msm_id, interval=interval)
+        if number + 1 < args.polls:
+            time.sleep(args.every)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=("stream", "latest"))
+    parser.add_argument("--msm", type=int, action="append", default=[], help="measurement id, repeatable")
+    parser.add_argument("--probestatus", action="store_true", help="also record the probe status stream")
+    parser.add_argument("--seconds", type=float, default=600, help="how long to record the stream")
+    parser.add_argument("--polls", type=int, default=2, help="how many latest results to record")
+    parser.add_argument("--every", type=float, default=900, help="seconds between two latest results")
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    with Recorder(args.output) as recorder:
+        if args.mode == "stream":
+            record_stream(args, recorder)
+        else:
+            record_latest(args, recorder)
+    print("recorded {} messages to {}".format(recorder.count, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""Replay recorded or synthetic RIPE Atlas traffic through the sensors of the
+pack, offline, and report their throughput, latency and memory.
+
+    python benchmarks/replay.py ping --recording atlas.ndjson.gz --speed realtime
+    python benchmarks/replay.py disco --synthetic 1000000 --probes 100000
+    python benchmarks/replay.py polling --synthetic 4 --probes 10000
+
+Recordings are made by benchmarks/recorder.py. The sensors run against the
+in memory FakeSensorService: every dispatch is counted, nothing is sent. The
+messages are processed in the replaying thread, latencies are the time spent
+in process_message, or in a whole poll of a measurement for polling.
+
+When st2 is not installed, minimal Sensor and PollingSensor base classes are
+registered in its place, so the sensors can be run from a plain checkout.
+"""
+import argparse
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "sensors"))
+
+from fake_sensor_service import FakeSensorService, ensure_st2reactor  # noqa: E402
+from recorder import LATEST_CHANNEL, PROBESTATUS_CHANNEL, RESULT_CHANNEL, read_recording  # noqa: E402
+from synthetic import ping_results, probe_rows, probe_status_events, traceroute_rounds  # noqa: E402
+
+
+class Replay(object):
+    """Feeds records to a handler at their recorded pace, or as fast as
+       possible, and measures the handler
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.latencies = []
+        self.messages = 0
+        self.elapsed = 0
+
+    def run(self, records, handle, count=None):
+        """Call `handle` with the payload of every record; `count`, if given,
+           is called with the payload for the number of messages it holds
+        """
+        first_received = None
+        started = time.time()
+        perf_counter = time.perf_counter
+        for record in records:
+            if self.realtime:
+                if first_received is None:
+                    first_received = record["received"]
+                delay = record["received"] - first_received - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            payload = record["payload"]
+            before = perf_counter()
+            handle(payload)
+            self.latencies.append(perf_counter() - before)
+            self.messages += count(payload) if count else 1
+        self.elapsed = time.time() - started
+
+    def report(self, service, unit="message"):
+        latencies = np.array(self.latencies or [0.0]) * 1000
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        busy = float(np.sum(latencies)) / 1000
+        lines = [
+            "messages:        {}".format(self.messages),
+            "elapsed:         {:.2f}s".format(self.elapsed),
+            "throughput:      {:.0f} msgs/s ({:.0f} msgs/s busy)".format(
+                self.messages / self.elapsed if self.elapsed else 0, self.messages / busy if busy else 0),
+            "latency/{}: p50 {:.3f}ms p95 {:.3f}ms p99 {:.3f}ms".format(unit, p50, p95, p99),
+            # kilobytes on Linux
+            "peak RSS:        {:.1f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0),
+            "dispatches:      {}".format(sum(service.dispatch_counts.values())),
+        ]
+        lines.extend("  {}: {}".format(trigger, number) for trigger, number in sorted(service.dispatch_counts.items()))
+        return "\n".join(lines)
+
+
+def _records(channel, payloads, key="timestamp"):
+    for payload in payloads:
+        yield {"channel": channel, "received": payload[key], "payload": payload}
+
+
+def _recorded(path, channel):
+    return (record for record in read_recording(path) if record["channel"] == channel)
+
+
+def replay_ping(args, service, replay):
+    from ping_streaming_sensor import PERCENTILE_TRIGGER, PingStreamingSensor
+
+    if args.recording:
+        msm_ids = sorted(set(record["payload"].get("msm_id") for record in _recorded(args.recording, RESULT_CHANNEL)))
+        records = _recorded(args.recording, RESULT_CHANNEL)
+    else:
+        msm_ids = list(range(5001, 5001 + args.measurements))
+        records = _records(RESULT_CHANNEL, ping_results(msm_ids, args.probes, args.synthetic, seed=args.seed))
+
+    sensor = PingStreamingSensor(service, {"percentile_window": args.window})
+    sensor.setup()
+    for msm_id in msm_ids:
+        sensor.add_trigger({"id": "replay-{}".format(msm_id), "ref": PERCENTILE_TRIGGER,
+                            "parameters": {"msm_id": msm_id, "target_rtt": args.target_rtt}})
+    replay.run(records, sensor.process_message)
+    sensor.cleanup()
+    return sensor
+
+
+def replay_disco(args, service, replay):
+    from probe_fleet import ProbeFleet
+    from probes_disco_sensor import ProbesDiscoSensor
+
+    rows = probe_rows(args.probes, seed=args.seed)
+    if args.recording:
+        records = _recorded(args.recording, PROBESTATUS_CHANNEL)
+    else:
+        records = _records(PROBESTATUS_CHANNEL, probe_status_events(rows, args.synthetic, seed=args.seed))
+
+    sensor = ProbesDiscoSensor(service, {"cache_dir": args.cache_dir})
+    sensor.setup()
+    # a recording starts from the synthetic fleet too, its probes are added
+    # by their first status event
+    sensor._fleet = ProbeFleet.from_rows(rows, dimensions=sensor._dimensions)
+    coalescer = sensor._coalescer
+
+    def handle(message):
+        sensor.process_message(message)
+        # the flusher thread of the sensor is not running
+        if replay.realtime:
+            coalescer.flush()
+
+    replay.run(records, handle)
+    coalescer.flush(force=True)
+    sensor.cleanup()
+    return sensor
+
+
+class ReplayFetcher(object):
+    """MeasurementFetcher answering every request with the next recorded
+       results of the measurement, and with ongoing measurements of the
+       given intervals
+    """
+
+    def __init__(self, intervals):
+        self.pending = {}
+        self.intervals = intervals
+
+    def measurement(self, msm_id):
+        return True, {"id": msm_id, "interval": self.intervals[msm_id], "type": "traceroute",
+                      "status": {"id": 2, "name": "Ongoing"}}
+
+    def latest(self, msm_id, probe_ids=None):
+        return True, self.pending.pop(msm_id, [])
+
+    def results_since(self, msm_id, start, probe_ids=None):
+        return self.latest(msm_id, probe_ids)
+
+    def close(self):
+        pass
+
+
+def replay_polling(args, service, replay):
+    from ripe_atlas_polling import RIPEAtlasPolling
+
+    if args.recording:
+        records = list(_recorded(args.recording, LATEST_CHANNEL))
+        intervals = dict((record["msm_id"], record["interval"]) for record in records if record.get("interval"))
+    else:
+        records = []
+        for batch in traceroute_rounds(args.probes, rounds=args.synthetic, interval=args.interval, seed=args.seed):
+            records.append({"channel": LATEST_CHANNEL, "received": batch[0]["timestamp"], "msm_id": 5001,
+                            "payload": batch})
+        intervals = {5001: args.interval}
+    msm_ids = sorted(set(record["msm_id"] for record in records))
+
+    sensor = RIPEAtlasPolling(service, {"measurements": [{"measurement_id": msm_id} for msm_id in msm_ids],
+                                        "cache_dir": args.cache_dir})
+    sensor.setup()
+    fetcher = sensor._fetcher = ReplayFetcher(dict((msm_id, intervals.get(msm_id, args.interval))
+                                                   for msm_id in msm_ids))
+    watches = dict((watch.id, watch) for watch in sensor._watches)
+    for msm_id in watches:
+        # replace the meta data cached by a previous replay
+        sensor._measurements.refresh(msm_id)
+
+    def poll(record):
+        fetcher.pending[record["msm_id"]] = record["payload"]
+        sensor._poll_measurement(watches[record["msm_id"]])
+
+    # the handler needs the measurement id of the record, not only its payload
+    replay.run(({"received": record["received"], "payload": record} for record in records), poll,
+               count=lambda record: len(record["payload"]))
+    sensor.cleanup()
+    return sensor
+
+
+SENSORS = {
+    "ping": replay_ping,
+    "disco": replay_disco,
+    "polling": replay_polling,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sensor", choices=sorted(SENSORS))
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--recording", help="gzipped NDJSON file of benchmarks/recorder.py")
+    source.add_argument("--synthetic", type=int,
+                        help="number of synthetic messages, or of polls for the polling sensor")
+    parser.add_argument("--speed", choices=("max", "realtime"), default="max")
+    parser.add_argument("--probes", type=int, default=10000, help="probes of the synthetic data")
+    parser.add_argument("--measurements", type=int, default=10, help="measurements of the synthetic ping results")
+    parser.add_argument("--interval", type=int, default=900, help="interval of the synthetic traceroutes")
+    parser.add_argument("--window", type=int, default=300, help="percentile window of the ping sensor")
+    parser.add_argument("--target-rtt", type=float, default=100.0, help="target rtt of the ping triggers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the sensor")
+    parser.add_argument("--metrics", action="store_true", help="print the stage metrics of the sensor")
+    args = parser.parse_args()
+
+    ensure_st2reactor()
+    service = FakeSensorService(log_level=logging.INFO if args.verbose else logging.WARNING)
+    replay = Replay(realtime=args.speed == "realtime")
+    args.cache_dir = tempfile.mkdtemp(prefix="atlas-replay-")
+    try:
+        sensor = SENSORS[args.sensor](args, service, replay)
+    finally:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+    print(replay.report(service, unit="poll" if args.sensor == "polling" else "message"))
+    if args.metrics:
+        print(sensor._metrics.render())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Synthetic RIPE Atlas data for the benchmarks, shaped like the API output"""
+import random
+
+
+def traceroute_result(prb_id, timestamp, dst_addr="193.0.6.139", hops=8, attempts=3,
+                      base_rtt=10.0, unreachable=False, rng=random):
+    """A traceroute result of a probe, with `hops` hops of `attempts` packets.
+       The last hop answers from `dst_addr`, unless the target was not reached.
+    """
+    result = []
+    for hop in range(1, hops + 1):
+        last_hop = hop == hops
+        address = dst_addr if last_hop else "10.{}.{}.1".format(prb_id % 250, hop)
+        hop_attempts = []
+        for _ in range(attempts):
+            if last_hop and unreachable:
+                hop_attempts.append({"x": "*"})
+            else:
+                hop_attempts.append({"from": address, "rtt": round(base_rtt * hop / hops + rng.random(), 3),
+                                     "size": 68, "ttl": 64 - hop})
+        result.append({"hop": hop, "result": hop_attempts})
+    return {"prb_id": prb_id, "msm_id": 5001, "type": "traceroute", "af": 4,
+            "dst_addr": dst_addr, "timestamp": timestamp, "stored_timestamp": timestamp + 5,
+            "result": result}
+
+
+def traceroute_rounds(probe_count, rounds=2, interval=900, start=1500000000,
+                      change_ratio=0.05, seed=0):
+    """`rounds` batches of latest results for `probe_count` probes, a
+       `change_ratio` of the probes changing path length, reachability or
+       rtt from one round to the next.
+    """
+    rng = random.Random(seed)
+    state = dict((prb_id, {"hops": rng.randint(5, 15), "base_rtt": rng.uniform(5, 200), "unreachable": False})
+                 for prb_id in range(1, probe_count + 1))
+    batches = []
+    for number in range(rounds):
+        timestamp = start + number * interval
+        batch = []
+        for prb_id, probe in state.items():
+            if number and rng.random() < change_ratio:
+                change = rng.randint(0, 2)
+                if change == 0:
+                    probe["hops"] += rng.choice((-1, 1)) if probe["hops"] > 2 else 1
+                elif change == 1:
+                    probe["unreachable"] = not probe["unreachable"]
+                else:
+                    probe["base_rtt"] *= rng.choice((0.5, 2.0))
+            batch.append(traceroute_result(prb_id, timestamp + rng.randint(0, 60), hops=probe["hops"],
+                                           base_rtt=probe["base_rtt"], unreachable=probe["unreachable"],
+                                           rng=rng))
+        batches.append(batch)
+    return batches
+
+
+def probe_rows(probe_count, asn_count=None, seed=0):
+    """`probe_count` rows shaped like the probes/all API, spread over
+       `asn_count` ASes, most of them connected
+    """
+    rng = random.Random(seed)
+    asn_count = asn_count or max(1, probe_count // 10)
+    countries = ["C{}".format(number) for number in range(200)]
+    rows = []
+    for prb_id in range(1, probe_count + 1):
+        asn_v4 = rng.randint(1, asn_count)
+        asn_v6 = asn_v4 if rng.random() < 0.4 else 0
+        status = 1 if rng.random() < 0.8 else rng.choice((2, 2, 3, 4))
+        rows.append([prb_id, asn_v4, asn_v6, rng.choice(countries), int(rng.random() < 0.01), 1,
+                     rng.uniform(-90, 90), rng.uniform(-180, 180),
+                     "10.{}.{}.0/24".format(prb_id // 256 % 256, prb_id % 256),
+                     "2001:db8:{:x}::/48".format(prb_id) if asn_v6 else 0, 0, 0,
+                     status, 1500000000])
+    return rows
+
+
+def probe_status_events(rows, event_count, seed=0):
+    """`event_count` probestatus stream events of the probes of `rows`"""
+    rng = random.Random(seed)
+    for number in range(event_count):
+        row = rows[rng.randrange(len(rows))]
+        yield {"prb_id": row[0], "event": rng.choice(("connect", "disconnect")),
+               "timestamp": 1500000000 + number, "type": "connection",
+               "probe": {"asn_v4": row[1] or None, "asn_v6": row[2] or None,
+                         "country_code": row[3], "is_anchor": bool(row[4]),
+                         "prefix_v4": row[8] or None, "prefix_v6": row[9] or None}}
+
+
+def ping_results(msm_ids, probe_count, result_count, packets=3, interval=240, start=1500000000,
+                 spike_ratio=0.01, seed=0):
+    """`result_count` ping results of the streams of `msm_ids`, from
+       `probe_count` probes per measurement, in timestamp order; a
+       `spike_ratio` of them see their rtt multiplied by ten.
+    """
+    rng = random.Random(seed)
+    base_rtts = dict(((msm_id, prb_id), rng.uniform(5, 200))
+                     for msm_id in msm_ids for prb_id in range(1, probe_count + 1))
+    # results of a round are spread over the interval of the measurement
+    per_second = max(1, len(base_rtts) // interval)
+    for number in range(result_count):
+        msm_id = msm_ids[rng.randrange(len(msm_ids))]
+        prb_id = rng.randint(1, probe_count)
+        base_rtt = base_rtts[(msm_id, prb_id)] * (10 if rng.random() < spike_ratio else 1)
+        timestamp = start + number // per_second
+        yield {"prb_id": prb_id, "msm_id": msm_id, "type": "ping", "af": 4,
+               "dst_addr": "193.0.6.139", "timestamp": timestamp, "stored_timestamp": timestamp + 2,
+               "sent": packets, "rcvd": packets,
+               "result": [{"rtt": round(base_rtt + rng.random(), 3)} for _ in range(packets)]}
@@ -0,0 +1,49 @@
+import time
+
+from collections import deque
+
+
+class DisconnectWindow(object):
+    """The probes of a group that disconnected in the last `window` seconds.
+
+       Disconnections are queued in time order, so expiring them only pops
+       from the left; a connect removes the probe from the live set and
+       leaves its queued entry to be skipped when it expires. Every event is
+       amortized O(1) and the count is the size of the live set.
+    """
+
+    def __init__(self, window=1800, clock=time.monotonic):
+        self.window = window
+        self._clock = clock
+        self._queue = deque()
+        # time of the latest disconnection of every probe in the window
+        self._disconnected = {}
+
+    def __len__(self):
+        self.expire()
+        return len(self._disconnected)
+
+    def __contains__(self, prb_id):
+        self.expire()
+        return prb_id in self._disconnected
+
+    def __repr__(self):
+        return "DisconnectWindow({})".format(sorted(self._disconnected))
+
+    def disconnect(self, prb_id):
+        now = self._clock()
+        self._disconnected[prb_id] = now
+        self._queue.append((now, prb_id))
+        self.expire(now)
+
+    def connect(self, prb_id):
+        self._disconnected.pop(prb_id, None)
+        self.expire()
+
+    def expire(self, now=None):
+        deadline = (self._clock() if now is None else now) - self.window
+        queue, disconnected = self._queue, self._disconnected
+        while queue and queue[0][0] < deadline:
+            disconnected_at, prb_id = queue.popleft()
+            if disconnected.get(prb_id) == disconnected_at:
+                del disconnected[prb_id]
@@ -0,0 +1,144 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class GroupSummary(object):
+    """What happened to a group during a coalescing window"""
+
+    def __init__(self, dimension, key, started_at):
+        self.dimension = dimension
+        self.key = key
+        self.started_at = started_at
+        # message of every event, in the order they first happened
+        self.events = OrderedDict()
+        # ordered set of the probes of the events
+        self.probe_ids = OrderedDict()
+        self.before = None
+        self.after = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def add(self, name, text, prb_id, before, after, timestamp):
+        self.events.setdefault(name, text)
+        self.probe_ids[prb_id] = None
+        if self.first_timestamp is None:
+            self.before = before
+            self.first_timestamp = timestamp
+        self.after = after
+        self.last_timestamp = timestamp
+
+    def trace_tag(self):
+        return "{}-{}-{}-{}".format(self.dimension, self.key, "+".join(self.events), self.first_timestamp)
+
+    def payload(self):
+        event = "{} ({} probes".format("; ".join(self.events.values()), len(self.probe_ids))
+        if self.before is not None or self.after is not None:
+            event += ", {} -> {}".format(_percentage(self.before), _percentage(self.after))
+        return {
+            "event": event + ")",
+            "dimension": self.dimension,
+            "group": self.key,
+            "events": list(self.events),
+            "probe_ids": list(self.probe_ids),
+            "before": self.before,
+            "after": self.after,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+        }
+
+
+def _percentage(value):
+    return "{:.1f}%".format(value) if value is not None else "n/a"
+
+
+def merged_payload(summaries):
+    """Payload of the summaries flushed together: the summary of every
+       group in `groups`, and the events and probes of all of them
+    """
+    groups = [summary.payload() for summary in summaries]
+    events = OrderedDict()
+    probe_ids = OrderedDict()
+    for summary in summaries:
+        events.update(summary.events)
+        probe_ids.update(summary.probe_ids)
+    return {
+        "event": " | ".join(group["event"] for group in groups),
+        "events": list(events),
+        "probe_ids": list(probe_ids),
+        "first_timestamp": min(summary.first_timestamp for summary in summaries),
+        "last_timestamp": max(summary.last_timestamp for summary in summaries),
+        "groups": groups,
+    }
+
+
+def merged_trace_tag(summaries):
+    if len(summaries) == 1:
+        return summaries[0].trace_tag()
+    return "{}-and-{}-more".format(summaries[0].trace_tag(), len(summaries) - 1)
+
+
+class DispatchCoalescer(object):
+    """Gathers the events of every group over `window` seconds and
+       dispatches the summaries of the groups whose window is over together,
+       once per flush, so an outage in one AS is a single dispatch whatever
+       the number of probe events and of groups it changed.
+
+       Duplicate trace tags, of the incoming events or of the summaries,
+       are dropped; the last `max_trace_tags` tags are remembered.
+    """
+
+    def __init__(self, dispatch, window=30, max_trace_tags=100000, clock=time.time):
+        self._dispatch = dispatch
+        self.window = window
+        self._max_trace_tags = max_trace_tags
+        self._clock = clock
+        self._summaries = OrderedDict()
+        self._trace_tags = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def _seen(self, trace_tag):
+        if trace_tag in self._trace_tags:
+            self.duplicates += 1
+            return True
+        self._trace_tags[trace_tag] = None
+        if len(self._trace_tags) > self._max_trace_tags:
+            self._trace_tags.popitem(last=False)
+        return False
+
+    def add(self, dimension, key, name, text, prb_id, before, after, timestamp, trace_tag=None):
+        """Add an event of a group; returns False if it was a duplicate"""
+        with self._lock:
+            if trace_tag is not None and self._seen(trace_tag):
+                return False
+            summary = self._summaries.get((dimension, key))
+            if summary is None:
+                summary = self._summaries[(dimension, key)] = GroupSummary(dimension, key, self._clock())
+            summary.add(name, text, prb_id, before, after, timestamp)
+        if not self.window:
+            self.flush()
+        return True
+
+    def flush(self, force=False):
+        """Dispatch the summaries whose window is over, all of them if forced,
+           in a single dispatch. Returns how many summaries were dispatched.
+        """
+        deadline = self._clock() - self.window
+        ready = []
+        with self._lock:
+            # summaries are ordered by the start of their window
+            while self._summaries:
+                group, summary = next(iter(self._summaries.items()))
+                if not force and summary.started_at > deadline:
+                    break
+                del self._summaries[group]
+                if not self._seen(summary.trace_tag()):
+                    ready.append(summary)
+        if ready:
+            self._dispatch(merged_payload(ready), merged_trace_tag(ready))
+        return len(ready)
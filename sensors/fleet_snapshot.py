@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+from probe_fleet import ProbeFleet
+
+META_FILE = "meta.json"
+# layout of the columns and sidecar, a snapshot of another version is ignored
+SNAPSHOT_VERSION = 1
+
+
+class FleetSnapshot(object):
+    """Local copy of a ProbeFleet: one .npy file per column, loaded memory
+       mapped copy-on-write, and a JSON sidecar with the group keys, the time
+       of the download and the validators for a conditional refresh.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.timestamp = None
+        self.etag = None
+        self.last_modified = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """The snapshot fleet, None if there is no usable snapshot"""
+        import numpy as np
+
+        try:
+            with open(self._path(META_FILE)) as f:
+                meta = json.load(f)
+            if meta.get("version") != SNAPSHOT_VERSION:
+                return None
+            status = np.load(self._path("status.npy"), mmap_mode="c")
+            group_codes = dict((dimension, np.load(self._path("{}.npy".format(dimension)), mmap_mode="c"))
+                               for dimension in meta["group_keys"])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if any(len(codes) != len(status) for codes in group_codes.values()) or len(status) != meta["size"]:
+            return None
+        self.timestamp = meta["timestamp"]
+        self.etag = meta.get("etag")
+        self.last_modified = meta.get("last_modified")
+        return ProbeFleet.from_columns(status, group_codes, meta["group_keys"])
+
+    def save(self, fleet, etag=None, last_modified=None, timestamp=None):
+        import numpy as np
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        columns = [("status", fleet.status)] + [(dimension, fleet.group_codes[dimension])
+                                                for dimension in fleet.dimensions]
+        for name, column in columns:
+            path = self._path("{}.npy".format(name))
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(column))
+            os.rename(path + ".tmp", path)
+        self.timestamp = timestamp or int(time.time())
+        self.etag = etag
+        self.last_modified = last_modified
+        meta = {
+            "version": SNAPSHOT_VERSION,
+            "timestamp": self.timestamp,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": len(fleet.status),
+            "group_keys": dict((dimension, fleet.groups[dimension].keys) for dimension in fleet.dimensions),
+        }
+        # the sidecar goes last: a snapshot whose columns and sidecar do
+        # not match in size is ignored
+        with open(self._path(META_FILE + ".tmp"), "w") as f:
+            json.dump(meta, f)
+        os.rename(self._path(META_FILE + ".tmp"), self._path(META_FILE))
+
+    def touch(self):
+        """Mark the snapshot as fresh after a not modified answer"""
+        self.timestamp = int(time.time())
+        path = self._path(META_FILE)
+        with open(path) as f:
+            meta = json.load(f)
+        meta["timestamp"] = self.timestamp
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.rename(path + ".tmp", path)
+
+    def headers(self):
+        """Headers of a conditional request for a newer fleet"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
@@ -0,0 +1,52 @@
+import codecs
+import json
+
+# actions/lib/result_stream.py has a copy of this parser for the actions,
+# which cannot import the sensor modules: keep both in sync.
+
+WHITESPACE = " \t\n\r"
+
+
+def iter_array_items(chunks, key, encoding="utf-8"):
+    """Items of the array `key` of a JSON document, parsed as the chunks of
+       its body come in instead of once the whole body is loaded.
+
+       The array is located by the first occurrence of its quoted key, and
+       its items must be arrays or objects: an item is only yielded once
+       its closing bracket was received. Raises ValueError if the chunks end
+       before the array does.
+    """
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder(encoding)().decode
+    quoted_key = json.dumps(key)
+    buffer = ""
+    position = None
+    for chunk in chunks:
+        if position is None:
+            buffer += decode(chunk)
+            start = buffer.find(quoted_key)
+            start = buffer.find("[", start + len(quoted_key)) if start != -1 else -1
+            if start == -1:
+                # keep enough to find a key split across two chunks
+                buffer = buffer[-len(quoted_key) - 64:]
+                continue
+            position = start + 1
+        else:
+            buffer = buffer[position:] + decode(chunk)
+            position = 0
+        length = len(buffer)
+        while True:
+            while position < length and (buffer[position] in WHITESPACE or buffer[position] == ","):
+                position += 1
+            if position == length:
+                break
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # the item is not complete yet
+                break
+            yield item
+            position = end
+    raise ValueError("The body ended before the end of its {} array".format(quoted_key))
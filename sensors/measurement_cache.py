@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+
+# how long, in seconds, the meta data of a measurement is used before it is
+# fetched again
+DEFAULT_MEASUREMENT_CACHE_TTL = 3600
+
+CACHE_FILE = "measurements.json"
+
+# options of the meta data of a measurement that define it, copied to
+# create it again
+DEFINITION_FIELDS = ("af", "target", "description", "interval", "is_public", "resolve_on_probe",
+                     "packets", "size", "protocol", "paris", "first_hop", "max_hops", "port",
+                     "dont_fragment", "response_timeout", "duplicate_timeout", "skip_dns_check")
+
+
+class MeasurementInfo(object):
+    """What the sensors keep of the meta data of a measurement"""
+
+    __slots__ = ("id", "interval", "status", "status_id", "type", "probes", "definition",
+                 "fetched_at", "replaced_by")
+
+    def __init__(self, id, interval=None, status=None, status_id=None, type=None, probes=None,
+                 definition=None, fetched_at=0, replaced_by=None):
+        self.id = id
+        self.interval = interval
+        self.status = status
+        self.status_id = status_id
+        self.type = type
+        # ids of the participant probes, None when unknown
+        self.probes = probes
+        self.definition = definition or {}
+        self.fetched_at = fetched_at
+        # id of the measurement created again in place of this one
+        self.replaced_by = replaced_by
+
+    @classmethod
+    def from_meta_data(cls, meta_data, fetched_at=None):
+        """Info of the meta data of the measurements API"""
+        status = meta_data.get("status") or {}
+        measurement_type = meta_data.get("type")
+        if isinstance(measurement_type, dict):
+            measurement_type = measurement_type.get("name")
+        probes = meta_data.get("probes")
+        return cls(id=meta_data["id"],
+                   interval=meta_data.get("interval"),
+                   status=status.get("name"),
+                   status_id=status.get("id"),
+                   type=measurement_type.lower() if measurement_type else None,
+                   probes=[probe["id"] for probe in probes] if probes is not None else None,
+                   definition=dict((field, meta_data[field]) for field in DEFINITION_FIELDS
+                                   if meta_data.get(field) is not None),
+                   fetched_at=fetched_at or int(time.time()))
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __repr__(self):
+        return "MeasurementInfo(id={}, interval={}, status={}, type={})".format(
+            self.id, self.interval, self.status, self.type)
+
+
+class MeasurementCache(object):
+    """Meta data of the measurements: interval, status, type and participant
+       probes, shared by the workers of a sensor and kept in a local JSON
+       file, so a restarted sensor polls without fetching it again.
+
+       Lookups never call the API. An entry older than `ttl` is still
+       returned, and is listed by `stale` for its owner to refresh it in the
+       background; `refresh` is the only call fetching, through `fetch`,
+       which takes a measurement id and returns the (is_success, meta data)
+       of cousteau requests.
+    """
+
+    def __init__(self, path, fetch, ttl=DEFAULT_MEASUREMENT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._fetch = fetch
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        # refreshes run concurrently, their saves are written one at a time
+        self._save_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """Reload the entries saved by a previous run; returns how many"""
+        try:
+            with open(self.path) as f:
+                entries = [MeasurementInfo(**entry) for entry in json.load(f)]
+        except (IOError, OSError, ValueError, TypeError):
+            return 0
+        with self._lock:
+            self._entries.update((entry.id, entry) for entry in entries)
+        return len(entries)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._save_lock:
+            with self._lock:
+                entries = [entry.to_dict() for entry in self._entries.values()]
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(entries, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def get(self, msm_id):
+        """The cached info of a measurement, however old, None if it was never fetched"""
+        return self._entries.get(msm_id)
+
+    def resolve(self, msm_id):
+        """The id of the measurement created in place of `msm_id`, or of the
+           ones created in place of that one, `msm_id` if there is none
+        """
+        seen = set()
+        entry = self._entries.get(msm_id)
+        while entry is not None and entry.replaced_by is not None and entry.id not in seen:
+            seen.add(entry.id)
+            msm_id = entry.replaced_by
+            entry = self._entries.get(msm_id)
+        return msm_id
+
+    def stale(self, msm_ids, now=None):
+        """The measurements of `msm_ids` whose info is older than the ttl and
+           not already being refreshed; they are marked as being refreshed
+           until their `refresh` is done
+        """
+        deadline = (now or time.time()) - self.ttl
+        with self._lock:
+            stale = [msm_id for msm_id in msm_ids
+                     if msm_id not in self._refreshing and msm_id in self._entries and
+                     self._entries[msm_id].fetched_at <= deadline]
+            self._refreshing.update(stale)
+        return stale
+
+    def refresh(self, msm_id):
+        """Fetch the meta data of a measurement. Returns (True, info), or
+           (False, error) keeping the previous info if there was one.
+        """
+        try:
+            is_success, meta_data = self._fetch(msm_id)
+            if not is_success:
+                return is_success, meta_data
+            info = MeasurementInfo.from_meta_data(meta_data)
+            with self._lock:
+                previous = self._entries.get(msm_id)
+                info.replaced_by = previous.replaced_by if previous else None
+                self._entries[msm_id] = info
+            self.save()
+            return is_success, info
+        finally:
+            with self._lock:
+                self._refreshing.discard(msm_id)
+
+    def replace(self, msm_id, new_msm_id):
+        """Record that `new_msm_id` was created in place of `msm_id`"""
+        with self._lock:
+            entry = self._entries.get(msm_id)
+            if entry is None:
+                entry = self._entries[msm_id] = MeasurementInfo(msm_id)
+            entry.replaced_by = new_msm_id
+        self.save()
@@ -0,0 +1,55 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+from ripe.atlas.cousteau import (AtlasCreateRequest, AtlasLatestRequest, AtlasMeasurement, AtlasRequest,
+                                  AtlasResultsRequest, AtlasSource, Measurement)
+
+
+class MeasurementFetcher(object):
+    """Runs RIPE Atlas measurement requests over one keep-alive HTTP session.
+
+       The session is shared by every worker thread of the polling sensor,
+       so its connection pool is sized to the number of workers. Results
+       keep the ``(is_success, results)`` convention of cousteau requests.
+    """
+
+    def __init__(self, pool_size=10, timeout=30):
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+
+    def latest(self, msm_id, probe_ids=None):
+        return self._create(AtlasLatestRequest(msm_id=msm_id, probe_ids=probe_ids))
+
+    def results_since(self, msm_id, start, probe_ids=None):
+        """Results of the measurement with a timestamp not older than `start`"""
+        return self._create(AtlasResultsRequest(msm_id=msm_id, start=start, probe_ids=probe_ids))
+
+    def measurement(self, msm_id):
+        """Meta data of the measurement, with its participant probes"""
+        request = AtlasRequest(url_path=Measurement.API_META_URL.format(msm_id))
+        return self._route(request).get(optional_fields="probes")
+
+    def create_measurement(self, key, definition, probe_ids):
+        """Create a measurement of `definition`, the options of an
+           AtlasMeasurement with its type, run by the given probes
+        """
+        source = AtlasSource(type="probes", value=",".join(str(prb_id) for prb_id in probe_ids),
+                             requested=len(probe_ids))
+        return self._create(AtlasCreateRequest(key=key, measurements=[AtlasMeasurement(**definition)],
+                                               sources=[source]))
+
+    def _create(self, request):
+        return self._route(request).create()
+
+    def _route(self, request):
+        # cousteau calls the module level requests.get() by default, which
+        # opens a new connection for every request; route it through the
+        # pooled session instead and bound the time spent on a single call
+        request.http_methods = {"GET": self._session.get, "POST": self._session.post}
+        request.http_method_args["timeout"] = self._timeout
+        return request
+
+    def close(self):
+        self._session.close()
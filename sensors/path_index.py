@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+# code of a hop without any answer, as in AddressTable
+NO_ADDRESS = -1
+
+
+class PathIndex(object):
+    """Paths of the probes of a measurement and, inverted, the probes whose
+       path goes through every hop address.
+
+       A path is the tuple of the address codes answering at every hop. Paths
+       are interned: every probe only keeps the id of its path, so comparing
+       paths is comparing ids, and the tuples shared by many probes are
+       stored once and dropped with their last probe.
+    """
+
+    def __init__(self):
+        self._path_ids = {}
+        self._paths = []
+        self._refcounts = []
+        self._free_ids = []
+        # path id of every probe, and probes of every hop address
+        self.probe_paths = {}
+        self.probes_by_address = defaultdict(set)
+
+    def __len__(self):
+        return len(self.probe_paths)
+
+    def intern(self, path):
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            if self._free_ids:
+                path_id = self._free_ids.pop()
+                self._paths[path_id] = path
+                self._refcounts[path_id] = 0
+            else:
+                path_id = len(self._paths)
+                self._paths.append(path)
+                self._refcounts.append(0)
+            self._path_ids[path] = path_id
+        return path_id
+
+    def path(self, path_id):
+        return self._paths[path_id]
+
+    def path_of(self, prb_id):
+        """The path of a probe, None if it has none"""
+        path_id = self.probe_paths.get(prb_id)
+        return self._paths[path_id] if path_id is not None else None
+
+    def update(self, prb_id, path):
+        """Set the path of a probe; returns the id of its previous path, None
+           if it had none, and the id of the new one
+        """
+        path_id = self.intern(path)
+        old_path_id = self.probe_paths.get(prb_id)
+        if old_path_id == path_id:
+            return old_path_id, path_id
+        if old_path_id is not None:
+            self._release(prb_id, old_path_id)
+        self.probe_paths[prb_id] = path_id
+        self._refcounts[path_id] += 1
+        for address in set(path):
+            if address != NO_ADDRESS:
+                self.probes_by_address[address].add(prb_id)
+        return old_path_id, path_id
+
+    def _release(self, prb_id, path_id):
+        path = self._paths[path_id]
+        for address in set(path):
+            probes = self.probes_by_address.get(address)
+            if probes is not None:
+                probes.discard(prb_id)
+                if not probes:
+                    del self.probes_by_address[address]
+        self._refcounts[path_id] -= 1
+        if not self._refcounts[path_id]:
+            del self._path_ids[path]
+            self._paths[path_id] = None
+            self._free_ids.append(path_id)
+
+    def probes_through(self, address):
+        return self.probes_by_address.get(address, ())
+
+
+def last_shared_hop(prefixes, min_probes, quorum=0.5):
+    """The deepest hop address shared by the responsive prefixes of the paths
+       of probes that lost their target, ie the hops they still reached
+       before the first unanswered one.
+
+       `prefixes` are (prb_id, address codes) pairs. An address is shared when
+       at least `min_probes` and a `quorum` of the probes reach it; of those,
+       the one with the greatest mean position is returned with the probes
+       reaching it, or None when no address is shared. Every hop of every
+       prefix is visited once.
+    """
+    probe_count = 0
+    counts = defaultdict(int)
+    positions = defaultdict(int)
+    probes = defaultdict(list)
+    for prb_id, prefix in prefixes:
+        probe_count += 1
+        seen = set()
+        for position, address in enumerate(prefix):
+            if address == NO_ADDRESS or address in seen:
+                continue
+            seen.add(address)
+            counts[address] += 1
+            positions[address] += position
+            probes[address].append(prb_id)
+    needed = max(min_probes, quorum * probe_count)
+    shared = [address for address, count in counts.items() if count >= needed]
+    if not shared:
+        return None
+    address = max(shared, key=lambda address: (positions[address] / float(counts[address]), counts[address]))
+    return address, positions[address] / float(counts[address]), probes[address]
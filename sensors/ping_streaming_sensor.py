@@ -1,95 +1,214 @@
-import numpy as np
+import threading
 
-from ripe.atlas.cousteau import (
-  AtlasStream,
-)
+from collections import defaultdict
 
-from st2reactor.sensor.base import Sensor
+from streaming_sensor import StreamingSensor
 
-# Sample ping probe id
-PING_PROBE_ID = 5001
 PERCENTILE_TRIGGER = "atlas.rtt_percentile_exceeded"
+
+# defaults of the trigger parameters
 PERCENTILE = 75
-TARGET_RTT_PERCENTILE = 50 
+TARGET_RTT_PERCENTILE = 50
 
 MIN_SAMPLE_COUNT = 10
 
+# percentiles reported with every trigger
+TRACKED_PERCENTILES = (50, 75, 95, 99)
+# sliding window, in seconds, the percentiles are computed over
+PERCENTILE_WINDOW = 300
+# relative error of the percentiles computed by the sketches
+SKETCH_RELATIVE_ACCURACY = 0.02
+
+
+class PercentileSubscription(object):
+    """The measurement, probes and thresholds a trigger asks the sensor to
+       watch, with the windowed sketches evaluated for it: one for the whole
+       measurement, key None, and one per probe, key prb_id.
+    """
+
+    def __init__(self, trigger, default_window=PERCENTILE_WINDOW):
+        parameters = trigger.get("parameters") or {}
+        self.trigger_ref = trigger["ref"]
+        self.msm_id = parameters["msm_id"]
+        probe_ids = parameters.get("probe_ids")
+        self.probe_ids = set(probe_ids) if probe_ids else None
+        self.percentile = parameters.get("percentile", PERCENTILE)
+        self.target_rtt = parameters.get("target_rtt", TARGET_RTT_PERCENTILE)
+        self.min_sample_count = parameters.get("min_sample_count", MIN_SAMPLE_COUNT)
+        self.window = parameters.get("window", default_window)
+        self.percentiles = sorted(set(TRACKED_PERCENTILES + (self.percentile,)))
+        self.sketches = {}
+        # keys whose percentile is above the target: they were reported when
+        # they crossed it, and are reported again only after dropping below
+        self.exceeded = set()
+
+    def watches(self, prb_id):
+        return self.probe_ids is None or prb_id in self.probe_ids
+
+    def carry_over(self, previous):
+        """Keep the sketches of `previous`, the subscription this one
+           replaces for the same measurement, unless the window changed, and
+           the keys it reported unless the threshold changed
+        """
+        if previous.window == self.window:
+            self.sketches = dict((key, sketch) for key, sketch in previous.sketches.items()
+                                 if key is None or self.watches(key))
+        if (previous.percentile, previous.target_rtt) == (self.percentile, self.target_rtt):
+            self.exceeded = set(key for key in previous.exceeded if key in self.sketches)
 
+    def sketch(self, key):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            # the sketches pull numpy in, it is imported with the first result
+            # instead of delaying the start of the sensor
+            from quantile_sketch import WindowedQuantileSketch
+            sketch = self.sketches[key] = WindowedQuantileSketch(
+                window=self.window, relative_accuracy=SKETCH_RELATIVE_ACCURACY)
+        return sketch
 
-class PingStreamingSensor(Sensor):
 
-    def __init__(self, sensor_service, config):
-        super(PingStreamingSensor, self).__init__(sensor_service=sensor_service, config=config)
-        self._logger = self.sensor_service.get_logger(name=self.__class__.__name__)
+class PingStreamingSensor(StreamingSensor):
 
-    def setup(self):
-        self.atlas_stream = AtlasStream()
+    channel = "atlas_result"
 
-    def on_result_response(self, *args):
+    def __init__(self, sensor_service, config):
+        super(PingStreamingSensor, self).__init__(sensor_service=sensor_service, config=config)
+        # PercentileSubscription of every trigger, by trigger id, and the ids
+        # of the triggers watching each measurement
+        self._subscriptions = {}
+        self._triggers_by_msm = defaultdict(set)
+        self._subscriptions_lock = threading.Lock()
+        # triggers may be added before setup is called
+        self._window = self._config.get("percentile_window", PERCENTILE_WINDOW)
+
+    def warm_up(self):
+        import quantile_sketch  # noqa: F401
+
+    def partition_key(self, message):
+        # the sketch of a measurement is shared by its probes
+        return message.get('msm_id')
+
+    def sequence_of(self, message):
+        # the results of a probe come in order, one per timestamp
+        return (message.get('msm_id'), message.get('prb_id')), message.get('timestamp', 0), None
+
+    def process_message(self, message):
         """
         Process the result from the Atlas Ping Probe
         """
-        self._logger.info("Received a probe response for measurement {}".format(PING_PROBE_ID))
-        
-        round_trip_times = self._get_round_trip_times(args)
-        if len(round_trip_times) < MIN_SAMPLE_COUNT:
-            self._logger.info("Not enough samples in this result, sample count = {}".format(len(round_trip_times)))
+        msm_id = message.get('msm_id')
+        prb_id = message.get('prb_id')
+        self._debug.debug("Received a probe response for measurement %s from probe %s", msm_id, prb_id)
+
+        with self._subscriptions_lock:
+            subscriptions = [self._subscriptions[trigger_id] for trigger_id in self._triggers_by_msm.get(msm_id, ())]
+        subscriptions = [subscription for subscription in subscriptions if subscription.watches(prb_id)]
+        if not subscriptions:
+            return
+
+        with self._metrics.timer("parse"):
+            round_trip_times = self._get_round_trip_times(message)
+        if not round_trip_times:
             return
 
-        percentile = self._rtt_percentile(round_trip_times)
-        if percentile > TARGET_RTT_PERCENTILE:
-            self._dispatch_exceed_rtt_trigger(percentile)
-        
-    def _get_round_trip_times(self, args):
+        # every result is added to the window of its measurement and of its
+        # probe, the percentiles are evaluated once a window has enough samples
+        for subscription in subscriptions:
+            for key in (None, prb_id):
+                sketch = subscription.sketch(key)
+                sketch.add(round_trip_times)
+                self._evaluate_window(subscription, key, sketch)
+
+    def _get_round_trip_times(self, message):
         round_trip_times = []
-        for result in args[0]['result']:
-            if 'result' in result.keys():
-                for probe_result in result['result']:
-                    try:
-                        round_trip_times.append(probe_result['rtt'])
-                    except KeyError:
-                         self._logger.info("No rtt data in this result")
+        for result in message['result']:
+            # ping results list the packets, traceroute results nest them in hops
+            for probe_result in result.get('result', [result]):
+                if 'rtt' in probe_result:
+                    round_trip_times.append(probe_result['rtt'])
         return round_trip_times
-        
-    def _rtt_percentile(self, round_trip_times):
-        self._logger.info("RTT samples: {}".format(round_trip_times))
-        rtt_array = np.array(round_trip_times)
-        percentile = np.percentile(rtt_array, PERCENTILE)
-        self._logger.info("RTT p{}: {}".format(PERCENTILE, percentile))
-        
-        return percentile
-        
-    def _dispatch_exceed_rtt_trigger(self, percentile):
-        self._logger.info("Target rtt p{} of {}s exceeded, rtt p{} = {}s".format(
-            PERCENTILE, TARGET_RTT_PERCENTILE, PERCENTILE, percentile))
+
+    def _evaluate_window(self, subscription, prb_id, sketch):
+        """Report the window when its percentile crosses the target rtt"""
+        sample_count, values = sketch.quantiles([p / 100.0 for p in subscription.percentiles])
+        if sample_count < subscription.min_sample_count:
+            self._debug.debug("Not enough samples in the window of measurement %s probe %s, sample count = %s",
+                              subscription.msm_id, prb_id, sample_count)
+            return
+
+        rtt_percentiles = dict(zip(subscription.percentiles, values))
+        if rtt_percentiles[subscription.percentile] <= subscription.target_rtt:
+            subscription.exceeded.discard(prb_id)
+        elif prb_id not in subscription.exceeded:
+            subscription.exceeded.add(prb_id)
+            self._dispatch_exceed_rtt_trigger(subscription, prb_id, rtt_percentiles, sample_count)
+
+    def _dispatch_exceed_rtt_trigger(self, subscription, prb_id, rtt_percentiles, sample_count):
+        percentile = rtt_percentiles[subscription.percentile]
+        self._debug.debug("Target rtt p%s of %sms exceeded for measurement %s probe %s, rtt p%s = %sms",
+                          subscription.percentile, subscription.target_rtt, subscription.msm_id, prb_id,
+                          subscription.percentile, percentile)
         payload = {
-            'percentile': PERCENTILE,
+            'percentile': subscription.percentile,
             'rtt': float(percentile),
+            'target_rtt': subscription.target_rtt,
+            'msm_id': subscription.msm_id,
+            'prb_id': prb_id,
+            'samples': sample_count,
+            'window': subscription.window,
+            'percentiles': dict(('p{}'.format(p), float(v)) for p, v in rtt_percentiles.items()),
         }
-        self._sensor_service.dispatch(trigger=PERCENTILE_TRIGGER, payload=payload)
-
-    def run(self):
-        stream_parameters = {"msm": 5001}
-        self.atlas_stream.connect()
-        channel = "atlas_result"
-        # Bind function we want to run with every result message received
-        self.atlas_stream.bind_channel(channel, self.on_result_response)
-        self.atlas_stream.start_stream(
-                stream_type="result", **stream_parameters)
-        self.atlas_stream.timeout()
+        with self._metrics.timer("dispatch"):
+            self._sensor_service.dispatch(trigger=subscription.trigger_ref, payload=payload)
+        self._metrics.count("dispatched")
 
     def cleanup(self):
         self._logger.info("Good bye cruel world...")
-        self.atlas_stream.disconnect()
+        super(PingStreamingSensor, self).cleanup()
 
     def add_trigger(self, trigger):
         # This method is called when trigger is created
-        pass
+        if not (trigger.get("parameters") or {}).get("msm_id"):
+            self._logger.warn("Trigger {} has no msm_id parameter, ignoring it".format(trigger.get("ref")))
+            return
+        subscription = PercentileSubscription(trigger, default_window=self._window)
+        if not self._shard.owns(subscription.msm_id):
+            self._logger.info("Measurement {} of trigger {} is watched by another shard than {}".format(
+                subscription.msm_id, trigger.get("ref"), self._shard))
+            return
+        with self._subscriptions_lock:
+            self._subscriptions[trigger["id"]] = subscription
+            first = not self._triggers_by_msm[subscription.msm_id]
+            self._triggers_by_msm[subscription.msm_id].add(trigger["id"])
+        if first:
+            self._logger.info("Subscribing to the results of measurement {}".format(subscription.msm_id))
+            self.atlas_stream.start_stream(stream_type="result", msm=subscription.msm_id)
 
     def update_trigger(self, trigger):
         # This method is called when trigger is updated
-        pass
+        msm_id = (trigger.get("parameters") or {}).get("msm_id")
+        with self._subscriptions_lock:
+            previous = self._subscriptions.get(trigger["id"])
+            if previous is not None and previous.msm_id == msm_id:
+                # same stream and shard: only the thresholds or probes changed,
+                # the windows gathered so far are kept
+                subscription = PercentileSubscription(trigger, default_window=self._window)
+                subscription.carry_over(previous)
+                self._subscriptions[trigger["id"]] = subscription
+                return
+        self.remove_trigger(trigger)
+        self.add_trigger(trigger)
 
     def remove_trigger(self, trigger):
         # This method is called when trigger is deleted
-        pass
+        with self._subscriptions_lock:
+            subscription = self._subscriptions.pop(trigger["id"], None)
+            if subscription is None:
+                return
+            self._triggers_by_msm[subscription.msm_id].discard(trigger["id"])
+            last = not self._triggers_by_msm[subscription.msm_id]
+            if last:
+                del self._triggers_by_msm[subscription.msm_id]
+        if last:
+            self._logger.info("Unsubscribing from the results of measurement {}".format(subscription.msm_id))
+            self.atlas_stream.unsubscribe(stream_type="result", msm=subscription.msm_id)
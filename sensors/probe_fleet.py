@@ -0,0 +1,309 @@
+# status ids of the probes/all rows and of the probestatus events
+STATUS_CONNECTED = 1
+STATUS_DISCONNECTED = 2
+STATUS_ABANDONED = 3
+STATUS_NEVER_SEEN = 4
+
+EVENT_STATUS = {
+    "connect": STATUS_CONNECTED,
+    "disconnect": STATUS_DISCONNECTED,
+}
+
+# code of the probes that are in no group of a dimension
+NO_GROUP = -1
+
+# columns of the probes/all rows
+ROW_PRB_ID = 0
+ROW_ASN_V4 = 1
+ROW_ASN_V6 = 2
+ROW_COUNTRY = 3
+ROW_IS_ANCHOR = 4
+ROW_PREFIX_V4 = 8
+ROW_PREFIX_V6 = 9
+ROW_STATUS = 12
+
+ANCHOR = "anchor"
+PROBE = "probe"
+
+
+def _anchor_or_probe(is_anchor):
+    return ANCHOR if is_anchor else PROBE
+
+
+# dimensions the probes can be grouped by: the column of their probes/all
+# row, the field of the `probe` of their probestatus events, and the
+# conversion of both to the key of a group
+DIMENSIONS = {
+    "asn_v4": (ROW_ASN_V4, "asn_v4", None),
+    "asn_v6": (ROW_ASN_V6, "asn_v6", None),
+    "country": (ROW_COUNTRY, "country_code", None),
+    "prefix_v4": (ROW_PREFIX_V4, "prefix_v4", None),
+    "prefix_v6": (ROW_PREFIX_V6, "prefix_v6", None),
+    "anchor": (ROW_IS_ANCHOR, "is_anchor", _anchor_or_probe),
+}
+# the probes are grouped by ASN unless configured otherwise: the country,
+# prefix and anchor groups are large or few enough that a disconnect in
+# one AS changes them all at once, and are opt-in
+DEFAULT_DIMENSIONS = ("asn_v4", "asn_v6")
+
+
+class GroupCounters(object):
+    """Connected and disconnected probe counters of the groups of a
+       dimension, e.g. of every ASN. Groups are interned to codes, the
+       counters are lists indexed by code and are updated in O(1).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.codes = {}
+        self.keys = []
+        self.connected = []
+        self.disconnected = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def code(self, key):
+        """Code of a group, interned on first use; NO_GROUP for an empty key"""
+        code = self.codes.get(key)
+        if code is None:
+            if not key:
+                return NO_GROUP
+            code = self.codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.connected.append(0)
+            self.disconnected.append(0)
+        return code
+
+    def intern(self, keys):
+        """Codes of a sequence of keys"""
+        import numpy as np
+
+        code = self.code
+        return np.array([code(key) for key in keys], dtype=np.int32)
+
+    def count(self, codes, status):
+        """Set the counters from the group codes and statuses of a fleet"""
+        import numpy as np
+
+        present = codes != NO_GROUP
+        self.connected = np.bincount(codes[present & (status == STATUS_CONNECTED)],
+                                     minlength=len(self.keys)).tolist()
+        self.disconnected = np.bincount(codes[present & (status == STATUS_DISCONNECTED)],
+                                        minlength=len(self.keys)).tolist()
+
+    def add(self, code, status, delta):
+        if code == NO_GROUP:
+            return
+        if status == STATUS_CONNECTED:
+            self.connected[code] += delta
+        elif status == STATUS_DISCONNECTED:
+            self.disconnected[code] += delta
+
+    def percentage(self, code):
+        """Connected percentage of the connected and disconnected probes of a
+           group, None for no group or a group without any
+        """
+        if code == NO_GROUP:
+            return None
+        connected = self.connected[code]
+        total = connected + self.disconnected[code]
+        return 100.0 * connected / total if total else None
+
+
+class GroupChange(object):
+    """Connected percentage of a group before and after a probe event"""
+
+    __slots__ = ("dimension", "key", "before", "after")
+
+    def __init__(self, dimension, key, before, after):
+        self.dimension = dimension
+        self.key = key
+        self.before = before
+        self.after = after
+
+    def __repr__(self):
+        return "GroupChange(dimension={}, key={}, before={}, after={})".format(
+            self.dimension, self.key, self.before, self.after)
+
+
+class ProbeFleet(object):
+    """Status and groups of every probe, as columns indexed by probe id.
+
+       Each dimension (see DIMENSIONS) keeps the group code of every probe
+       and the GroupCounters of its groups; a status event updates the
+       counters of the groups of its probe by delta instead of recounting,
+       and only those groups can cross a threshold.
+    """
+
+    def __init__(self, capacity=1024, dimensions=DEFAULT_DIMENSIONS):
+        import numpy as np
+
+        unknown = set(dimensions).difference(DIMENSIONS)
+        if unknown:
+            raise ValueError("Unknown probe dimensions {}, expected some of {}".format(
+                ", ".join(sorted(unknown)), ", ".join(sorted(DIMENSIONS))))
+        self.dimensions = tuple(dimensions)
+        self.status = np.zeros(capacity, dtype=np.int8)
+        self.groups = dict((dimension, GroupCounters(dimension)) for dimension in self.dimensions)
+        self.group_codes = dict((dimension, np.full(capacity, NO_GROUP, dtype=np.int32))
+                                for dimension in self.dimensions)
+        self._views()
+
+    def _views(self):
+        # memoryviews of the columns, for fast scalar access on events
+        self._status = memoryview(self.status)
+        self._codes = [(dimension, self.groups[dimension], memoryview(self.group_codes[dimension]))
+                       for dimension in self.dimensions]
+
+    def __len__(self):
+        import numpy as np
+
+        return int(np.count_nonzero(self.status))
+
+    @classmethod
+    def from_rows(cls, probes, dimensions=DEFAULT_DIMENSIONS):
+        """Fleet of the rows of the probes/all API"""
+        import numpy as np
+
+        prb_ids = np.array([p[ROW_PRB_ID] for p in probes], dtype=np.int64)
+        fleet = cls(capacity=int(prb_ids.max()) + 1 if len(prb_ids) else 1024, dimensions=dimensions)
+        status = np.array([p[ROW_STATUS] for p in probes], dtype=np.int8)
+        fleet.status[prb_ids] = status
+        for dimension in fleet.dimensions:
+            column, _, convert = DIMENSIONS[dimension]
+            keys = [p[column] for p in probes]
+            codes = fleet.groups[dimension].intern(map(convert, keys) if convert else keys)
+            fleet.group_codes[dimension][prb_ids] = codes
+            fleet.groups[dimension].count(codes, status)
+        fleet._views()
+        return fleet
+
+    @classmethod
+    def from_columns(cls, status, group_codes, group_keys):
+        """Fleet of the columns of another fleet, e.g. loaded from a snapshot.
+           `group_codes` and `group_keys` map every dimension to its column of
+           codes and to the keys of its codes.
+        """
+        fleet = cls(capacity=0, dimensions=list(group_codes))
+        fleet.status = status
+        for dimension, codes in group_codes.items():
+            groups = fleet.groups[dimension]
+            groups.intern(group_keys[dimension])
+            fleet.group_codes[dimension] = codes
+            groups.count(codes, status)
+        fleet._views()
+        return fleet
+
+    def reconcile_rows(self, probes, skip=()):
+        """Apply the rows of the probes/all API whose status or groups differ
+           from the fleet, but the ones of the probes in `skip`. Returns the
+           probe ids of the rows and how many of them changed.
+        """
+        import numpy as np
+
+        prb_ids = np.array([p[ROW_PRB_ID] for p in probes], dtype=np.int64)
+        if not len(prb_ids):
+            return prb_ids, 0
+        if prb_ids.max() >= len(self.status):
+            self._grow(int(prb_ids.max()))
+        status = np.array([p[ROW_STATUS] for p in probes], dtype=np.int8)
+        changed = self.status[prb_ids] != status
+        row_codes = []
+        for dimension in self.dimensions:
+            column, _, convert = DIMENSIONS[dimension]
+            keys = [p[column] for p in probes]
+            codes = self.groups[dimension].intern(map(convert, keys) if convert else keys)
+            changed |= self.group_codes[dimension][prb_ids] != codes
+            row_codes.append((dimension, codes))
+        if skip:
+            changed &= ~np.isin(prb_ids, np.fromiter(skip, dtype=np.int64, count=len(skip)))
+        rows = np.flatnonzero(changed)
+        self._apply(prb_ids[rows], status[rows], dict((dimension, codes[rows]) for dimension, codes in row_codes))
+        return prb_ids, len(rows)
+
+    def _apply(self, prb_ids, status, group_codes):
+        """Set the status and group codes of distinct probes at once"""
+        import numpy as np
+
+        old_status = self.status[prb_ids]
+        for dimension, codes in group_codes.items():
+            groups = self.groups[dimension]
+            old_codes = self.group_codes[dimension][prb_ids]
+            for counter, counted in (("connected", STATUS_CONNECTED), ("disconnected", STATUS_DISCONNECTED)):
+                counts = np.array(getattr(groups, counter), dtype=np.int64)
+                counts += np.bincount(codes[(codes != NO_GROUP) & (status == counted)], minlength=len(counts))
+                counts -= np.bincount(old_codes[(old_codes != NO_GROUP) & (old_status == counted)],
+                                      minlength=len(counts))
+                setattr(groups, counter, counts.tolist())
+            self.group_codes[dimension][prb_ids] = codes
+        self.status[prb_ids] = status
+
+    def retain(self, prb_ids, skip=()):
+        """Forget the probes that are not in `prb_ids` nor in `skip`.
+           Returns how many were forgotten.
+        """
+        import numpy as np
+
+        gone = self.status != 0
+        gone[np.asarray(prb_ids, dtype=np.int64)] = False
+        if skip:
+            gone[np.fromiter(skip, dtype=np.int64, count=len(skip))] = False
+        prb_ids = np.flatnonzero(gone)
+        self._apply(prb_ids, np.zeros(len(prb_ids), dtype=np.int8),
+                    dict((dimension, np.full(len(prb_ids), NO_GROUP, dtype=np.int32))
+                         for dimension in self.dimensions))
+        return len(prb_ids)
+
+    def _grow(self, prb_id):
+        import numpy as np
+
+        capacity = max(prb_id + 1, 2 * len(self.status))
+        extra = capacity - len(self.status)
+        self.status = np.concatenate((self.status, np.zeros(extra, dtype=np.int8)))
+        for dimension in self.dimensions:
+            self.group_codes[dimension] = np.concatenate(
+                (self.group_codes[dimension], np.full(extra, NO_GROUP, dtype=np.int32)))
+        self._views()
+
+    def percentage(self, dimension, key):
+        groups = self.groups[dimension]
+        return groups.percentage(groups.codes.get(key, NO_GROUP))
+
+    def keys_of(self, probe):
+        """Group keys of the `probe` of a probestatus event, by dimension"""
+        keys = {}
+        for dimension in self.dimensions:
+            _, field, convert = DIMENSIONS[dimension]
+            if field in probe:
+                keys[dimension] = convert(probe[field]) if convert else probe[field]
+        return keys
+
+    def update(self, prb_id, status, **keys):
+        """Set the status of a probe, and its groups when given as keyword
+           arguments, e.g. asn_v4=3333. Returns the GroupChange of every group
+           of the probe.
+        """
+        if prb_id >= len(self._status):
+            self._grow(prb_id)
+        old_status = self._status[prb_id]
+        changes = []
+        for dimension, groups, codes in self._codes:
+            old_code = codes[prb_id]
+            code = groups.code(keys[dimension]) if dimension in keys else old_code
+            if code == NO_GROUP:
+                if old_code != NO_GROUP:
+                    groups.add(old_code, old_status, -1)
+                    codes[prb_id] = code
+                continue
+            before = groups.percentage(code)
+            if code != old_code or status != old_status:
+                groups.add(old_code, old_status, -1)
+                groups.add(code, status, 1)
+                codes[prb_id] = code
+                after = groups.percentage(code)
+            else:
+                after = before
+            changes.append(GroupChange(dimension, groups.keys[code], before, after))
+        self._status[prb_id] = status
+        return changes
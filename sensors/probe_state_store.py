@@ -0,0 +1,79 @@
+import math
+import os
+import sqlite3
+import threading
+
+
+class ProbeSummary(object):
+    """What the polling sensor keeps of the latest result of a probe"""
+
+    __slots__ = ("stored_timestamp", "hop_count", "rtt_median", "unreachable", "from_hash")
+
+    def __init__(self, stored_timestamp, hop_count, rtt_median, unreachable, from_hash):
+        self.stored_timestamp = stored_timestamp
+        self.hop_count = hop_count
+        self.rtt_median = rtt_median
+        self.unreachable = unreachable
+        self.from_hash = from_hash
+
+    def __repr__(self):
+        return "ProbeSummary(stored_timestamp={}, hop_count={}, rtt_median={}, unreachable={}, from_hash={})".format(
+            self.stored_timestamp, self.hop_count, self.rtt_median, self.unreachable, self.from_hash)
+
+
+class ProbeStateStore(object):
+    """Checkpoints the probe summaries of the watched measurements to a local
+       SQLite file, so that a restarted sensor compares its first results
+       with the ones seen before the restart.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS measurement_state ("
+                "msm_id INTEGER PRIMARY KEY, high_water_mark INTEGER)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS probe_state ("
+                "msm_id INTEGER, prb_id INTEGER, stored_timestamp INTEGER, hop_count INTEGER, "
+                "rtt_median REAL, unreachable INTEGER, from_hash INTEGER, PRIMARY KEY (msm_id, prb_id))")
+
+    def save(self, msm_id, high_water_mark, summaries):
+        """Replace the checkpoint of a measurement. `summaries` maps the
+           probe ids to their ProbeSummary.
+        """
+        rows = [(msm_id, prb_id, s.stored_timestamp, s.hop_count,
+                 None if math.isnan(s.rtt_median) else s.rtt_median, int(s.unreachable), s.from_hash)
+                for prb_id, s in list(summaries.items())]
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO measurement_state VALUES (?, ?)",
+                                     (msm_id, high_water_mark))
+            self._connection.execute("DELETE FROM probe_state WHERE msm_id = ?", (msm_id,))
+            self._connection.executemany("INSERT INTO probe_state VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load(self, msm_id):
+        """The high water mark and the probe summaries checkpointed for a
+           measurement, or (None, {}) if there is no checkpoint.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT high_water_mark FROM measurement_state WHERE msm_id = ?", (msm_id,)).fetchone()
+            if row is None:
+                return None, {}
+            summaries = dict(
+                (prb_id, ProbeSummary(stored_timestamp, hop_count,
+                                      float("nan") if rtt_median is None else rtt_median,
+                                      bool(unreachable), from_hash))
+                for prb_id, stored_timestamp, hop_count, rtt_median, unreachable, from_hash
+                in self._connection.execute(
+                    "SELECT prb_id, stored_timestamp, hop_count, rtt_median, unreachable, from_hash "
+                    "FROM probe_state WHERE msm_id = ?", (msm_id,)))
+        return row[0], summaries
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
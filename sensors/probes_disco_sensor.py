@@ -1,43 +1,155 @@
-from collections import defaultdict
-from datetime import datetime, timedelta
-
-from ripe.atlas.cousteau import (
-    AtlasStream,
-)
-from st2reactor.sensor.base import Sensor
+import itertools
+import os
+import threading
+import time
+
+from dispatch_coalescer import DispatchCoalescer
+from disconnect_window import DisconnectWindow
+from fleet_snapshot import FleetSnapshot
+from json_stream import iter_array_items
+from probe_fleet import DEFAULT_DIMENSIONS, EVENT_STATUS, ProbeFleet
+from streaming_sensor import OVERFLOW_COALESCE, StreamingSensor
 
 ALL_PROBES_STATE_URL = "https://atlas.ripe.net/api/v2/probes/all"
-
-STATUS_MAP = {
-    1: "Connected",
-    2: "Disconnected",
-    3: "Abandoned",
-    4: "NeverSeen"
-}
-
-import requests
-
-
-class ProbesDiscoSensor(Sensor):
+PROBES_DISCO_TRIGGER = "atlas.probes_disco"
+
+DEFAULT_CACHE_DIR = "/var/tmp/stackstorm-atlas"
+# how often, in seconds, the fleet snapshot is refreshed from probes/all
+FLEET_REFRESH_INTERVAL = 3600
+FLEET_FETCH_TIMEOUT = 60
+# bytes read from the probes/all body at once, and rows reconciled at once
+FLEET_READ_SIZE = 64 * 1024
+FLEET_CHUNK_ROWS = 5000
+
+# window, in seconds, over which the events of a group are coalesced
+# into a single dispatch
+COALESCE_WINDOW = 30
+
+# sliding window, in minutes, of the last disconnected probes of a group
+DISCONNECT_WINDOW_MINUTES = 30
+# disconnections in the window above which a group is going down fast
+DOWN_FAST_THRESHOLD = 3
+# connection percentages of a group that trigger an event
+LOW_CONNECTION_PERCENTAGE = 50.0
+OFFLINE_PERCENTAGE = 1.0
+# change of the connection percentage of a group that triggers an event
+SIGNIFICANT_CHANGE = 19.0
+
+
+class ProbesDiscoSensor(StreamingSensor):
+
+    channel = "atlas_probestatus"
+    # only the latest status of a probe matters: a backed up queue keeps it
+    # instead of blocking the stream thread, and the socket, until it drains
+    overflow_policy = OVERFLOW_COALESCE
 
     def __init__(self, sensor_service, config):
         super(ProbesDiscoSensor, self).__init__(
             sensor_service=sensor_service, config=config)
-        self._logger = self.sensor_service.get_logger(
-            name=self.__class__.__name__)
-        self._probes_state = {}
-        self._ases_v4_state = {}
-        self._ases_v6_state = {}
-        self.atlas_stream = AtlasStream()
+        self._dimensions = DEFAULT_DIMENSIONS
+        # built by setup, the fleet columns pull numpy in
+        self._fleet = None
+        # sliding window of the last disconnected probes of every group,
+        # by (dimension, group)
+        self._last_disconnected = {}
+        self._window_length = DISCONNECT_WINDOW_MINUTES * 60
+        self._down_fast_threshold = DOWN_FAST_THRESHOLD
+        # the groups are shared by probes processed in different workers
+        self._state_lock = threading.Lock()
+        self._coalescer = DispatchCoalescer(self._dispatch_summary, window=COALESCE_WINDOW)
+        self._snapshot = None
+        # probes updated by status events while the fleet is being refreshed,
+        # None when no refresh is running
+        self._touched = None
+        # whether this shard owns the groups seen so far, by (dimension, group)
+        self._owned_groups = {}
 
     def setup(self):
-        r = requests.get(ALL_PROBES_STATE_URL)
-        if r.status_code == 200:
-            self._create_state_dicts(r.json()["probes"])
-            # self._logger.info(self._create_probes_dict(r.json()["probes"]))
-
-    def _create_state_dicts(self, probes):
+        super(ProbesDiscoSensor, self).setup()
+        self._window_length = self._config.get(
+            "disconnect_window_minutes", DISCONNECT_WINDOW_MINUTES) * 60
+        self._down_fast_threshold = self._config.get(
+            "down_fast_threshold", DOWN_FAST_THRESHOLD)
+        self._dimensions = tuple(self._config.get("probe_dimensions") or DEFAULT_DIMENSIONS)
+        self._fleet = ProbeFleet(dimensions=self._dimensions)
+        self._coalescer.window = self._config.get("disco_coalesce_window", COALESCE_WINDOW)
+        self._refresh_interval = self._config.get("fleet_refresh_interval", FLEET_REFRESH_INTERVAL)
+        self._fetch_timeout = self._config.get("fetch_timeout", FLEET_FETCH_TIMEOUT)
+        self.atlas_stream.start_stream(stream_type="probestatus", enrichProbes=True)
+
+        # start from the local snapshot, the refresh thread reconciles it with
+        # probes/all once the sensor runs
+        self._snapshot = FleetSnapshot(os.path.join(
+            self._config.get("cache_dir", DEFAULT_CACHE_DIR), "probes_fleet"))
+        fleet = self._snapshot.load()
+        if fleet is not None and fleet.dimensions == self._dimensions:
+            self._fleet = fleet
+            self._log_fleet("Loaded the fleet snapshot of {}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._snapshot.timestamp))))
+        else:
+            # without a fleet every group would look brand new: the stream is
+            # read right away, but its events wait for the first download
+            self._ready.clear()
+            self._logger.info("No fleet snapshot, queueing the probe events until probes/all is downloaded")
+
+    def _log_fleet(self, message):
+        fleet = self._fleet
+        self._logger.info("{}: {} probes, groups: {}".format(message, len(fleet), ", ".join(
+            "{} {}".format(len(fleet.groups[dimension]), dimension) for dimension in fleet.dimensions)))
+
+    def _refresh_fleet(self):
+        """Download probes/all, unless it did not change since the snapshot,
+           and reconcile the fleet with it. The probes updated by status events
+           during the download keep the status of the events.
         """
+        import requests
+
+        with self._state_lock:
+            self._touched = set()
+        try:
+            r = requests.get(ALL_PROBES_STATE_URL, headers=self._snapshot.headers(),
+                             timeout=self._fetch_timeout, stream=True)
+            if r.status_code == 304:
+                self._snapshot.touch()
+                self._logger.info("The fleet did not change since the snapshot")
+                return
+            if r.status_code != 200:
+                self._logger.warning("Failed to refresh the fleet, status code {}".format(r.status_code))
+                return
+            try:
+                prb_ids, changed = self._reconcile_fleet(r)
+            except ValueError as e:
+                # the probes missing from a truncated body are not gone
+                self._logger.warning("Incomplete probes/all body, not forgetting any probe: {}".format(e))
+                return
+            with self._state_lock:
+                changed += self._fleet.retain(prb_ids, skip=self._touched)
+                self._snapshot.save(self._fleet, etag=r.headers.get("ETag"),
+                                    last_modified=r.headers.get("Last-Modified"))
+            self._log_fleet("Refreshed the fleet, {} probes changed".format(changed))
+        finally:
+            with self._state_lock:
+                self._touched = None
+
+    def _refresh_fleet_loop(self):
+        snapshot_age = time.time() - (self._snapshot.timestamp or 0)
+        delay = max(0, self._refresh_interval - snapshot_age)
+        while not self._stopping.wait(delay):
+            try:
+                with self._metrics.timer("fleet_refresh"):
+                    self._refresh_fleet()
+            except Exception:
+                self._logger.exception("Failed to refresh the fleet")
+            if not self._ready.is_set():
+                self._log_fleet("Processing the queued probe events")
+                self._ready.set()
+            delay = self._refresh_interval
+
+    def _reconcile_fleet(self, response):
+        """
+        Parse the probes of the probes/all response as its body streams in,
+        and reconcile the fleet with them chunk by chunk:
+
         #         [
         #   *   0           probe.pk,
         #   *   1           probe.asn_v4 if probe.asn_v4 else 0,
@@ -54,83 +166,28 @@ class ProbesDiscoSensor(Sensor):
         #   *   12          probe.status,
         #   *   13         int(probe.status_since.strftime("%s")) if probe.status_since is not None else None
         #   *  ]
-        """
-        for p in probes:
-            status = STATUS_MAP[p[12]]
-            self._probes_state[p[0]] = {"prb_id": p[0], "asn_v4": p[1],
-                                        "asn_v6": p[2], "status": status}
-
-            if p[1] and self._ases_v4_state.get(p[1]):
-                self._ases_v4_state[p[1]].setdefault(status, set()).add(p[0])
-            elif p[1] and p[1] != 0:
-                self._ases_v4_state[p[1]] = {status: set([p[0]])}
-
-            if p[2] and self._ases_v6_state.get(p[2]):
-                self._ases_v6_state[p[2]].setdefault(status, set()).add(p[0])
-            elif p[2] and p[2] != 0:
-                self._ases_v6_state[p[1]] = {status: set([p[0]])}
-
-        for asn_v4 in self._ases_v4_state:
-            # self._logger.info(asn_v4)
-            # self._logger.info(self._ases_v4_state)
-            self._update_vstate(self._ases_v4_state[asn_v4])
-
-        for asn_v6 in self._ases_v6_state:
-            self._update_vstate(self._ases_v6_state[asn_v6])
-
-        # return {p[0]: {"prb_id": p[0], "asn_v4": p[1], "asn_v6": p[2], "status": STATUS_MAP[p[12]]} for p in probes}
-
-    def _update_vstate(self, vstate, prb_id=None, event=None):
-        def _update_disco_list(prb_id, event):
-            if event == "connect":
-                vstate.setdefault(
-                    "Disconnected", set()).discard(prb_id)
-                vstate.setdefault(
-                    "Connected", set()).add(prb_id)
-                try:
-                    del vstate.get("LastDisconnected", {})[prb_id]
-                except KeyError:
-                    pass
-                self._logger.info(vstate.get("LastDisconnected"))
-
-                for p in vstate.get("LastDisconnected", {}):
-                    if vstate["LastDisconnected"][p] < datetime.now() - timedelta(minutes=30):
-                        try:
-                            del vstate.get("LastDisconnected", {})[p]
-                        except KeyError:
-                            pass
-
-            if event == "disconnect":
-                vstate.setdefault(
-                    "Connected", set()).discard(prb_id)
-                vstate.setdefault(
-                    "Disconnected", set()).add(prb_id)
-
-                # add the prb_id to the disconnected sliding window
-                vstate.setdefault("LastDisconnected", {}).update(
-                    {prb_id: datetime.now()})
-                self._logger.info(vstate["LastDisconnected"])
-
-                # check for late disconnected and delete those from the sliding window
-                for p in vstate["LastDisconnected"]:
-                    if vstate["LastDisconnected"][p] < datetime.now() - timedelta(minutes=30):
-                        try:
-                            del vstate.get("LastDisconnected", {})[p]
-                        except KeyError:
-                            pass
 
-        if prb_id:
-            _update_disco_list(prb_id, event)
-
-        perc = 100.0 * float(len(vstate.get("Connected", []))) / float(
-            len(vstate.get("Connected", [])) +
-            len(vstate.get("Disconnected", []))
-        )
-
-        vstate["connection_percentage"] = perc
-        # self._logger.info('new perc: {}'.format(perc))
-
-        return perc
+        Returns the ids of the probes and how many of them changed.
+        """
+        import numpy as np
+
+        rows = iter_array_items(response.iter_content(chunk_size=FLEET_READ_SIZE), "probes")
+        prb_ids, changed = [], 0
+        while True:
+            chunk = list(itertools.islice(rows, FLEET_CHUNK_ROWS))
+            if not chunk:
+                break
+            with self._state_lock:
+                chunk_ids, chunk_changed = self._fleet.reconcile_rows(chunk, skip=self._touched)
+            prb_ids.append(chunk_ids)
+            changed += chunk_changed
+        return np.concatenate(prb_ids) if prb_ids else np.zeros(0, dtype=np.int64), changed
+
+    def _window_of(self, dimension, key):
+        window = self._last_disconnected.get((dimension, key))
+        if window is None:
+            window = self._last_disconnected[(dimension, key)] = DisconnectWindow(self._window_length)
+        return window
 
     def _update_probe_status(self, probe):
         """
@@ -157,198 +214,130 @@ class ProbesDiscoSensor(Sensor):
         u'prb_id': 20981,
         u'type': u'connection',
         u'event': u'disconnect'}
+
+        Returns the GroupChange of every group of the probe.
         """
-        p_state = self._probes_state.get(probe["prb_id"])
         event = probe["event"]
         prb_id = probe["prb_id"]
-        asn_v4 = probe["probe"]["asn_v4"]
-        asn_v6 = probe["probe"]["asn_v6"]
-        if event == "disconnect":  # and p_state["status"] == "Connected":
-            p_state["status"] = "Disconnected"
-            if asn_v4:
-                self._update_vstate(self._ases_v4_state[asn_v4], prb_id, event)
-            if asn_v6:
-                self._update_vstate(self._ases_v6_state[asn_v6], prb_id, event)
-        elif event == "connect":  # and p_state["status"] == "Disconnected":
-            p_state["status"] = "Connected"
-            if asn_v4:
-                self._update_vstate(self._ases_v4_state[asn_v4], prb_id, event)
-            if asn_v6:
-                self._update_vstate(self._ases_v6_state[asn_v6], prb_id, event)
-        else:
-            self._logger.info("probe {p} in wrong state".format(p=prb_id))
-
-        if (event == "disconnect" and p_state["status"] == "Disconnected") or (
-            event == "connect" and p_state["status"] == "Connected"
-        ):
-            self._logger.info("NO STATE CHANGE for probe {}".format(prb_id))
-        self._logger.info(p_state)
-        self._logger.info(probe["probe"])
-
-        self._probes_state[probe["prb_id"]] = p_state
-
-    def on_result_response(self, *args):
+        status = EVENT_STATUS.get(event)
+        if status is None:
+            self._debug.debug("Probe %s sent the unknown event %s", prb_id, event)
+            return []
+
+        if prb_id < len(self._fleet.status) and self._fleet.status[prb_id] == status:
+            self._debug.debug("No state change for probe %s", prb_id)
+        if self._touched is not None:
+            self._touched.add(prb_id)
+        changes = self._fleet.update(prb_id, status, **self._fleet.keys_of(probe["probe"]))
+        # every shard follows the whole fleet, its small columns are needed to
+        # compute the percentages, but only evaluates the groups it owns
+        if self._shard.count > 1:
+            changes = [change for change in changes if self._owns_group(change.dimension, change.key)]
+        for change in changes:
+            window = self._window_of(change.dimension, change.key)
+            if event == "disconnect":
+                window.disconnect(prb_id)
+            else:
+                window.connect(prb_id)
+        return changes
+
+    def _owns_group(self, dimension, key):
+        owned = self._owned_groups.get((dimension, key))
+        if owned is None:
+            owned = self._owned_groups[(dimension, key)] = self._shard.owns("{}:{}".format(dimension, key))
+        return owned
+
+    def coalesce_key(self, message):
+        # only the latest status of a probe matters
+        return message.get('prb_id')
+
+    def sequence_of(self, message):
+        # a probe may disconnect and connect within the same second
+        return message.get('prb_id'), message.get('timestamp', 0), message.get('event')
+
+    def process_message(self, message):
         """
         Process the result from the Atlas Ping Probe
         """
-        probe_update = args[0]
+        probe_update = message
         prb_id = probe_update['prb_id']
         event = probe_update['event']
-        asn_v4 = probe_update['probe']["asn_v4"]
-        asn_v6 = probe_update['probe']["asn_v6"]
-        curr_asn_v4_conn = self._ases_v4_state.get(
-            asn_v4, {}).get('connection_percentage')
-        curr_asn_v6_conn = self._ases_v6_state.get(
-            asn_v6, {}).get('connection_percentage')
-        self._logger.info("Received a probe update for probe {prb_id} (asn v4:{asn_v4}, v6: {asn_v6}), event: \"{event}\"".format(
-            prb_id=prb_id, event=event, asn_v4=asn_v4, asn_v6=asn_v6))
-        # self._logger.info(probe_update)
-        self._update_probe_status(probe_update)
-        new_asn_v4_conn = self._ases_v4_state.get(
-            asn_v4, {}).get('connection_percentage')
-        new_asn_v6_conn = self._ases_v6_state.get(
-            asn_v6, {}).get('connection_percentage')
-
+        self._debug.debug("Received a probe update for probe %s (asn v4: %s, v6: %s), event: \"%s\"",
+                          prb_id, probe_update['probe'].get("asn_v4"), probe_update['probe'].get("asn_v6"), event)
+        with self._metrics.timer("analyze"):
+            with self._state_lock:
+                changes = self._update_probe_status(probe_update)
+                disconnected = dict((change, len(self._window_of(change.dimension, change.key)))
+                                    for change in changes)
+
+        timestamp = probe_update['timestamp']
         # Evaluate single probe disco
-        if event == "connect" or event == 'disconnect':
-            trigger = 'atlas.probes_disco'
-            payload = {event: "probe with id {prb_id} {event}ed.".format(
-                prb_id=prb_id, event=event)}
-            trace_tag = "{prb_id}-{event}-{timestamp}".format(
-                prb_id=prb_id, event=event, timestamp=probe_update['timestamp'])
-
+        if (event == "connect" or event == 'disconnect') and self._owns_group("probe", event):
+            self._coalescer.add(
+                "probe", event, event, "probes {event}ed".format(event=event), prb_id, None, None, timestamp,
+                trace_tag="{prb_id}-{event}-{timestamp}".format(prb_id=prb_id, event=event, timestamp=timestamp))
+
+        # Evaluate the groups of the probe, the only ones the event changed
+        for change in changes:
+            for name, text in self._group_events(change, event, disconnected[change]):
+                text = text.format(dimension=change.dimension, key=change.key)
+                self._debug.debug("%s", text)
+                self._coalescer.add(change.dimension, change.key, name, text, prb_id,
+                                    change.before, change.after, timestamp)
+            self._debug.debug("connection percentage for %s %s %s -> %s, disconnect bin: %s",
+                              change.dimension, change.key, change.before, change.after, disconnected[change])
+
+    def _dispatch_summary(self, payload, trace_tag):
+        self._logger.info(payload["event"])
+        with self._metrics.timer("dispatch"):
             self.sensor_service.dispatch(
-                trigger=trigger, payload=payload, trace_tag=trace_tag)
+                trigger=PROBES_DISCO_TRIGGER, payload=payload, trace_tag=trace_tag)
+        self._metrics.count("dispatched")
 
-        # Evaluate ASes disco
-        if event == "disconnect":
-            trigger = 'atlas.probes_disco'
-
-            # AS presence goes below 50 percent
-            if curr_asn_v4_conn >= 50.0:
-                if new_asn_v4_conn < 50.0:
-                    self._logger.info('AWAS! asn_v4 {asn_v4} less than 50 percent connected!'.format(
-                        asn_v4=asn_v4))
-                    self.sensor_service.dispatch(
-                        trigger=trigger,
-                        payload={"event": 'AWAS! asn_v4 {asn_v4} less than 50 percent connected!'.format(
-                            asn_v4=asn_v4)},
-                        trace_tag="{asn_v4}-lessthan-{timestamp}".format(
-                            asn_v4=asn_v4, timestamp=probe_update['timestamp'])
-                    )
-                elif new_asn_v4_conn - curr_asn_v4_conn <= 19.0:
-                    self._logger.info(
-                        'NO! asn_v4 {asn_v4} going down significantly'.format(asn_v4=asn_v4))
-                    self.sensor_service.dispatch(
-                        trigger=trigger, payload={"event": 'NO! asn_v4 {asn_v4} going down significantly'.format(asn_v4=asn_v4)}, trace_tag="{asn_v4}-down-{timestamp}".format(
-                            asn_v4=asn_v4, timestamp=probe_update['timestamp']
-                        )
-                    )
-                if curr_asn_v6_conn >= 50.0 and new_asn_v6_conn < 50.0:
-                    self._logger.info('AWAS! asn_v6 {asn_v6} less than 50 percent connected!'.format(
-                        asn_v6=asn_v6))
-                    self.sensor_service.dispatch(
-                        trigger=trigger,
-                        payload={"event": 'AWAS! asn_v6 {asn_v6} less than 50 percent connected!'.format(
-                            asn_v6=asn_v6)},
-                        trace_tag="{asn_v6}-lessthan-{timestamp}".format(
-                            asn_v4=asn_v4, timestamp=probe_update['timestamp']
-                        )
-                    )
-
-                elif new_asn_v6_conn and curr_asn_v6_conn and new_asn_v6_conn - curr_asn_v6_conn <= 19.0:
-                    self._logger.info(
-                        'NO! asn_v6 {asn_v6} going down significantly'.format(asn_v6=asn_v6))
-                    self.sensor_service.dispatch(
-                        trigger=trigger,
-                        payload={"event": 'NO! asn_v6 {asn_v6} going down significantly'.format(
-                            asn_v6=asn_v6)},
-                        trace_tag="{asn_v6}-down-{timestamp}"
-                    )
-
-            # no AS presence
-            if curr_asn_v4_conn > 1.0 and new_asn_v4_conn < 1.0:
-                self._logger.info('as{asn_v4} completely offline'.format(
-                    asn_v4=asn_v4))
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'as{asn_v4} went completely offline'.format(
-                        asn_v4=asn_v4)},
-                    trace_tag="{asn_v4}-offline-{timestamp}".format(
-                        asn_v4=asn_v4, timestamp=probe_update['timestamp'])
-                )
-            if curr_asn_v6_conn > 1.0 and new_asn_v6_conn < 1.0:
-                self._logger.info('{asn_v6} went completely offline'.format(
-                    asn_v6=asn_v6))
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'as{asn_v6} went completely offline'.format(
-                        asn_v6=asn_v6)},
-                    trace_tag="{asn_v6}-offline-{timestamp}".format(
-                        asn_v6=asn_v6, timestamp=probe_update['timestamp'])
-                )
-
-            # AS picks up
-            if new_asn_v4_conn and curr_asn_v4_conn and new_asn_v4_conn - curr_asn_v4_conn > 19.0:
-                self._logger.info(
-                    'YEAH! as{asn_v4} seeing significant uptake in online probes'.format(asn_v4=asn_v4))
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'YEAH! as{asn_v4} seeing significant uptake in online probes'.format(
-                        asn_v4=asn_v4)},
-                    trace_tag="{asn_v4}-uptake-{timestamp}".format(
-                        asn_v4=asn_v4, timestamp=probe_update['timestamp'])
-                )
-            if new_asn_v6_conn and curr_asn_v6_conn and new_asn_v6_conn - curr_asn_v6_conn > 19.0:
-                self._logger.info(
-                    'YEAH! as{asn_v6} seeing significant uptake in online probes'.format(asn_v6=asn_v6))
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'YEAH! as{asn_v6} seeing significant uptake in online probes'.format(
-                        asn_v6=asn_v6)},
-                    trace_tag="{asn_v6}-uptake-{timestamp}".format(
-                        asn_v6=asn_v6, timestamp=probe_update['timestamp'])
-                )
-
-            # Probes going down fast
-            if len(self._ases_v4_state.get(asn_v4, {}).get('LastDisconnected')) >= 3:
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'OMG! as{asn_v4} going down fast now'.format(
-                        asn_v4=asn_v4)},
-                    trace_tag="{asn_v4}-downfast-{timestamp}".format(
-                        asn_v4=asn_v4, timestamp=probe_update['timestamp'])
-                )
-            if len(self._ases_v6_state.get(asn_v6, {}).get('LastDisconnected')) >= 3:
-                self.sensor_service.dispatch(
-                    trigger=trigger,
-                    payload={"event": 'OMG! as{asn_v6} going down fast now'.format(
-                        asn_v6=asn_v6)},
-                    trace_tag="{asn_v6}-downfast-{timestamp}".format(
-                        asn_v4=asn_v6, timestamp=probe_update['timestamp'])
-                )
-
-        self._logger.info('connection percentage for asn_v4 {asn_v4} {old} -> {new}'.format(
-            asn_v4=asn_v4, old=curr_asn_v4_conn, new=new_asn_v4_conn))
-        self._logger.info('connection percentage for asn_v6 {asn_v6} {old} -> {new}'.format(
-            asn_v6=asn_v6, old=curr_asn_v6_conn, new=new_asn_v6_conn))
-        self._logger.info('disconnect bin asn v4: {}'.format(
-            self._ases_v4_state.get(asn_v4, {}).get('LastDisconnected')))
-        self._logger.info('disconnect bin asn v6: {}'.format(
-            self._ases_v6_state.get(asn_v6, {}).get('LastDisconnected')))
+    def _flush_summaries(self):
+        interval = min(max(self._coalescer.window / 4.0, 0.5), 5)
+        while not self._stopping.wait(interval):
+            try:
+                self._coalescer.flush()
+            except Exception:
+                self._logger.exception("Failed to dispatch the probes disco summaries")
 
     def run(self):
-        stream_parameters = {"enrichProbes": True}
-        self.atlas_stream.connect()
-        channel = "atlas_probestatus"
-        # Bind function we want to run with every result message received
-        self.atlas_stream.bind_channel(channel, self.on_result_response)
-        self.atlas_stream.start_stream(
-            stream_type="probestatus", **stream_parameters)
-        self.atlas_stream.timeout()
+        flusher = threading.Thread(target=self._flush_summaries, name="ProbesDiscoSensor-flusher")
+        flusher.daemon = True
+        flusher.start()
+        refresher = threading.Thread(target=self._refresh_fleet_loop, name="ProbesDiscoSensor-refresher")
+        refresher.daemon = True
+        refresher.start()
+        super(ProbesDiscoSensor, self).run()
 
     def cleanup(self):
-        self.atlas_stream.disconnect()
+        super(ProbesDiscoSensor, self).cleanup()
+        self._coalescer.flush(force=True)
+
+    def _group_events(self, change, event, disconnected):
+        """Name and message of the thresholds a group crossed with an event"""
+        before, after = change.before, change.after
+        if before is None or after is None:
+            return []
+        events = []
+        if event == "disconnect":
+            # group presence goes below 50 percent
+            if before >= LOW_CONNECTION_PERCENTAGE > after:
+                events.append(("lessthan", 'AWAS! {dimension} {key} less than 50 percent connected!'))
+            elif before - after >= SIGNIFICANT_CHANGE:
+                events.append(("down", 'NO! {dimension} {key} going down significantly'))
+            # no group presence
+            if before > OFFLINE_PERCENTAGE and after < OFFLINE_PERCENTAGE:
+                events.append(("offline", '{dimension} {key} went completely offline'))
+            # probes going down fast
+            if disconnected >= self._down_fast_threshold:
+                events.append(("downfast", 'OMG! {dimension} {key} going down fast now'))
+        elif event == "connect":
+            # group picks up
+            if after - before >= SIGNIFICANT_CHANGE:
+                events.append(("uptake", 'YEAH! {dimension} {key} seeing significant uptake in online probes'))
+        return events
 
     def add_trigger(self, trigger):
         # This method is called when trigger is created
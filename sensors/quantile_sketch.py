@@ -0,0 +1,95 @@
+import math
+import time
+
+import numpy as np
+
+
+class QuantileSketch(object):
+    """Mergeable quantile sketch over logarithmic buckets (DDSketch style).
+
+       A value v lands in bucket ceil(log(v) / log(gamma)), so that any
+       quantile is returned within `relative_accuracy` of the exact one.
+       The buckets cover [min_value, max_value] and are preallocated, the
+       memory of a sketch does not depend on the number of values added.
+    """
+
+    def __init__(self, relative_accuracy=0.02, min_value=0.01, max_value=60000.0):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(gamma)
+        self._offset = int(math.ceil(math.log(min_value) / self._log_gamma))
+        self.bucket_count = int(math.ceil(math.log(max_value) / self._log_gamma)) - self._offset + 1
+        self.counts = np.zeros(self.bucket_count, dtype=np.uint32)
+        # representative value of every bucket, the middle of its bounds
+        upper = gamma ** (np.arange(self.bucket_count) + self._offset)
+        self._values = 2 * upper / (gamma + 1)
+
+    def buckets(self, values):
+        """Bucket index of each of the values, clipped to the covered range"""
+        values = np.clip(np.asarray(values, dtype=np.float64), self.min_value, self.max_value)
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64) - self._offset
+
+    def add(self, values):
+        self.counts += np.bincount(self.buckets(values), minlength=self.bucket_count).astype(np.uint32)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def quantiles(self, quantiles, counts=None):
+        """Values at the given quantiles (0-1), NaN when the sketch is empty"""
+        return quantiles_of(self.counts if counts is None else counts, self._values, quantiles)
+
+
+class WindowedQuantileSketch(object):
+    """Quantile sketch over a sliding time window.
+
+       The window is split in `slots` sub-sketches; adding a value first
+       clears the slots that fell out of the window, so quantiles cover at
+       least `window - window / slots` seconds without keeping raw samples.
+    """
+
+    def __init__(self, window=300, slots=5, relative_accuracy=0.02, clock=time.time):
+        self.window = window
+        self.slot_length = float(window) / slots
+        self._clock = clock
+        self._sketch = QuantileSketch(relative_accuracy=relative_accuracy)
+        self._slots = np.zeros((slots, self._sketch.bucket_count), dtype=np.uint32)
+        self._slot_number = int(self._clock() // self.slot_length)
+
+    def _rotate(self):
+        slot_number = int(self._clock() // self.slot_length)
+        expired = min(slot_number - self._slot_number, len(self._slots))
+        for number in range(self._slot_number + 1, self._slot_number + 1 + expired):
+            self._slots[number % len(self._slots)] = 0
+        self._slot_number = max(slot_number, self._slot_number)
+
+    def add(self, values):
+        self._rotate()
+        self._slots[self._slot_number % len(self._slots)] += np.bincount(
+            self._sketch.buckets(values), minlength=self._sketch.bucket_count).astype(np.uint32)
+
+    def counts(self):
+        self._rotate()
+        return self._slots.sum(axis=0)
+
+    def __len__(self):
+        return int(self.counts().sum())
+
+    def quantiles(self, quantiles):
+        counts = self.counts()
+        return int(counts.sum()), self._sketch.quantiles(quantiles, counts)
+
+
+def quantiles_of(counts, values, quantiles):
+    total = counts.sum()
+    if not total:
+        return [float("nan")] * len(quantiles)
+    cumulative = np.cumsum(counts)
+    # rank of the quantile, as in the lower interpolation of np.percentile
+    ranks = np.floor(np.asarray(quantiles, dtype=np.float64) * (total - 1))
+    return values[np.searchsorted(cumulative, ranks, side="right")].tolist()
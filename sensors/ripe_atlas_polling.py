@@ -1,10 +1,23 @@
+import math
+import os
+import threading
 import time
 
+from concurrent import futures
 from datetime import datetime
 
-from ripe.atlas.cousteau import AtlasLatestRequest, Measurement
 from st2reactor.sensor.base import PollingSensor
 
+from measurement_cache import CACHE_FILE, DEFAULT_MEASUREMENT_CACHE_TTL, MeasurementCache
+from path_index import PathIndex, last_shared_hop
+from probe_state_store import ProbeStateStore, ProbeSummary
+from sensor_metrics import DEFAULT_LOG_EVERY, SampledLogger, SensorMetrics
+from sharding import Shard
+
+# numpy, with the analysis modules built on it, and the requests of the
+# fetcher are imported by the first poll instead of when the sensor module
+# is loaded
+
 
 HARDCODED_MEASUREMENT_ID = 14682099
 
@@ -15,178 +28,614 @@ FROM_FIELD_DIFFERENT_THAN_GENERAL = "atlas.FromFieldDifferentThanGeneral"
 HOST_PARTIALLY_UNREACHABLE = "atlas.HostPartiallyUnreachable"
 # TODO: fix naming. The case for the following trigger is when the host is fully reachable
 HOST_PARTIALLY_REACHABLE = "atlas.HostPartiallyReachable"
+PATH_CHANGED = "atlas.PathChanged"
+PATH_FAULT_LOCALIZED = "atlas.PathFaultLocalized"
+MEASUREMENT_STOPPED = "atlas.MeasurementStopped"
+
+# number of measurements fetched at the same time
+DEFAULT_MAX_CONCURRENT_FETCHES = 8
+# timeout, in seconds, of a single results request
+DEFAULT_FETCH_TIMEOUT = 30
+# directory of the files the sensors keep across restarts
+DEFAULT_CACHE_DIR = "/var/tmp/stackstorm-atlas"
+# how often, in seconds, the probe summaries are checkpointed
+DEFAULT_STATE_CHECKPOINT_INTERVAL = 300
+# probes losing their target behind the same hop reported as one fault,
+# when at least that many and that share of them share the hop
+DEFAULT_FAULT_MIN_PROBES = 3
+FAULT_QUORUM = 0.5
+
+# rtt drift detection modes: rtt median against the previous result with a
+# fixed tolerance, or EWMA of the rtt medians against the probe's history
+RTT_DETECTION_THRESHOLD = "threshold"
+RTT_DETECTION_ZSCORE = "zscore"
+
+
+class WatchedMeasurement(object):
+    """A measurement followed by the polling sensor, together with
+       the probes to query and the results seen on the previous poll.
+    """
+
+    def __init__(self, measurement_id, probes=None, rtt_tolerance=None, rtt_history=None):
+        self.id = measurement_id
+        self.probes = probes
+        self.rtt_tolerance = rtt_tolerance
+        # RttHistory of the probes, in the zscore detection mode
+        self.rtt_history = rtt_history
+        # MeasurementInfo of the measurement, read from the measurement
+        # cache by every poll
+        self.measurement = None
+        # ProbeSummary of the latest result of every probe
+        self.previous_measurement = {}
+        # AddressTable of the addresses found in the results of the
+        # measurement, created by the first analysis
+        self.addresses = None
+        # latest path of every probe, and the probes through every hop; it is
+        # not checkpointed, paths are compared again from the second poll
+        # after a restart
+        self.paths = PathIndex()
+        # newest result timestamp seen so far; polls only ask for results
+        # after it, the per probe marks being the stored_timestamp of the
+        # results kept in previous_measurement
+        self.high_water_mark = None
+        # longest delay, in seconds, between the timestamp and the
+        # stored_timestamp of the latest results: how far behind the high
+        # water mark late results can still show up
+        self.upload_delay = 0
+        # when the next poll of this measurement is due, and how many polls
+        # in a row came back without the results expected by then
+        self.next_poll_at = 0
+        self.missed_polls = 0
+        # set while a worker is fetching or analysing this measurement
+        self.in_flight = False
+        # set when the probe summaries changed since the last checkpoint
+        self.dirty = False
+        # set once the measurement is stopped and was not created again:
+        # it is not polled anymore
+        self.stopped = False
+
 
 class RIPEAtlasPolling(PollingSensor):
 
     # List of statuses when the measurement is considered invalid
     # and the measurement needs to be re-created
-    _stopped_statuses = ["Stopped"]
+    _stopped_statuses = ["Stopped", "Forced to stop", "No suitable probes", "Failed", "Denied", "Canceled"]
     # how long to consider a stale result valid (seconds)
     _measurement_delay_tolerance = 10
+    # shortest time, in seconds, between two polls of the same measurement
+    _min_poll_gap = 10
+    # a measurement is polled again once that share of its probes have a
+    # result due, so probes spread over the interval are fetched in a few
+    # polls per interval instead of one poll per probe
+    _poll_due_share = 0.25
+    # after being stopped for longer than this many measurement intervals,
+    # the sensor starts again from the latest results instead of catching up
+    _max_catch_up_intervals = 4
 
     # tolerance, in ms, of rtt
     _rtt_tolerance = 10
 
+    # zscore detection: number of rtt medians kept per probe, weight of the
+    # newest median in the EWMA, how many standard deviations the EWMA has
+    # to move, and how many medians are needed before detecting anything
+    _rtt_history_size = 24
+    _rtt_ewma_alpha = 0.3
+    _rtt_zscore_threshold = 3.0
+    _rtt_min_history = 8
+
     def __init__(self, sensor_service, config):
         super(RIPEAtlasPolling, self).__init__(sensor_service=sensor_service,
                                                config=config)
         self._logger = self.sensor_service.get_logger(name=self.__class__.__name__)
-        self._previous_measurement = {}
-        self._measurement = None
+        self._watches = []
+        self._executor = None
+        self._fetcher = None
+        self._fetcher_lock = threading.Lock()
+        self._max_workers = DEFAULT_MAX_CONCURRENT_FETCHES
+        self._fetch_timeout = DEFAULT_FETCH_TIMEOUT
+        self._state_store = None
+        self._measurements = None
+        self._recreate_stopped = False
+        self._api_key = None
+        self._checkpoint_interval = DEFAULT_STATE_CHECKPOINT_INTERVAL
+        self._last_checkpoint = time.time()
+        self._rtt_detection = RTT_DETECTION_THRESHOLD
+        self._fault_min_probes = DEFAULT_FAULT_MIN_PROBES
+        self._shard = Shard()
+        self._metrics = SensorMetrics(self.__class__.__name__)
+        self._metrics_dir = None
+        self._debug = SampledLogger(self._logger)
 
     def setup(self):
-        # TODO: implement the actual measurement creation
-        self._measurement = Measurement(id=self._config.get("measurement_id", HARDCODED_MEASUREMENT_ID))
-        self._logger.info("Using measurement with ID %s", self._measurement.id)
-        self._rtt_tolerance = self._config.get("rtt_tolerance", RIPEAtlasPolling._rtt_tolerance)
+        self._rtt_detection = self._config.get("rtt_detection", RTT_DETECTION_THRESHOLD)
+        self._rtt_zscore_threshold = self._config.get("rtt_zscore_threshold", RIPEAtlasPolling._rtt_zscore_threshold)
+        self._rtt_min_history = self._config.get("rtt_min_history", RIPEAtlasPolling._rtt_min_history)
+        self._shard = Shard.from_config(self._config)
+        self._fault_min_probes = self._config.get("fault_min_probes", DEFAULT_FAULT_MIN_PROBES)
+        self._metrics_dir = self._config.get("metrics_dir")
+        self._debug.every = self._config.get("debug_log_every", DEFAULT_LOG_EVERY)
+        self._recreate_stopped = self._config.get("recreate_stopped_measurements", False)
+        self._api_key = self._config.get("atlas_api_key")
+        self._max_workers = self._config.get("max_concurrent_fetches", DEFAULT_MAX_CONCURRENT_FETCHES)
+        self._executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        self._fetch_timeout = self._config.get("fetch_timeout", DEFAULT_FETCH_TIMEOUT)
+        self._load_measurements()
+        self._watches = self._read_watched_measurements()
+        self._logger.info("Watching measurements %s with %s workers, %s",
+                          [watch.id for watch in self._watches], self._max_workers, self._shard)
+        self._restore_state()
+
+    @property
+    def fetcher(self):
+        # the session is opened by the first worker needing it
+        with self._fetcher_lock:
+            if self._fetcher is None:
+                from measurement_fetcher import MeasurementFetcher
+                self._fetcher = MeasurementFetcher(pool_size=self._max_workers, timeout=self._fetch_timeout)
+        return self._fetcher
+
+    def _load_measurements(self):
+        """Reload the measurement meta data cached before the last restart"""
+        path = os.path.join(self._config.get("cache_dir", DEFAULT_CACHE_DIR), CACHE_FILE)
+        self._measurements = MeasurementCache(path, fetch=self._fetch_measurement,
+                                              ttl=self._config.get("measurement_cache_ttl",
+                                                                   DEFAULT_MEASUREMENT_CACHE_TTL))
+        self._logger.info("Restored the meta data of %s measurements", self._measurements.load())
+
+    def _fetch_measurement(self, msm_id):
+        return self.fetcher.measurement(msm_id)
+
+    def _restore_state(self):
+        """Reload the probe summaries checkpointed before the last restart"""
+        cache_dir = self._config.get("cache_dir", DEFAULT_CACHE_DIR)
+        self._checkpoint_interval = self._config.get("state_checkpoint_interval",
+                                                     DEFAULT_STATE_CHECKPOINT_INTERVAL)
+        try:
+            self._state_store = ProbeStateStore(os.path.join(cache_dir, "polling_state.sqlite"))
+            for watch in self._watches:
+                watch.high_water_mark, watch.previous_measurement = self._state_store.load(watch.id)
+                self._logger.info("Restored %s probe summaries of measurement %s",
+                                  len(watch.previous_measurement), watch.id)
+        except Exception:
+            self._logger.exception("Could not restore the probe summaries from %s, starting without them",
+                                   cache_dir)
+            self._state_store = None
+        self._last_checkpoint = time.time()
+
+    def _checkpoint_state(self):
+        if self._state_store is None:
+            return
+        for watch in self._watches:
+            if not watch.dirty:
+                continue
+            watch.dirty = False
+            try:
+                self._state_store.save(watch.id, watch.high_water_mark, watch.previous_measurement)
+            except Exception:
+                self._logger.exception("Checkpointing the probe summaries of measurement %s failed", watch.id)
+                watch.dirty = True
+        self._last_checkpoint = time.time()
+
+    def _read_watched_measurements(self):
+        """Build the watched measurements from the `measurements` list of the
+           config, falling back to the single `measurement_id` / `probes` keys.
+        """
+        default_probes = self._config.get("probes")
+        default_rtt_tolerance = self._config.get("rtt_tolerance", RIPEAtlasPolling._rtt_tolerance)
+        measurements = self._config.get("measurements") or [
+            {"measurement_id": self._config.get("measurement_id", HARDCODED_MEASUREMENT_ID)}
+        ]
+        # with several shards, every measurement is polled by one of them
+        # only; a measurement created again in place of a stopped one is
+        # polled by the shard of the configured one
+        return [WatchedMeasurement(measurement_id=self._measurements.resolve(m["measurement_id"]),
+                                   probes=m.get("probes", default_probes),
+                                   rtt_tolerance=m.get("rtt_tolerance", default_rtt_tolerance),
+                                   rtt_history=self._create_rtt_history())
+                for m in measurements if self._shard.owns(m["measurement_id"])]
+
+    def _create_rtt_history(self):
+        if self._rtt_detection != RTT_DETECTION_ZSCORE:
+            return None
+        from rtt_history import RttHistory
+        return RttHistory(size=self._config.get("rtt_history_size", RIPEAtlasPolling._rtt_history_size),
+                          alpha=self._config.get("rtt_ewma_alpha", RIPEAtlasPolling._rtt_ewma_alpha))
 
     def poll(self):
-        is_success, results = AtlasLatestRequest(msm_id=self._measurement.id,
-                                                 probe_ids=self._config.get('probes')
-                                                 ).create()
-        if is_success:
-            self._logger.info("Measurement reading successful, interpreting results")
-            self._handle_results(results)
+        now = time.time()
+        pending = []
+        # the meta data is refreshed in the background, the polls use the
+        # cached one meanwhile
+        for msm_id in self._measurements.stale([watch.id for watch in self._watches if not watch.stopped], now):
+            self._executor.submit(self._refresh_measurement, msm_id)
+        for watch in self._watches:
+            if watch.stopped or watch.next_poll_at > now:
+                continue
+            if watch.in_flight:
+                self._logger.warn("Measurement %s is still being processed by a previous poll, skipping",
+                                  watch.id)
+                continue
+            watch.in_flight = True
+            pending.append(self._executor.submit(self._poll_measurement, watch))
+        # wait for the fetches of this cycle, but no longer than a request timeout:
+        # a slow measurement keeps running in its worker and is skipped by the
+        # next polls until it is done, without holding up the other measurements
+        futures.wait(pending, timeout=self._fetch_timeout)
+        if time.time() - self._last_checkpoint >= self._checkpoint_interval:
+            self._checkpoint_state()
+        self._publish_metrics()
+        self._schedule_next_wakeup()
+
+    def _publish_metrics(self):
+        if not self._metrics_dir:
+            return
+        self._metrics.gauge("watched_measurements", len(self._watches))
+        self._metrics.gauge("stopped_measurements", sum(1 for watch in self._watches if watch.stopped))
+        try:
+            self._metrics.write(self._metrics_dir)
+        except (IOError, OSError):
+            self._logger.exception("Could not write the metrics to %s", self._metrics_dir)
+
+    def _schedule_next_wakeup(self):
+        """Sleep until the earliest measurement is due instead of a fixed interval"""
+        now = time.time()
+        watches = [watch for watch in self._watches if not watch.stopped]
+        due_times = [watch.next_poll_at for watch in watches if not watch.in_flight]
+        if len(due_times) < len(watches):
+            # measurements still in flight get rescheduled when their worker is done
+            due_times.append(now + self._min_poll_gap)
+        if not due_times:
+            # every measurement is stopped, there is nothing left to poll
+            due_times.append(now + self._measurements.ttl)
+        self.set_poll_interval(max(1, min(due_times) - now))
+
+    def _poll_measurement(self, watch):
+        try:
+            info = self._measurements.get(watch.id)
+            if info is None:
+                is_success, info = self._measurements.refresh(watch.id)
+                if not is_success:
+                    self._metrics.count("failed_polls")
+                    self._handle_atlas_error(watch, info)
+                    return
+                self._logger.info("Using measurement with ID %s", watch.id)
+            watch.measurement = info
+            if info.status in self._stopped_statuses:
+                self._handle_stopped_measurement(watch, info)
+                return
+            with self._metrics.timer("fetch"):
+                is_success, results = self._fetch_new_results(watch)
+            self._metrics.count("polls")
+            if is_success:
+                self._logger.info("Measurement %s reading successful, interpreting results", watch.id)
+                self._metrics.count("results", len(results))
+                self._handle_results(watch, results)
+            else:
+                self._metrics.count("failed_polls")
+                self._handle_atlas_error(watch, results)
+        except Exception:
+            self._logger.exception("Polling measurement %s failed", watch.id)
+            self._metrics.count("failed_polls")
+        finally:
+            if not watch.stopped:
+                self._schedule_next_poll(watch)
+            watch.in_flight = False
+
+    def _refresh_measurement(self, msm_id):
+        try:
+            with self._metrics.timer("metadata_refresh"):
+                is_success, info = self._measurements.refresh(msm_id)
+            if not is_success:
+                self._logger.warn("Refreshing the meta data of measurement %s failed, using the cached one: %s",
+                                  msm_id, info)
+        except Exception:
+            self._logger.exception("Refreshing the meta data of measurement %s failed", msm_id)
+
+    def _handle_stopped_measurement(self, watch, info):
+        """Create the stopped measurement again when allowed to, otherwise
+           stop polling it: it will not have any new results
+        """
+        new_msm_id = None
+        if self._recreate_stopped and self._api_key:
+            new_msm_id = self._recreate_measurement(watch, info)
+        self._send_trigger(trigger=MEASUREMENT_STOPPED, payload={
+            "msm_id": watch.id,
+            "timestamp": str(datetime.now()),
+            "status": info.status,
+            "new_msm_id": new_msm_id,
+        })
+        if new_msm_id is None:
+            self._logger.warn("Measurement %s is %s, not polling it anymore", watch.id, info.status)
+            watch.stopped = True
+            return
+        self._logger.info("Measurement %s is %s, polling measurement %s created in its place",
+                          watch.id, info.status, new_msm_id)
+        self._measurements.replace(watch.id, new_msm_id)
+        # the probe summaries are kept: the new measurement has the same
+        # target and probes, its results are compared with the old ones
+        watch.id = new_msm_id
+        watch.measurement = None
+        watch.high_water_mark = None
+        watch.missed_polls = 0
+        watch.dirty = True
+
+    def _recreate_measurement(self, watch, info):
+        """Create a measurement with the definition and the participant
+           probes of a stopped one; returns its id, None if it failed
+        """
+        probe_ids = info.probes or watch.probes
+        if not info.type or not probe_ids:
+            self._logger.error("Cannot create measurement %s again, its type or probes are unknown", watch.id)
+            return None
+        is_success, response = self.fetcher.create_measurement(
+            self._api_key, dict(info.definition, type=info.type), probe_ids)
+        if not is_success:
+            self._logger.error("Creating measurement %s again failed: %s", watch.id, response)
+            return None
+        self._metrics.count("recreated_measurements")
+        return response["measurements"][0]
+
+    def _schedule_next_poll(self, watch):
+        """Poll the measurement again when a share of its probes have their
+           next result due: stored timestamp + measurement interval +
+           tolerance. Probes overdue by more than an interval are taken as
+           offline and left out. While that share of results is overdue, back
+           off exponentially up to an interval.
+        """
+        now = time.time()
+        interval = watch.measurement.interval if watch.measurement else None
+
+        expected = []
+        if interval:
+            expected = sorted(due for due in (summary.stored_timestamp + interval + self._measurement_delay_tolerance
+                                              for summary in list(watch.previous_measurement.values()))
+                              if due > now - interval)
+        if expected:
+            due = expected[int(math.ceil(self._poll_due_share * len(expected))) - 1]
+            if due <= now:
+                # the results due by the previous poll are still missing
+                watch.missed_polls += 1
+                backoff = self._measurement_delay_tolerance * 2 ** watch.missed_polls
+                due = now + min(backoff, interval)
+            else:
+                watch.missed_polls = 0
         else:
-            self._handle_atlas_error()
+            watch.missed_polls = 0
+            due = now + (interval or self.get_poll_interval())
 
-    def _handle_results(self, results):
-        if len(results) != len(self._previous_measurement):
-            self._logger.warn("Different number of probes found compared to previous measurements: %s now vs %s historical",
-                              len(results), len(self._previous_measurement))
+        watch.next_poll_at = max(now + self._min_poll_gap, due)
+        self._logger.debug("Next poll of measurement %s in %.0fs", watch.id, watch.next_poll_at - now)
+
+    def _fetch_new_results(self, watch):
+        """Fetch the results stored since the previous poll. Only the latest
+           result of every probe is returned, and only if it is newer than
+           the one already compared for that probe.
+        """
+        interval = watch.measurement.interval
+        if (watch.high_water_mark is None or
+                time.time() - watch.high_water_mark > self._max_catch_up_intervals * interval):
+            is_success, results = self.fetcher.latest(watch.id, watch.probes)
+        else:
+            # look back only as far as the probes were seen uploading late
+            margin = min(interval, watch.upload_delay + self._measurement_delay_tolerance)
+            start = watch.high_water_mark - margin
+            is_success, results = self.fetcher.results_since(watch.id, start, watch.probes)
+        if not is_success:
+            return is_success, results
+
+        latest_results = {}
         for probe_result in results:
-            new_probe_result = probe_result
-            if probe_result["prb_id"] in self._previous_measurement:
-                self._compare_probe_stats(self._previous_measurement[probe_result["prb_id"]],
-                                          new_probe_result)
-            else:
-                self._logger.info("This is the first time probe %s is seen, adding", probe_result["prb_id"])
+            latest_result = latest_results.get(probe_result["prb_id"])
+            if latest_result is None or probe_result["timestamp"] > latest_result["timestamp"]:
+                latest_results[probe_result["prb_id"]] = probe_result
+        if latest_results:
+            watch.high_water_mark = max([watch.high_water_mark or 0] +
+                                        [r["timestamp"] for r in latest_results.values()])
+            watch.upload_delay = max(r["stored_timestamp"] - r["timestamp"] for r in latest_results.values())
+
+        new_results = []
+        for prb_id, probe_result in latest_results.items():
+            previous_result = watch.previous_measurement.get(prb_id)
+            if previous_result is None or probe_result["stored_timestamp"] > previous_result.stored_timestamp:
+                new_results.append(probe_result)
+        return is_success, new_results
+
+    def _handle_results(self, watch, results):
+        previous_measurement = watch.previous_measurement
+        self._logger.info("Measurement %s has new results for %s probes, %s probes known",
+                          watch.id, len(results), len(previous_measurement))
+        from traceroute_analysis import AddressTable, TracerouteBatch
+        if watch.addresses is None:
+            watch.addresses = AddressTable()
+        with self._metrics.timer("parse"):
+            batch = TracerouteBatch(results, watch.addresses)
+        previous_results = [previous_measurement.get(probe_result["prb_id"]) for probe_result in results]
+
+        with self._metrics.timer("analyze"):
+            changes = self._compare_probe_stats(watch, batch, previous_results)
+            self._validate_from_fields(watch, batch, changes)
+
+        # only a summary of the new results is kept, to compare the next ones with
+        previous_measurement.update(
+            (prb_id, ProbeSummary(*summary))
+            for prb_id, summary in zip(batch.prb_ids.tolist(),
+                                       zip(batch.stored_timestamp.tolist(), batch.hop_count.tolist(),
+                                           batch.rtt_median.tolist(), batch.unreachable.tolist(),
+                                           batch.from_hash.tolist())))
+        watch.dirty = watch.dirty or len(results) > 0
+
+    def _payload_base(self, watch, prb_id):
+        return {
+            "msm_id": watch.id,
+            "prb_id": int(prb_id),
+            "timestamp": str(datetime.now())
+        }
 
-            self._validate_from_fields(new_probe_result)
+    def _compare_probe_stats(self, watch, batch, previous_results, ingore_stale_results=True):
+        import numpy as np
+        from traceroute_analysis import PreviousColumns
 
-            self._previous_measurement[probe_result["prb_id"]] = new_probe_result
+        previous = PreviousColumns(
+            known=[r is not None for r in previous_results],
+            stored_timestamp=[r.stored_timestamp if r else 0 for r in previous_results],
+            hop_count=[r.hop_count if r else 0 for r in previous_results],
+            unreachable=[r.unreachable if r else False for r in previous_results],
+            rtt_median=[r.rtt_median if r else np.nan for r in previous_results])
+        for row in np.flatnonzero(~previous.known):
+            self._debug.debug("This is the first time probe %s is seen, adding", batch.prb_ids[row])
 
-    def _compare_probe_stats(self, old_probe_result, new_probe_result, ingore_stale_results=True):
         # discard results if measurement was not made
         # measurement is not made if the stored timestamp is the same and the expected next
         # measurement is due in the future: stored timestamp + measurement interval + tolerance
         # is the speculated next update time
-        measurements_stale_deadline = (new_probe_result["stored_timestamp"] +
-                                       self._measurement.interval +
-                                       self._measurement_delay_tolerance)
-        now = int(time.time())
         # TODO: define alert for probable stale for more than stale deadline
-        if all([new_probe_result["stored_timestamp"] == old_probe_result["stored_timestamp"],
-                measurements_stale_deadline > now,
-                ingore_stale_results]):
-            self._logger.info("Measurements for probe %s not fresh enough. Expecting new measurements at latest at %s "
-                              "Now: %s",
-                              old_probe_result["prb_id"], measurements_stale_deadline, now)
-            return
-
-        payload_base = {
-            "prb_id": old_probe_result["prb_id"],
-            "timestamp": str(datetime.now())
-        }
-        if len(old_probe_result["result"]) != len(new_probe_result["result"]):
-             self._send_trigger(trigger=HOPS_NUMBER_CHANGED,
-                                payload=dict({"old_hops_number": len(old_probe_result["result"]),
-                                              "new_hops_number": len(new_probe_result["result"])},
-                                              **payload_base))
+        changes = batch.compare(previous, rtt_tolerance=watch.rtt_tolerance,
+                                stale_after=watch.measurement.interval + self._measurement_delay_tolerance,
+                                now=int(time.time()), ignore_stale_results=ingore_stale_results)
+        if changes.stale.any():
+            self._logger.info("Measurements for %s probes of measurement %s not fresh enough",
+                              changes.stale.sum(), watch.id)
+
+        for row in np.flatnonzero(changes.hops_changed):
+            self._send_trigger(trigger=HOPS_NUMBER_CHANGED,
+                               payload=dict({"old_hops_number": int(previous.hop_count[row]),
+                                             "new_hops_number": int(batch.hop_count[row])},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
         # TODO: add detailed state, for host becoming reacheable / unreachable
         # inside the same result, per iteration of proble try
-        if (self._probe_results_host_unreachable(old_probe_result["result"]) or
-            self._probe_results_host_unreachable(new_probe_result["result"])):
-            self._logger.warn("Host was unreacheable in current or previous attempt of probe %s",
-                              old_probe_result["prb_id"])
-
-            if (self._probe_results_host_unreachable(new_probe_result["result"]) and not
-                self._probe_results_host_unreachable(old_probe_result["result"])):
-                self._send_trigger(trigger=HOST_PARTIALLY_REACHABLE,
-                                   payload=dict({"dst_addr": new_probe_result["dst_addr"]},
-                                                **payload_base))
-
-            if (self._probe_results_host_unreachable(old_probe_result["result"]) and not
-                self._probe_results_host_unreachable(new_probe_result["result"])):
-                self._send_trigger(trigger=HOST_PARTIALLY_UNREACHABLE,
-                                   payload=dict({"dst_addr": new_probe_result["dst_addr"]},
-                                                **payload_base))
-            return
-
-        self._logger.info("Looks like the results do not have unreachables %s\n%s",
-                          old_probe_result["result"],
-                          new_probe_result["result"])
-        hops_comparison_result = self._compare_hops_median(old_probe_result, new_probe_result)
-        if hops_comparison_result is not True:
+        for row in np.flatnonzero(changes.any_unreachable):
+            self._debug.debug("Host was unreacheable in current or previous attempt of probe %s",
+                              batch.prb_ids[row])
+        localized = self._localize_fault(watch, batch, np.flatnonzero(changes.became_unreachable))
+        for row in np.flatnonzero(changes.became_unreachable & ~localized):
+            self._send_trigger(trigger=HOST_PARTIALLY_REACHABLE,
+                               payload=dict({"dst_addr": batch.results[row]["dst_addr"]},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
+        for row in np.flatnonzero(changes.became_reachable):
+            self._send_trigger(trigger=HOST_PARTIALLY_UNREACHABLE,
+                               payload=dict({"dst_addr": batch.results[row]["dst_addr"]},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
+        self._compare_paths(watch, batch, changes)
+
+        # the rtt median is only compared for results without unreachables
+        if watch.rtt_history is not None:
+            self._detect_rtt_drift(watch, batch, changes)
+            return changes
+        for row in np.flatnonzero(changes.rtt_changed):
             self._send_trigger(trigger=RTT_NUMBER_CHANGED,
-                               payload=dict({"old_hops_median": hops_comparison_result[0],
-                                             "new_hops_median": hops_comparison_result[1]},
-                                             **payload_base))
-
-    def _validate_from_fields(self, new_probe_result):
-        if self._probe_results_host_unreachable(new_probe_result["result"]):
-            self._logger.info("Probe results contain cases when the target was not reached. Not validating `from` fields")
-            return
+                               payload=dict({"old_hops_median": float(previous.rtt_median[row]),
+                                             "new_hops_median": float(batch.rtt_median[row])},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
+        return changes
+
+    def _localize_fault(self, watch, batch, rows):
+        """Report the probes that lost their target behind the same hop as a
+           single fault of the last hop they share. Returns the mask of the
+           rows of the reported probes.
+        """
+        import numpy as np
+
+        localized = np.zeros(len(batch), dtype=bool)
+        if len(rows) < self._fault_min_probes:
+            return localized
+        row_of = dict((batch.prb_ids[row], row) for row in rows.tolist())
+        shared = last_shared_hop(((prb_id, batch.responsive_prefix(row)) for prb_id, row in row_of.items()),
+                                 self._fault_min_probes, FAULT_QUORUM)
+        if shared is None:
+            return localized
+        address, position, prb_ids = shared
+        localized[[row_of[prb_id] for prb_id in prb_ids]] = True
+        self._send_trigger(trigger=PATH_FAULT_LOCALIZED, payload={
+            "msm_id": watch.id,
+            "timestamp": str(datetime.now()),
+            "hop_address": watch.addresses.addresses[address],
+            "hop_position": position + 1,
+            "probe_ids": [int(prb_id) for prb_id in prb_ids],
+            "affected_probes": len(row_of),
+            # probes whose previous path went through the hop
+            "probes_through_hop": len(watch.paths.probes_through(address)),
+        })
+        return localized
+
+    def _compare_paths(self, watch, batch, changes):
+        """Update the path index with the new results, and report the probes
+           that reached their target both times over another path
+        """
+        import numpy as np
+
+        paths = watch.paths
+        compared = ~changes.stale & ~batch.unreachable & ~changes.previous.unreachable
+        for row in np.flatnonzero(~changes.stale).tolist():
+            prb_id = int(batch.prb_ids[row])
+            old_path = paths.path_of(prb_id)
+            old_path_id, path_id = paths.update(prb_id, batch.path(row))
+            if old_path_id is None or old_path_id == path_id or not compared[row]:
+                continue
+            self._send_trigger(trigger=PATH_CHANGED,
+                               payload=dict({"old_path": self._addresses_of(watch, old_path),
+                                             "new_path": self._addresses_of(watch, paths.path(path_id))},
+                                            **self._payload_base(watch, prb_id)))
+
+    def _addresses_of(self, watch, path):
+        return [watch.addresses.addresses[code] if code >= 0 else None for code in path]
+
+    def _detect_rtt_drift(self, watch, batch, changes):
+        """zscore detection mode: add the new rtt medians to the history of
+           their probes and report the probes whose EWMA drifted significantly
+           from their rolling mean.
+        """
+        import numpy as np
 
-        self._logger.info("Validating the consistency of the `from` fields from the probe result")
-        froms = set([result_iteration['from']
-                     for probe_result in new_probe_result['result']
-                     for result_iteration in probe_result['result']])
-        self._logger.info("Found unique `from` values: %s", froms)
-        if len(froms) != 1:
-            self._logger.info("Expected unique `from` field, found %s", froms)
+        observed = np.flatnonzero(~batch.unreachable & ~changes.stale & ~np.isnan(batch.rtt_median))
+        drift = watch.rtt_history.observe(batch.prb_ids[observed].tolist(), batch.rtt_median[observed])
+        significant = drift.significant(self._rtt_zscore_threshold, self._rtt_min_history, watch.rtt_tolerance)
+        for index in np.flatnonzero(significant):
+            row = observed[index]
+            self._send_trigger(trigger=RTT_NUMBER_CHANGED,
+                               payload=dict({"old_hops_median": float(drift.mean[index]),
+                                             "new_hops_median": float(batch.rtt_median[row]),
+                                             "rtt_ewma": float(drift.ewma[index]),
+                                             "zscore": float(drift.zscore[index])},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
+
+    def _validate_from_fields(self, watch, batch, changes):
+        import numpy as np
+
+        # Probe results containing cases when the target was not reached are not validated
+        for row in np.flatnonzero(changes.from_differs_in_attempts):
+            froms = batch.froms(row)
+            self._debug.debug("Expected unique `from` field for probe %s, found %s", batch.prb_ids[row], froms)
             self._send_trigger(trigger=FROM_FIELD_DIFFERENT_IN_ATTEMPTS,
                                payload=dict({"hops_froms": repr(froms)},
-                                             **payload_base))
+                                            **self._payload_base(watch, batch.prb_ids[row])))
 
-        if len(froms.difference({new_probe_result["dst_addr"]})) != 0:
-            self._logger.info("At least one of the from fields %s is not the same as the expected one %s",
-                              froms, new_probe_result["dst_addr"])
+        for row in np.flatnonzero(changes.from_differs_from_dst):
+            froms = batch.froms(row)
+            dst_addr = batch.results[row]["dst_addr"]
+            self._debug.debug("At least one of the from fields %s is not the same as the expected one %s",
+                              froms, dst_addr)
             self._send_trigger(trigger=FROM_FIELD_DIFFERENT_THAN_GENERAL,
-                               payload=dict({"expected_from_field": new_probe_result["dst_addr"],
-                                             "found_from_fields": froms},
-                                             **payload_base))
-
-    def _probe_results_host_unreachable(self, probe_results):
-        """ Checking if the marker for an unreachable host is present
-            in the probe results. The expected item is {"x": "*"}.
-            A host is considered unreachable if the marker is found.
-        """
-        self._logger.info("Checking if the probe results contain results that indicate that the host was not reached")
-        unreacheable_marker = {"x": "*"}
-        return any([unreacheable_marker in probe_result['result']
-                    for probe_result in probe_results])
-
-    def _compare_hops_median(self, old_probe_result, new_probe_result):
-        self._logger.info("_compare_hops_median")
-        self._logger.info("old_probe_result = %s", old_probe_result)
-        self._logger.info("new_probe_result = %s", new_probe_result)
-        old_rtt_median = old_probe_result.get("__rtt_median",
-                            median([result_iteration['rtt']
-                                    for probe_result in old_probe_result['result']
-                                    for result_iteration in probe_result['result']]))
-        new_rtt_median = median([result_iteration['rtt']
-                                 for probe_result in new_probe_result['result']
-                                 for result_iteration in probe_result['result']])
-        # cache the rtt median for the new result
-        new_probe_result["__rtt_median"] = new_rtt_median
-        self._logger.info("Calculated RTT median: old %s new %s", old_rtt_median, new_rtt_median)
-        if not (old_rtt_median - self._rtt_tolerance <=
-                new_rtt_median <=
-                old_rtt_median + self._rtt_tolerance):
-
-            return old_rtt_median, new_rtt_median
-        return True
+                               payload=dict({"expected_from_field": dst_addr,
+                                             "found_from_fields": repr(froms)},
+                                            **self._payload_base(watch, batch.prb_ids[row])))
 
     def _send_trigger(self, trigger, payload):
-        self._logger.info("_send_trigger triggered with %s %s", trigger, payload)
-        self._sensor_service.dispatch(trigger=trigger, payload=payload)
+        self._debug.debug("_send_trigger triggered with %s %s", trigger, payload)
+        with self._metrics.timer("dispatch"):
+            self._sensor_service.dispatch(trigger=trigger, payload=payload)
+        self._metrics.count("dispatched")
 
-    def _handle_atlas_error():
-        pass
+    def _handle_atlas_error(self, watch, error):
+        self._logger.error("Reading measurement %s failed: %s", watch.id, error)
 
     def cleanup(self):
-        pass
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        if self._fetcher:
+            self._fetcher.close()
+        if self._state_store:
+            self._checkpoint_state()
+            self._state_store.close()
 
     def add_trigger(self, trigger):
         # This method is called when trigger is created
@@ -199,14 +648,3 @@ class RIPEAtlasPolling(PollingSensor):
     def remove_trigger(self, trigger):
         # This method is called when trigger is deleted
         pass
-
-#TODO: move helper functions below to different module
-def median(array):
-    """Calculate median of the given list. Backport from Python 3
-       statistics.median for python 3
-    """
-    array = sorted(array)
-    half, odd = divmod(len(array), 2)
-    if odd:
-        return array[half]
-    return (array[half - 1] + array[half]) / 2.0
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class RttDrift(object):
+    """Drift of new rtt medians against the history of their probes: the
+       window mean, standard deviation and sample count before the new
+       values, the EWMA after them, and the z-score of that EWMA.
+
+       As in an EWMA control chart, the z-score uses the standard deviation
+       of the EWMA itself, std * sqrt(alpha / (2 - alpha)).
+    """
+
+    def __init__(self, mean, std, samples, ewma, alpha):
+        self.mean = mean
+        self.std = std
+        self.samples = samples
+        self.ewma = ewma
+        ewma_std = std * np.sqrt(alpha / (2.0 - alpha))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.zscore = np.where(ewma_std > 0, (ewma - mean) / ewma_std, 0.0)
+
+    def significant(self, threshold, min_samples, min_delta):
+        """Rows whose EWMA moved at least `threshold` standard deviations and
+           `min_delta` ms away from a mean of at least `min_samples` values
+        """
+        return ((self.samples >= min_samples) &
+                (np.abs(self.zscore) >= threshold) &
+                (np.abs(self.ewma - self.mean) > min_delta))
+
+
+class RttHistory(object):
+    """Fixed size history of the rtt medians of the probes of a measurement.
+
+       Every probe owns a row of a preallocated ring buffer; the rolling sum,
+       sum of squares and EWMA of each row are updated in O(1) per new value,
+       so the memory is bounded by probes x size whatever the uptime.
+    """
+
+    def __init__(self, size=24, alpha=0.3, initial_rows=64):
+        self.size = size
+        self.alpha = alpha
+        self._rows = {}
+        self._values = np.zeros((initial_rows, size), dtype=np.float32)
+        self._position = np.zeros(initial_rows, dtype=np.int32)
+        self._count = np.zeros(initial_rows, dtype=np.int32)
+        self._sum = np.zeros(initial_rows)
+        self._sum_sq = np.zeros(initial_rows)
+        self._ewma = np.zeros(initial_rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _rows_of(self, prb_ids):
+        rows = self._rows
+        for prb_id in prb_ids:
+            if prb_id not in rows:
+                rows[prb_id] = len(rows)
+        if len(rows) > len(self._position):
+            self._grow(len(rows))
+        return np.array([rows[prb_id] for prb_id in prb_ids], dtype=np.int64)
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._position))
+        extra = capacity - len(self._position)
+        self._values = np.vstack((self._values, np.zeros((extra, self.size), dtype=np.float32)))
+        self._position = np.concatenate((self._position, np.zeros(extra, dtype=np.int32)))
+        self._count = np.concatenate((self._count, np.zeros(extra, dtype=np.int32)))
+        self._sum = np.concatenate((self._sum, np.zeros(extra)))
+        self._sum_sq = np.concatenate((self._sum_sq, np.zeros(extra)))
+        self._ewma = np.concatenate((self._ewma, np.zeros(extra)))
+
+    def observe(self, prb_ids, values):
+        """Add one new rtt median for each of the given (distinct) probes and
+           return the RttDrift of the new values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        rows = self._rows_of(prb_ids)
+        count = self._count[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(count > 0, self._sum[rows] / count, np.nan)
+            variance = np.where(count > 0, self._sum_sq[rows] / count - mean ** 2, np.nan)
+        std = np.sqrt(np.clip(variance, 0, None))
+
+        position = self._position[rows]
+        evicted = np.where(count == self.size, self._values[rows, position], 0.0).astype(np.float64)
+        stored = values.astype(np.float32)
+        self._sum[rows] += stored - evicted
+        self._sum_sq[rows] += stored.astype(np.float64) ** 2 - evicted ** 2
+        self._values[rows, position] = stored
+        self._position[rows] = (position + 1) % self.size
+        self._count[rows] = np.minimum(count + 1, self.size)
+        self._ewma[rows] = np.where(count > 0, self.alpha * values + (1 - self.alpha) * self._ewma[rows], values)
+
+        # the running sums drift with floating point errors: recompute them
+        # exactly whenever a row wraps around
+        wrapped = rows[self._position[rows] == 0]
+        if len(wrapped):
+            window = self._values[wrapped].astype(np.float64)
+            self._sum[wrapped] = window.sum(axis=1)
+            self._sum_sq[wrapped] = (window ** 2).sum(axis=1)
+
+        return RttDrift(mean, std, count, self._ewma[rows].copy(), self.alpha)
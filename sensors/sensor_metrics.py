@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from collections import defaultdict
+
+# upper bounds, in seconds, of the buckets of the stage histograms
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# one in that many per message debug logs is written
+DEFAULT_LOG_EVERY = 100
+
+METRIC_PREFIX = "atlas_sensor"
+
+
+class Histogram(object):
+    """Cumulative histogram of durations, in the Prometheus bucket layout"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class _Timer(object):
+
+    __slots__ = ("_metrics", "_stage", "_started")
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._stage, time.perf_counter() - self._started)
+
+
+class SensorMetrics(object):
+    """Counters, gauges and stage latency histograms of a sensor, rendered in
+       the Prometheus text format, e.g. for the textfile collector of the
+       node exporter:
+
+           atlas_sensor_events_total{sensor="PingStreamingSensor",event="received"} 1234
+           atlas_sensor_stage_seconds_bucket{sensor="PingStreamingSensor",stage="process",le="0.001"} 1200
+    """
+
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, event, value=1):
+        with self._lock:
+            self.counters[event] += value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, stage):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, stage)
+
+    def render(self):
+        sensor = 'sensor="{}"'.format(self.sensor)
+        lines = ["# TYPE {}_events_total counter".format(METRIC_PREFIX)]
+        with self._lock:
+            lines.extend('{}_events_total{{{},event="{}"}} {}'.format(METRIC_PREFIX, sensor, event, value)
+                         for event, value in sorted(self.counters.items()))
+            lines.append("# TYPE {}_gauge gauge".format(METRIC_PREFIX))
+            lines.extend('{}_gauge{{{},name="{}"}} {}'.format(METRIC_PREFIX, sensor, name, value)
+                         for name, value in sorted(self.gauges.items()))
+            lines.append("# TYPE {}_stage_seconds histogram".format(METRIC_PREFIX))
+            for stage, histogram in sorted(self.histograms.items()):
+                labels = '{},stage="{}"'.format(sensor, stage)
+                lines.extend('{}_stage_seconds_bucket{{{},le="{}"}} {}'.format(
+                    METRIC_PREFIX, labels, "+Inf" if bound == float("inf") else bound, total)
+                    for bound, total in histogram.cumulative())
+                lines.append("{}_stage_seconds_sum{{{}}} {}".format(METRIC_PREFIX, labels, histogram.sum))
+                lines.append("{}_stage_seconds_count{{{}}} {}".format(METRIC_PREFIX, labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory):
+        """Replace <directory>/<sensor>.prom with the current metrics"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "{}.prom".format(self.sensor))
+        with open(path + ".tmp", "w") as f:
+            f.write(self.render())
+        os.rename(path + ".tmp", path)
+
+
+class SampledLogger(object):
+    """Debug logging for the per message paths: nothing is formatted unless
+       debug is enabled, and only one in `every` calls of each message is
+       logged, with the number of calls it stands for.
+    """
+
+    def __init__(self, logger, every=DEFAULT_LOG_EVERY):
+        self._logger = logger
+        self.every = max(1, every)
+        self._calls = defaultdict(int)
+
+    def debug(self, msg, *args):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        calls = self._calls[msg] = self._calls[msg] + 1
+        if calls % self.every == 1 or self.every == 1:
+            self._logger.debug(msg + " (call %s, 1 in %s logged)", *(args + (calls, self.every)))
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+DEFAULT_GUARD_SIZE = 100000
+
+
+class SequenceGuard(object):
+    """Drops the stream messages already seen, or older than the last one of
+       their key, e.g. replayed by the stream after a reconnect.
+
+       The timestamp of the last message of every key is kept, with a tag
+       telling apart different messages of the same timestamp; a message
+       with the same timestamp and tag is a duplicate, one with an older
+       timestamp is stale. Keys are evicted least recently seen first past
+       `max_keys`, so the memory is fixed; the first message of an evicted
+       key always goes through.
+    """
+
+    def __init__(self, max_keys=DEFAULT_GUARD_SIZE):
+        self.max_keys = max_keys
+        self._last = OrderedDict()
+        self.duplicates = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def accept(self, key, timestamp, tag=None):
+        """Whether a message is new, in which case it becomes the last one
+           of its key
+        """
+        last = self._last.get(key)
+        if last is not None:
+            if timestamp < last[0]:
+                self.stale += 1
+                return False
+            if timestamp == last[0] and tag == last[1]:
+                self.duplicates += 1
+                return False
+            self._last.move_to_end(key)
+        self._last[key] = (timestamp, tag)
+        if len(self._last) > self.max_keys:
+            self._last.popitem(last=False)
+        return True
@@ -0,0 +1,69 @@
+import numbers
+import zlib
+
+_MASK = 0xffffffffffffffff
+
+
+def _mix(value):
+    """splitmix64 finalizer of a 64 bit integer"""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & _MASK
+    return value ^ (value >> 31)
+
+
+def key_hash(key):
+    """Hash of a shard key, stable across processes and restarts unlike hash()"""
+    if isinstance(key, numbers.Integral) and not isinstance(key, bool):
+        return int(key) & _MASK
+    return zlib.crc32(str(key).encode("utf-8"))
+
+
+class Shard(object):
+    """The share of the keys, measurements, probes or groups, owned by one of
+       `count` sensor instances.
+
+       Keys are assigned by rendezvous hashing: every key goes to the shard
+       with the highest score of (key, shard). All instances agree on the
+       owner without talking to each other, and when the shard count changes
+       only the keys whose highest score moved to an added or removed shard
+       change owner.
+    """
+
+    def __init__(self, index=0, count=1):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("Invalid shard {} of {}, expected 0 <= shard_index < shard_count".format(index, count))
+        self.index = index
+        self.count = count
+        self._salts = [_mix(shard + 1) for shard in range(count)]
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("shard_index", 0), config.get("shard_count", 1))
+
+    def __repr__(self):
+        return "Shard({} of {})".format(self.index, self.count)
+
+    def owner(self, key):
+        hashed = key_hash(key)
+        scores = [_mix(hashed ^ salt) for salt in self._salts]
+        return scores.index(max(scores))
+
+    def owns(self, key):
+        return self.count == 1 or self.owner(key) == self.index
+
+    def owned(self, keys):
+        """Mask of the integer keys of an array owned by this shard"""
+        import numpy as np
+
+        keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+        if self.count == 1:
+            return np.ones(len(keys), dtype=bool)
+        scores = np.stack([_mix_array(np, keys ^ np.uint64(salt)) for salt in self._salts])
+        return np.argmax(scores, axis=0) == self.index
+
+
+def _mix_array(np, values):
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return values ^ (values >> np.uint64(31))
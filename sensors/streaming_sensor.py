@@ -0,0 +1,303 @@
+import threading
+import time
+
+from collections import deque
+
+from st2reactor.sensor.base import Sensor
+
+from sensor_metrics import DEFAULT_LOG_EVERY, SampledLogger, SensorMetrics
+from sequence_guard import DEFAULT_GUARD_SIZE, SequenceGuard
+from sharding import Shard
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_WORKERS = 4
+DEFAULT_OVERFLOW_POLICY = OVERFLOW_BLOCK
+# how often, in seconds, the stream metrics are logged and the connection checked
+DEFAULT_METRICS_INTERVAL = 60
+MAX_RECONNECT_DELAY = 60
+
+
+class PartitionedQueue(object):
+    """Bounded queue split in partitions, each drained by a single worker.
+
+       Messages with the same key always land in the same partition, so they
+       are processed in the order they were received. When a partition is
+       full the overflow policy decides what happens to a new message:
+
+       - block: the producer waits until the worker makes room
+       - drop_oldest: the oldest pending message of the partition is dropped
+       - coalesce: the new message replaces the pending one with the same
+         coalesce key, or the oldest pending message if there is none
+    """
+
+    def __init__(self, partitions, maxsize, policy=DEFAULT_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}, expected one of {}".format(
+                policy, ", ".join(OVERFLOW_POLICIES)))
+        self.policy = policy
+        self.partition_size = max(1, maxsize // partitions)
+        self._partitions = [deque() for _ in range(partitions)]
+        # pending entry of every coalesce key, by partition
+        self._pending = [{} for _ in range(partitions)]
+        self._conditions = [threading.Condition() for _ in range(partitions)]
+        self._closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return sum(len(partition) for partition in self._partitions)
+
+    def partition_of(self, key):
+        return hash(key) % len(self._partitions)
+
+    def put(self, key, message, coalesce_key=None):
+        index = self.partition_of(key)
+        partition, pending = self._partitions[index], self._pending[index]
+        condition = self._conditions[index]
+        with condition:
+            if len(partition) >= self.partition_size:
+                if self.policy == OVERFLOW_BLOCK:
+                    while len(partition) >= self.partition_size and not self._closed:
+                        condition.wait()
+                elif self.policy == OVERFLOW_COALESCE and coalesce_key in pending:
+                    pending[coalesce_key][1] = message
+                    self.coalesced += 1
+                    return
+                else:
+                    dropped = partition.popleft()
+                    if pending.get(dropped[0]) is dropped:
+                        del pending[dropped[0]]
+                    self.dropped += 1
+            if self._closed:
+                return
+            entry = [coalesce_key, message, time.time()]
+            partition.append(entry)
+            if coalesce_key is not None:
+                pending[coalesce_key] = entry
+            condition.notify_all()
+
+    def get(self, index):
+        """Oldest message of a partition and the time it was queued, or None
+           once the queue is closed
+        """
+        partition, pending = self._partitions[index], self._pending[index]
+        condition = self._conditions[index]
+        with condition:
+            while not partition and not self._closed:
+                condition.wait()
+            if not partition:
+                return None
+            entry = partition.popleft()
+            if pending.get(entry[0]) is entry:
+                del pending[entry[0]]
+            condition.notify_all()
+        return entry[1], entry[2]
+
+    def oldest(self):
+        """Time the oldest pending message was queued, None if empty"""
+        queued = []
+        for partition, condition in zip(self._partitions, self._conditions):
+            with condition:
+                if partition:
+                    queued.append(partition[0][2])
+        return min(queued) if queued else None
+
+    def close(self):
+        self._closed = True
+        for condition in self._conditions:
+            with condition:
+                condition.notify_all()
+
+
+class StreamingSensor(Sensor):
+    """Base of the sensors reading the RIPE Atlas stream.
+
+       The stream thread only queues the messages; a pool of workers drains
+       the queue and calls `process_message`, so slow analysis or dispatching
+       never backs up the socket. Subclasses set `channel`, implement
+       `process_message` and may override `partition_key`, `coalesce_key`
+       and the `overflow_policy` used unless configured otherwise.
+    """
+
+    channel = "atlas_result"
+    overflow_policy = DEFAULT_OVERFLOW_POLICY
+
+    def __init__(self, sensor_service, config):
+        super(StreamingSensor, self).__init__(sensor_service=sensor_service, config=config)
+        self._logger = self.sensor_service.get_logger(name=self.__class__.__name__)
+        self._atlas_stream = None
+        self._queue = None
+        self._workers = []
+        self._stopping = threading.Event()
+        # set once the state the messages are processed against is loaded;
+        # until then the stream is read and the messages wait in the queue
+        self._ready = threading.Event()
+        self._last_lag = 0.0
+        self._metrics = SensorMetrics(self.__class__.__name__)
+        self._metrics_dir = None
+        self._debug = SampledLogger(self._logger)
+        # triggers may be added before setup is called, and the shard decides
+        # which of them this sensor watches
+        self._shard = Shard.from_config(self._config)
+        self._guard = SequenceGuard()
+
+    @property
+    def atlas_stream(self):
+        # cousteau pulls requests and socketio in, only import it once the
+        # stream is used instead of when the sensor module is loaded
+        if self._atlas_stream is None:
+            from ripe.atlas.cousteau import AtlasStream
+            self._atlas_stream = AtlasStream()
+        return self._atlas_stream
+
+    def setup(self):
+        self._ready.set()
+        self._queue = PartitionedQueue(
+            partitions=self._config.get("stream_workers", DEFAULT_WORKERS),
+            maxsize=self._config.get("stream_queue_size", DEFAULT_QUEUE_SIZE),
+            policy=self._config.get("stream_overflow_policy") or self.overflow_policy)
+        self._metrics_interval = self._config.get("stream_metrics_interval", DEFAULT_METRICS_INTERVAL)
+        self._guard = SequenceGuard(self._config.get("stream_guard_size", DEFAULT_GUARD_SIZE))
+        self._metrics_dir = self._config.get("metrics_dir")
+        self._debug.every = self._config.get("debug_log_every", DEFAULT_LOG_EVERY)
+
+    def partition_key(self, message):
+        """Messages with the same partition key are processed in order"""
+        return message.get("prb_id")
+
+    def coalesce_key(self, message):
+        """Pending messages with the same coalesce key may be merged by the
+           coalesce overflow policy, None to never coalesce a message
+        """
+        return None
+
+    def sequence_of(self, message):
+        """(key, timestamp, tag) of a message for the duplicate and out of
+           order guard, see SequenceGuard; None to let every message through
+        """
+        return None
+
+    def process_message(self, message):
+        raise NotImplementedError()
+
+    def warm_up(self):
+        """Called in a thread of its own while the stream connects, e.g. to
+           import the modules the first message needs
+        """
+
+    def on_stream_message(self, *args):
+        """Called in the stream thread: queue the message and return"""
+        message = args[0]
+        self._metrics.count("received")
+        # only the stream thread calls this, the guard needs no lock
+        sequence = self.sequence_of(message)
+        if sequence is not None and not self._guard.accept(*sequence):
+            return
+        self._queue.put(self.partition_key(message), message, self.coalesce_key(message))
+
+    def _work(self, index):
+        self._ready.wait()
+        while True:
+            item = self._queue.get(index)
+            if item is None:
+                return
+            message, queued_at = item
+            self._last_lag = time.time() - queued_at
+            self._metrics.observe("queue_lag", self._last_lag)
+            try:
+                with self._metrics.timer("process"):
+                    self.process_message(message)
+            except Exception:
+                self._logger.exception("Failed to process stream message of probe %s", message.get("prb_id"))
+                self._metrics.count("failed")
+            self._metrics.count("processed")
+
+    def metrics(self):
+        """Queue depth, lag, in seconds, of the last processed message and of
+           the oldest pending one, and message counters
+        """
+        oldest = self._queue.oldest()
+        counters = self._metrics.counters
+        return {
+            "queue_depth": len(self._queue),
+            "lag": self._last_lag,
+            "oldest_pending_age": time.time() - oldest if oldest is not None else 0.0,
+            "received": counters["received"],
+            "processed": counters["processed"],
+            "failed": counters["failed"],
+            "dropped": self._queue.dropped,
+            "coalesced": self._queue.coalesced,
+            "duplicates": self._guard.duplicates,
+            "stale": self._guard.stale,
+            "reconnects": counters["reconnects"],
+        }
+
+    def _publish_metrics(self):
+        """Log the stream metrics, and write them to the metrics directory"""
+        metrics = self.metrics()
+        self._logger.info("Stream metrics: {}".format(metrics))
+        if not self._metrics_dir:
+            return
+        for name in ("queue_depth", "lag", "oldest_pending_age", "dropped", "coalesced", "duplicates", "stale"):
+            self._metrics.gauge(name, metrics[name])
+        try:
+            self._metrics.write(self._metrics_dir)
+        except (IOError, OSError):
+            self._logger.exception("Could not write the metrics to %s", self._metrics_dir)
+
+    def _connected(self):
+        return getattr(self.atlas_stream.ws, "connected", False)
+
+    def _connect(self):
+        # disconnect() drops the channel bindings, the subscriptions are kept
+        # by the stream and sent again on connect
+        self.atlas_stream.connect()
+        self.atlas_stream.bind_channel(self.channel, self.on_stream_message)
+
+    def start_workers(self):
+        for index in range(len(self._queue._partitions)):
+            worker = threading.Thread(target=self._work, args=(index,),
+                                      name="{}-worker-{}".format(self.__class__.__name__, index))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def run(self):
+        warm_up = threading.Thread(target=self.warm_up, name="{}-warm-up".format(self.__class__.__name__))
+        warm_up.daemon = True
+        warm_up.start()
+        self.start_workers()
+        delay = 1
+        self._connect()
+        while not self._stopping.is_set():
+            try:
+                self.atlas_stream.timeout(seconds=self._metrics_interval)
+            except Exception:
+                self._logger.exception("Error while reading the RIPE Atlas stream")
+            if self._stopping.is_set():
+                break
+            self._publish_metrics()
+            if self._connected():
+                delay = 1
+                continue
+            self._logger.warning("Lost the RIPE Atlas stream, reconnecting in {}s".format(delay))
+            self.atlas_stream.disconnect()
+            self._stopping.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            self._metrics.count("reconnects")
+            self._connect()
+
+    def cleanup(self):
+        self._stopping.set()
+        if self._queue is not None:
+            self._queue.close()
+        self._ready.set()
+        if self._atlas_stream is not None:
+            self._atlas_stream.disconnect()
+        for worker in self._workers:
+            worker.join(timeout=5)
@@ -0,0 +1,225 @@
+import zlib
+
+from itertools import chain, repeat
+from operator import itemgetter
+
+import numpy as np
+
+
+# marker of a hop attempt that got no answer
+UNREACHABLE_MARKER = {"x": "*"}
+
+NAN = float("nan")
+
+
+class AddressTable(dict):
+    """Interns addresses found in `from` and `dst_addr` fields into small
+       integer codes, so that they can be stored and compared in arrays.
+       Codes stay the same for the lifetime of the table; a missing
+       address (None) has code -1. Every address also gets a crc32 hash,
+       which unlike the code is stable across sensor restarts.
+    """
+
+    def __init__(self):
+        super(AddressTable, self).__init__()
+        self[None] = -1
+        self.addresses = []
+        self.hashes = []
+
+    def __missing__(self, address):
+        code = self[address] = len(self.addresses)
+        self.addresses.append(address)
+        self.hashes.append(zlib.crc32(address.encode("utf-8")) & 0xffffffff)
+        return code
+
+    def code(self, address):
+        return self[address]
+
+    def codes(self, addresses):
+        """Codes of a sequence of addresses, interning the new ones"""
+        codes = list(map(self.get, addresses))
+        if None in codes:
+            codes = list(map(self.__getitem__, addresses))
+        return codes
+
+
+class TracerouteBatch(object):
+    """Columnar representation of a batch of traceroute results.
+
+       Every hop attempt of every probe result becomes one row of the
+       attempt columns (probe index, hop index, rtt and `from` code), next
+       to a mask of the hops with unanswered attempts. The per probe summaries used by the polling
+       sensor are then computed with a handful of array operations.
+    """
+
+    def __init__(self, results, addresses):
+        self.results = results
+        self.addresses = addresses
+
+        size = len(results)
+        self.prb_ids = np.array([r["prb_id"] for r in results], dtype=np.int64)
+        self.stored_timestamp = np.array([r["stored_timestamp"] for r in results], dtype=np.int64)
+        self.hop_count = np.array([len(r["result"]) for r in results], dtype=np.int64)
+        self.dst_code = np.array([addresses[r["dst_addr"]] for r in results], dtype=np.int64)
+
+        # the result dicts are walked once, to flatten the attempts of every
+        # hop; the fields of the attempts are then read by C level map()s,
+        # and the probe and hop of every attempt derived from the counts
+        hops = list(map(dict.get, chain.from_iterable(map(itemgetter("result"), results)),
+                        repeat("result"), repeat(())))
+        attempts = list(chain.from_iterable(hops))
+        attempt_count = len(attempts)
+        attempts_per_hop = np.fromiter(map(len, hops), dtype=np.int64, count=len(hops))
+        self.hop_starts = np.cumsum(self.hop_count) - self.hop_count
+        hop_probe_idx = np.repeat(np.arange(size), self.hop_count)
+        hop_number = np.arange(len(hops)) - np.repeat(self.hop_starts, self.hop_count)
+        self.probe_idx = np.repeat(hop_probe_idx, attempts_per_hop)
+        self.hop_idx = np.repeat(hop_number, attempts_per_hop)
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(self.probe_idx, minlength=size))))
+
+        self.rtt = np.fromiter(map(dict.get, attempts, repeat("rtt"), repeat(NAN)),
+                               dtype=np.float64, count=attempt_count)
+        self.from_code = np.array(addresses.codes(list(map(dict.get, attempts, repeat("from")))),
+                                  dtype=np.int64)
+        # hop of every attempt, counted over all the hops of the batch
+        attempt_hop = np.repeat(np.arange(len(hops)), attempts_per_hop)
+        # only the attempts without a `from` can be the unanswered marker
+        marked = [index for index in np.flatnonzero(self.from_code < 0).tolist()
+                  if attempts[index] == UNREACHABLE_MARKER]
+        self.unreachable_hop = np.zeros(len(hops), dtype=bool)
+        self.unreachable_hop[attempt_hop[marked]] = True
+
+        # a probe result is unreachable when any of its hops has an unanswered attempt
+        self.unreachable = np.bincount(hop_probe_idx[self.unreachable_hop], minlength=size) > 0
+
+        # the path of every probe: the first `from` answering at each of its
+        # hops, -1 for the hops without any
+        # the attempts are ordered by hop: the first answering attempt of a
+        # hop is the one whose hop differs from the previous answering one
+        answering = np.flatnonzero(self.from_code >= 0)
+        answering_hop = attempt_hop[answering]
+        first = np.concatenate(([True], answering_hop[1:] != answering_hop[:-1])) if len(answering) else []
+        self.hop_from = np.full(len(hops), -1, dtype=np.int64)
+        self.hop_from[answering_hop[first]] = self.from_code[answering[first]]
+
+        answered = ~np.isnan(self.rtt)
+        self.rtt_median = grouped_median(self.probe_idx[answered], self.rtt[answered], size)
+
+        has_from = self.from_code >= 0
+        probe_idx, from_code = self.probe_idx[has_from], self.from_code[has_from]
+        # number of distinct `from` values per probe, from the distinct (probe, from) pairs
+        code_count = len(addresses.addresses) + 1
+        pairs = np.sort(probe_idx * code_count + from_code)
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))] if len(pairs) else pairs
+        pair_probe = pairs // code_count
+        self.from_count = np.bincount(pair_probe, minlength=size)
+        # order independent hash of the `from` set of every probe: the xor
+        # of the hashes of its distinct `from` values
+        self.from_hash = np.zeros(size, dtype=np.uint32)
+        if len(pairs):
+            pair_hash = np.array(addresses.hashes, dtype=np.uint32)[pairs % code_count]
+            starts = np.flatnonzero(np.concatenate(([True], pair_probe[1:] != pair_probe[:-1])))
+            self.from_hash[pair_probe[starts]] = np.bitwise_xor.reduceat(pair_hash, starts)
+        # whether any `from` differs from the destination of the probe result
+        self.from_differs_from_dst = np.bincount(probe_idx[from_code != self.dst_code[probe_idx]],
+                                                 minlength=size) > 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def froms(self, row):
+        """The set of `from` values found in the result of the probe at `row`"""
+        codes = self.from_code[self.offsets[row]:self.offsets[row + 1]]
+        return set(self.addresses.addresses[code] for code in np.unique(codes[codes >= 0]))
+
+    def path(self, row):
+        """The address codes answering at every hop of the probe at `row`"""
+        start = self.hop_starts[row]
+        return tuple(self.hop_from[start:start + self.hop_count[row]].tolist())
+
+    def responsive_prefix(self, row):
+        """The path of the probe at `row` up to its first hop with an
+           unanswered attempt
+        """
+        start = self.hop_starts[row]
+        unanswered = np.flatnonzero(self.unreachable_hop[start:start + self.hop_count[row]])
+        end = start + (unanswered[0] if len(unanswered) else self.hop_count[row])
+        return self.hop_from[start:end].tolist()
+
+    def compare(self, previous, rtt_tolerance, stale_after, now, ignore_stale_results=True):
+        """Compare the batch with the previous summaries of its probes.
+
+           `previous` are the (stored_timestamp, hop_count, unreachable,
+           rtt_median) columns of the previous result of every probe of the
+           batch, with `known` telling which probes have one. Results not
+           newer than the previous one are skipped while they are expected
+           to be refreshed, ie before stored timestamp + `stale_after`.
+        """
+        return BatchChanges(self, previous, rtt_tolerance, stale_after, now, ignore_stale_results)
+
+
+class PreviousColumns(object):
+    """Previous per probe summaries, aligned with the rows of a batch"""
+
+    def __init__(self, known, stored_timestamp, hop_count, unreachable, rtt_median):
+        self.known = np.asarray(known, dtype=bool)
+        self.stored_timestamp = np.asarray(stored_timestamp, dtype=np.int64)
+        self.hop_count = np.asarray(hop_count, dtype=np.int32)
+        self.unreachable = np.asarray(unreachable, dtype=bool)
+        self.rtt_median = np.asarray(rtt_median, dtype=np.float64)
+
+
+class BatchChanges(object):
+    """Masks over the rows of a batch, one per change the sensor reports"""
+
+    def __init__(self, batch, previous, rtt_tolerance, stale_after, now, ignore_stale_results=True):
+        self.previous = previous
+        deadline = batch.stored_timestamp + stale_after
+        self.stale = (previous.known & (batch.stored_timestamp == previous.stored_timestamp) &
+                      (deadline > now) & ignore_stale_results)
+        compared = previous.known & ~self.stale
+
+        self.hops_changed = compared & (previous.hop_count != batch.hop_count)
+        self.any_unreachable = compared & (previous.unreachable | batch.unreachable)
+        self.became_unreachable = self.any_unreachable & batch.unreachable & ~previous.unreachable
+        self.became_reachable = self.any_unreachable & previous.unreachable & ~batch.unreachable
+        with np.errstate(invalid="ignore"):
+            self.rtt_changed = (compared & ~self.any_unreachable &
+                                (np.abs(batch.rtt_median - previous.rtt_median) > rtt_tolerance))
+
+        # the `from` fields are only validated when the target was reached
+        validated = ~batch.unreachable
+        self.from_differs_in_attempts = validated & (batch.from_count != 1)
+        self.from_differs_from_dst = validated & batch.from_differs_from_dst
+
+
+def grouped_median(groups, values, group_count):
+    """Median of `values` for every group in range(group_count), NaN for
+       groups without values. Same result as `median()` applied per group.
+    """
+    # sort by group then value through a single key, the groups never overlap
+    if len(values):
+        span = values.max() - values.min() + 1
+        order = np.argsort(groups * span + (values - values.min()))
+    else:
+        order = np.arange(0)
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(group_count, np.nan)
+    has_values = counts > 0
+    lower = starts[has_values] + (counts[has_values] - 1) // 2
+    upper = starts[has_values] + counts[has_values] // 2
+    medians[has_values] = (sorted_values[lower] + sorted_values[upper]) / 2.0
+    return medians
+
+
+def median(array):
+    """Calculate median of the given list. Backport from Python 3
+       statistics.median for python 3
+    """
+    array = sorted(array)
+    half, odd = divmod(len(array), 2)
+    if odd:
+        return array[half]
+    return (array[half - 1] + array[half]) / 2.0
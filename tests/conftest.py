@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the sensors import their helper modules by bare name, as in the sensor
+# container, and the actions theirs from lib; the benchmarks provide the
+# offline sensor service
+sys.path[:0] = [os.path.join(ROOT, "sensors"), os.path.join(ROOT, "actions"), os.path.join(ROOT, "benchmarks")]
+
+from fake_sensor_service import ensure_st2reactor  # noqa: E402
+
+ensure_st2reactor()
@@ -0,0 +1,43 @@
+from disconnect_window import DisconnectWindow
+
+
+def clock_at(start):
+    now = [start]
+    return now, lambda: now[0]
+
+
+def test_disconnections_expire_after_the_window():
+    now, clock = clock_at(0.0)
+    window = DisconnectWindow(window=60, clock=clock)
+    window.disconnect(1)
+    now[0] = 30.0
+    window.disconnect(2)
+    assert len(window) == 2
+
+    now[0] = 61.0
+    assert len(window) == 1 and 2 in window and 1 not in window
+    now[0] = 91.0
+    assert len(window) == 0
+
+
+def test_connect_removes_the_probe():
+    now, clock = clock_at(0.0)
+    window = DisconnectWindow(window=60, clock=clock)
+    window.disconnect(1)
+    window.connect(1)
+    assert len(window) == 0
+
+
+def test_disconnecting_again_restarts_the_window_of_the_probe():
+    now, clock = clock_at(0.0)
+    window = DisconnectWindow(window=60, clock=clock)
+    window.disconnect(1)
+    now[0] = 50.0
+    window.connect(1)
+    window.disconnect(1)
+    # the first entry of the probe expires without removing the second one
+    now[0] = 70.0
+    assert 1 in window
+    now[0] = 111.0
+    assert 1 not in window
+    assert not window._queue
@@ -0,0 +1,68 @@
+import json
+import os
+
+from fleet_snapshot import META_FILE, FleetSnapshot
+from probe_fleet import ProbeFleet
+from synthetic import probe_rows
+
+DIMENSIONS = ("asn_v4", "asn_v6", "country")
+
+
+def saved_snapshot(directory, probe_count=500):
+    fleet = ProbeFleet.from_rows(probe_rows(probe_count), dimensions=DIMENSIONS)
+    FleetSnapshot(str(directory)).save(fleet, etag='"v1"', last_modified="Mon, 02 Jan 2017 00:00:00 GMT",
+                                       timestamp=1500000000)
+    return fleet
+
+
+def edit_meta(directory, edit):
+    path = os.path.join(str(directory), META_FILE)
+    with open(path) as f:
+        meta = json.load(f)
+    edit(meta)
+    with open(path, "w") as f:
+        json.dump(meta, f)
+
+
+def test_snapshot_round_trip(tmp_path):
+    fleet = saved_snapshot(tmp_path)
+    snapshot = FleetSnapshot(str(tmp_path))
+    loaded = snapshot.load()
+
+    assert loaded.dimensions == DIMENSIONS
+    assert len(loaded) == len(fleet)
+    assert (loaded.status == fleet.status).all()
+    for dimension in DIMENSIONS:
+        assert (loaded.group_codes[dimension] == fleet.group_codes[dimension]).all()
+        assert loaded.groups[dimension].keys == fleet.groups[dimension].keys
+        assert loaded.groups[dimension].connected == fleet.groups[dimension].connected
+    assert (snapshot.timestamp, snapshot.etag) == (1500000000, '"v1"')
+    assert snapshot.headers() == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 02 Jan 2017 00:00:00 GMT"}
+
+
+def test_loaded_fleet_takes_events_and_new_probes(tmp_path):
+    saved_snapshot(tmp_path, probe_count=100)
+    fleet = FleetSnapshot(str(tmp_path)).load()
+    fleet.update(5, 2)
+    fleet.update(100000, 1, asn_v4=3333)
+    assert fleet.status[5] == 2 and fleet.percentage("asn_v4", 3333) == 100.0
+
+
+def test_snapshot_of_another_version_is_ignored(tmp_path):
+    saved_snapshot(tmp_path)
+    edit_meta(tmp_path, lambda meta: meta.update(version=0))
+    assert FleetSnapshot(str(tmp_path)).load() is None
+
+    edit_meta(tmp_path, lambda meta: meta.pop("version"))
+    assert FleetSnapshot(str(tmp_path)).load() is None
+
+
+def test_snapshot_whose_columns_and_sidecar_differ_is_ignored(tmp_path):
+    saved_snapshot(tmp_path)
+    # a save interrupted after the columns of a larger fleet
+    edit_meta(tmp_path, lambda meta: meta.update(size=meta["size"] - 1))
+    assert FleetSnapshot(str(tmp_path)).load() is None
+
+
+def test_missing_snapshot(tmp_path):
+    assert FleetSnapshot(str(tmp_path / "none")).load() is None
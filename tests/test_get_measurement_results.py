@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+pytest.importorskip("st2common.runners.base_action")
+
+from get_measurement_results import MAX_PROBES_PER_REQUEST, AtlasGetMeasurementResults  # noqa: E402
+
+
+class FakeFetchAction(AtlasGetMeasurementResults):
+    """The action answering from `answers`, by measurement, instead of the API"""
+
+    def __init__(self, answers):
+        super(FakeFetchAction, self).__init__(config={})
+        self.answers = answers
+        self.fetches = []
+        self._fetches_lock = threading.Lock()
+
+    def _fetch(self, session, timeout, msm_id, probe_ids):
+        with self._fetches_lock:
+            self.fetches.append((msm_id, list(probe_ids)))
+        answer = self.answers[msm_id]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def result(prb_id, timestamp):
+    return {"prb_id": prb_id, "timestamp": timestamp}
+
+
+def test_duplicate_pairs_are_fetched_once_per_measurement():
+    action = FakeFetchAction({5001: (True, [result(1, 100), result(1, 200), result(2, 100)]),
+                              5002: (True, [result(1, 300)])})
+    pairs = [{"measurement_id": 5001, "probe_id": 1}, {"measurement_id": "5001", "probe_id": "2"},
+             {"measurement_id": 5001, "probe_id": 1}, {"measurement_id": 5002, "probe_id": 1}]
+
+    succeeded, results = action.run(pairs)
+    assert succeeded
+    assert sorted(action.fetches) == [(5001, [1, 2]), (5002, [1])]
+    assert list(results) == ["5001:1", "5001:2", "5002:1"]
+    # the latest result of a probe wins
+    assert results["5001:1"] == {"last_result": result(1, 200)}
+    assert results["5002:1"] == {"last_result": result(1, 300)}
+
+
+def test_probes_are_split_in_bounded_requests():
+    probe_count = 2 * MAX_PROBES_PER_REQUEST + 1
+    action = FakeFetchAction({5001: (True, [])})
+    action.run([{"measurement_id": 5001, "probe_id": prb_id} for prb_id in range(probe_count)])
+    assert sorted(len(probe_ids) for _, probe_ids in action.fetches) == [1, MAX_PROBES_PER_REQUEST,
+                                                                         MAX_PROBES_PER_REQUEST]
+
+
+def test_failed_fetch_only_fails_its_pairs():
+    action = FakeFetchAction({5001: (False, "500 Internal Server Error"), 5002: IOError("timed out"),
+                              5003: (True, [result(1, 100)])})
+    succeeded, results = action.run([{"measurement_id": msm_id, "probe_id": prb_id}
+                                     for msm_id in (5001, 5002, 5003) for prb_id in (1, 2)])
+    assert succeeded
+    assert "error" in results["5001:1"] and "error" in results["5002:2"]
+    assert results["5003:1"] == {"last_result": result(1, 100)}
+    assert "No results" in results["5003:2"]["error"]
+
+
+def test_no_result_at_all_is_a_failure():
+    succeeded, _ = FakeFetchAction({5001: (False, "404")}).run([{"measurement_id": 5001, "probe_id": 1}])
+    assert not succeeded
@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+from json_stream import iter_array_items
+
+
+def chunked(body, size=7):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+def test_items_are_parsed_across_chunks():
+    rows = [[prb_id, 3333, "NL"] for prb_id in range(50)]
+    body = json.dumps({"meta": {}, "probes": rows}).encode("utf-8")
+    assert list(iter_array_items(chunked(body), "probes")) == rows
+
+
+def test_truncated_body_raises():
+    body = json.dumps({"probes": [[prb_id, 3333] for prb_id in range(50)]}).encode("utf-8")
+    items = iter_array_items(chunked(body[:len(body) // 2]), "probes")
+    with pytest.raises(ValueError):
+        list(items)
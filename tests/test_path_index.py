@@ -0,0 +1,49 @@
+from path_index import NO_ADDRESS, PathIndex, last_shared_hop
+
+
+def test_probes_are_indexed_by_the_addresses_of_their_path():
+    index = PathIndex()
+    index.update(1, (10, 20, 30))
+    index.update(2, (10, 21, NO_ADDRESS, 30))
+    index.update(3, (10, 20, 30))
+
+    assert index.probe_paths[1] == index.probe_paths[3] != index.probe_paths[2]
+    assert set(index.probes_through(20)) == {1, 3}
+    assert set(index.probes_through(30)) == {1, 2, 3}
+    assert not index.probes_through(NO_ADDRESS)
+
+
+def test_changed_path_moves_the_probe():
+    index = PathIndex()
+    first = index.update(1, (10, 20, 30))[1]
+    old_path_id, path_id = index.update(1, (10, 25, 30))
+
+    assert old_path_id == first != path_id
+    assert index.path_of(1) == (10, 25, 30)
+    assert not index.probes_through(20) and 20 not in index.probes_by_address
+    assert index.update(1, (10, 25, 30)) == (path_id, path_id)
+
+
+def test_path_ids_are_reused_once_their_last_probe_left():
+    index = PathIndex()
+    shared = index.update(1, (10, 20))[1]
+    index.update(2, (10, 20))
+    index.update(1, (10, 21))
+    assert index.path(shared) == (10, 20)
+    index.update(2, (10, 22))
+    assert index.path(shared) is None
+    # the id of the dropped path is given to the next new one
+    assert index.update(3, (10, 23))[1] == shared
+    assert len(index) == 3
+
+
+def test_last_shared_hop_is_the_deepest_common_address():
+    prefixes = [(1, (10, 20, 30, 40)), (2, (11, 20, 30, 41)), (3, (12, 20, 30)), (4, (13, 20, NO_ADDRESS, 42))]
+    address, position, probes = last_shared_hop(prefixes, min_probes=3)
+    assert address == 30 and position == 2.0 and probes == [1, 2, 3]
+
+
+def test_no_shared_hop_below_the_quorum():
+    prefixes = [(1, (10, 20)), (2, (11, 21)), (3, (12, 20)), (4, (13, 23)), (5, (14, 24))]
+    assert last_shared_hop(prefixes, min_probes=2) is None
+    assert last_shared_hop(prefixes, min_probes=2, quorum=0.4)[0] == 20
@@ -0,0 +1,79 @@
+import pytest
+
+from fake_sensor_service import FakeSensorService
+from ping_streaming_sensor import PERCENTILE_TRIGGER, PingStreamingSensor
+from sharding import Shard
+
+MSM_ID = 5001
+PRB_ID = 6001
+
+
+@pytest.fixture
+def sensor():
+    service = FakeSensorService(keep_payloads=True)
+    sensor = PingStreamingSensor(service, {})
+    sensor.setup()
+    sensor.add_trigger({"id": "trigger", "ref": PERCENTILE_TRIGGER,
+                        "parameters": {"msm_id": MSM_ID, "target_rtt": 50}})
+    yield sensor
+    sensor.cleanup()
+
+
+def ping(timestamp, rtt):
+    return {"msm_id": MSM_ID, "prb_id": PRB_ID, "timestamp": timestamp,
+            "result": [{"rtt": rtt}, {"rtt": rtt}, {"rtt": rtt}]}
+
+
+def dispatched_keys(sensor):
+    return [payload["prb_id"] for _, payload, _ in sensor._sensor_service.dispatched]
+
+
+def test_sustained_high_latency_is_reported_once(sensor):
+    for timestamp in range(100):
+        sensor.process_message(ping(timestamp, 120.0))
+    # once for the measurement and once for its probe
+    assert sorted(dispatched_keys(sensor), key=str) == sorted([None, PRB_ID], key=str)
+
+
+def test_reported_again_after_dropping_below_the_target(sensor):
+    for timestamp in range(100):
+        sensor.process_message(ping(timestamp, 120.0))
+    for timestamp in range(100, 1100):
+        sensor.process_message(ping(timestamp, 10.0))
+    assert len(dispatched_keys(sensor)) == 2
+    for timestamp in range(1100, 5100):
+        sensor.process_message(ping(timestamp, 120.0))
+    assert len(dispatched_keys(sensor)) == 4
+
+
+def test_triggers_added_before_setup_use_the_config():
+    owner = Shard(0, 2).owner(MSM_ID)
+    for index in range(2):
+        sensor = PingStreamingSensor(FakeSensorService(),
+                                     {"percentile_window": 60, "shard_index": index, "shard_count": 2})
+        sensor.add_trigger({"id": "trigger", "ref": PERCENTILE_TRIGGER, "parameters": {"msm_id": MSM_ID}})
+        if index == owner:
+            assert sensor._subscriptions["trigger"].window == 60
+        else:
+            assert "trigger" not in sensor._subscriptions
+
+
+def test_update_of_the_thresholds_keeps_the_windows(sensor):
+    for timestamp in range(100):
+        sensor.process_message(ping(timestamp, 120.0))
+    sketches = dict(sensor._subscriptions["trigger"].sketches)
+
+    sensor.update_trigger({"id": "trigger", "ref": PERCENTILE_TRIGGER,
+                           "parameters": {"msm_id": MSM_ID, "target_rtt": 50, "min_sample_count": 5}})
+    subscription = sensor._subscriptions["trigger"]
+    assert subscription.min_sample_count == 5
+    assert subscription.sketches == sketches
+    sensor.process_message(ping(100, 120.0))
+    # still above the same target: not reported again
+    assert len(dispatched_keys(sensor)) == 2
+
+    sensor.update_trigger({"id": "trigger", "ref": PERCENTILE_TRIGGER,
+                           "parameters": {"msm_id": MSM_ID, "target_rtt": 100}})
+    sensor.process_message(ping(101, 120.0))
+    # a new target: the windows are evaluated against it right away
+    assert len(dispatched_keys(sensor)) == 4
@@ -0,0 +1,56 @@
+import copy
+
+from probe_fleet import STATUS_CONNECTED, STATUS_DISCONNECTED, ProbeFleet
+from synthetic import probe_rows
+
+DIMENSIONS = ("asn_v4", "asn_v6", "country", "anchor")
+
+
+def test_update_moves_the_counters_of_the_probe_groups():
+    fleet = ProbeFleet.from_rows([[1, 3333, 0, "NL", 0, 1, 0, 0, 0, 0, 0, 0, STATUS_CONNECTED, 0],
+                                  [2, 3333, 0, "NL", 0, 1, 0, 0, 0, 0, 0, 0, STATUS_CONNECTED, 0]],
+                                 dimensions=DIMENSIONS)
+    changes = fleet.update(1, STATUS_DISCONNECTED, asn_v4=3333, country="NL")
+
+    assert [(change.dimension, change.key, change.before, change.after) for change in changes] == [
+        ("asn_v4", 3333, 100.0, 50.0), ("country", "NL", 100.0, 50.0), ("anchor", "probe", 100.0, 50.0)]
+    assert fleet.percentage("asn_v4", 3333) == 50.0
+    assert len(fleet) == 2
+
+
+def test_probe_moving_to_another_group():
+    fleet = ProbeFleet.from_rows([[1, 3333, 0, "NL", 0, 1, 0, 0, 0, 0, 0, 0, STATUS_CONNECTED, 0],
+                                  [2, 3333, 0, "NL", 0, 1, 0, 0, 0, 0, 0, 0, STATUS_DISCONNECTED, 0]],
+                                 dimensions=DIMENSIONS)
+    fleet.update(2, STATUS_CONNECTED, asn_v4=1103)
+    assert fleet.percentage("asn_v4", 3333) == 100.0
+    assert fleet.percentage("asn_v4", 1103) == 100.0
+
+
+def test_reconciled_fleet_counts_as_a_new_one():
+    rows = probe_rows(3000, seed=1)
+    fleet = ProbeFleet.from_rows(rows[:2000], dimensions=DIMENSIONS)
+    changed_rows = copy.deepcopy(rows)
+    for row in changed_rows[::7]:
+        row[1] += 1
+        row[12] = STATUS_DISCONNECTED if row[12] == STATUS_CONNECTED else STATUS_CONNECTED
+
+    prb_ids, changed = fleet.reconcile_rows(changed_rows[1000:])
+    assert fleet.retain(prb_ids) == 1000
+    expected = ProbeFleet.from_rows(changed_rows[1000:], dimensions=DIMENSIONS)
+    assert len(fleet) == len(expected) == 2000
+    for dimension in DIMENSIONS:
+        groups, expected_groups = fleet.groups[dimension], expected.groups[dimension]
+        for key in expected_groups.keys:
+            assert fleet.percentage(dimension, key) == expected.percentage(dimension, key)
+        assert sum(groups.connected) == sum(expected_groups.connected)
+        assert sum(groups.disconnected) == sum(expected_groups.disconnected)
+
+
+def test_skipped_probes_keep_their_status():
+    rows = probe_rows(10)
+    fleet = ProbeFleet.from_rows(rows, dimensions=DIMENSIONS)
+    fleet.update(3, STATUS_DISCONNECTED)
+    fleet.reconcile_rows([row[:12] + [STATUS_CONNECTED, 0] for row in rows], skip={3})
+    assert fleet.status[3] == STATUS_DISCONNECTED
+    assert fleet.status[4] == STATUS_CONNECTED
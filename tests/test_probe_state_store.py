@@ -0,0 +1,29 @@
+import math
+
+from probe_state_store import ProbeStateStore, ProbeSummary
+
+
+def test_checkpoint_round_trip(tmp_path):
+    store = ProbeStateStore(str(tmp_path / "state" / "polling_state.sqlite"))
+    summaries = {1: ProbeSummary(1500000100, 12, 23.5, False, 77),
+                 2: ProbeSummary(1500000200, 30, float("nan"), True, 0)}
+    store.save(5001, 1500000150, summaries)
+    store.close()
+
+    high_water_mark, loaded = ProbeStateStore(str(tmp_path / "state" / "polling_state.sqlite")).load(5001)
+    assert high_water_mark == 1500000150
+    assert sorted(loaded) == [1, 2]
+    assert (loaded[1].stored_timestamp, loaded[1].hop_count, loaded[1].rtt_median,
+            loaded[1].unreachable, loaded[1].from_hash) == (1500000100, 12, 23.5, False, 77)
+    assert math.isnan(loaded[2].rtt_median) and loaded[2].unreachable is True
+
+
+def test_checkpoint_replaces_the_previous_one(tmp_path):
+    store = ProbeStateStore(str(tmp_path / "polling_state.sqlite"))
+    store.save(5001, 100, {1: ProbeSummary(90, 5, 1.0, False, 1), 2: ProbeSummary(95, 5, 1.0, False, 1)})
+    store.save(5001, 200, {2: ProbeSummary(195, 6, 2.0, False, 2)})
+    store.save(5002, 300, {3: ProbeSummary(295, 7, 3.0, False, 3)})
+
+    high_water_mark, summaries = store.load(5001)
+    assert high_water_mark == 200 and list(summaries) == [2]
+    assert store.load(6000) == (None, {})
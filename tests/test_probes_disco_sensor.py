@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import requests
+
+from fake_sensor_service import FakeSensorService
+from probe_fleet import ProbeFleet
+from probes_disco_sensor import ProbesDiscoSensor
+from synthetic import probe_rows
+
+
+class TruncatedResponse(object):
+    """probes/all response whose body stops halfway"""
+
+    status_code = 200
+    headers = {}
+
+    def __init__(self, rows):
+        body = json.dumps({"probes": rows}).encode("utf-8")
+        self._body = body[:len(body) // 2]
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self._body), chunk_size):
+            yield self._body[start:start + chunk_size]
+
+
+@pytest.fixture
+def sensor(tmp_path):
+    sensor = ProbesDiscoSensor(FakeSensorService(), {"cache_dir": str(tmp_path)})
+    sensor.setup()
+    yield sensor
+    sensor.cleanup()
+
+
+def test_truncated_fleet_download_keeps_the_missing_probes(sensor, monkeypatch):
+    rows = probe_rows(1000)
+    sensor._fleet = ProbeFleet.from_rows(rows, dimensions=sensor._dimensions)
+    known = len(sensor._fleet)
+    monkeypatch.setattr(requests, "get", lambda *args, **kwargs: TruncatedResponse(rows))
+
+    sensor._refresh_fleet()
+    assert len(sensor._fleet) == known
+
+
+def test_outage_of_one_as_is_one_dispatch(sensor):
+    rows = probe_rows(2000, asn_count=20)
+    for row in rows:
+        row[12] = 1
+    sensor._fleet = ProbeFleet.from_rows(rows, dimensions=sensor._dimensions)
+    sensor.sensor_service = FakeSensorService(keep_payloads=True)
+    outage = [row for row in rows if row[1] == 7]
+
+    for number, row in enumerate(outage):
+        sensor.process_message({"prb_id": row[0], "event": "disconnect", "timestamp": 1500000000 + number,
+                                "type": "connection",
+                                "probe": {"asn_v4": row[1], "asn_v6": row[2] or None,
+                                          "country_code": row[3], "is_anchor": bool(row[4]),
+                                          "prefix_v4": row[8], "prefix_v6": row[9] or None}})
+    sensor._coalescer.flush(force=True)
+
+    assert len(outage) > 50
+    assert sum(sensor.sensor_service.dispatch_counts.values()) == 1
+    _, payload, _ = sensor.sensor_service.dispatched[0]
+    assert len(payload["probe_ids"]) == len(outage)
+    assert ("asn_v4", 7) in [(group["dimension"], group["group"]) for group in payload["groups"]]
+
+
+def test_full_queue_coalesces_unless_configured_to_block(sensor, tmp_path):
+    assert sensor._queue.policy == "coalesce"
+
+    blocking = ProbesDiscoSensor(FakeSensorService(), {"cache_dir": str(tmp_path),
+                                                       "stream_overflow_policy": "block"})
+    blocking.setup()
+    assert blocking._queue.policy == "block"
+    blocking.cleanup()
@@ -0,0 +1,56 @@
+import numpy as np
+
+from quantile_sketch import QuantileSketch, WindowedQuantileSketch
+
+QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    rng = np.random.RandomState(0)
+    values = rng.lognormal(mean=3.5, sigma=1.0, size=20000)
+    sketch = QuantileSketch(relative_accuracy=0.02)
+    for chunk in np.array_split(values, 20):
+        sketch.add(chunk)
+
+    assert len(sketch) == len(values)
+    # the lower interpolation of np.percentile, as in the sketch
+    exact = np.sort(values)[[int(q * (len(values) - 1)) for q in QUANTILES]]
+    for estimate, value in zip(sketch.quantiles(QUANTILES), exact):
+        assert abs(estimate - value) <= 0.02 * value
+
+
+def test_merged_sketches_answer_as_one():
+    rng = np.random.RandomState(1)
+    values = rng.uniform(1, 300, size=5000)
+    whole, first, second = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    whole.add(values)
+    first.add(values[:1000])
+    second.add(values[1000:])
+    first.merge(second)
+    assert first.quantiles(QUANTILES) == whole.quantiles(QUANTILES)
+
+
+def test_values_out_of_range_are_clipped():
+    sketch = QuantileSketch(relative_accuracy=0.02, min_value=0.01, max_value=60000.0)
+    sketch.add([0.0, 1e9])
+    low, high = sketch.quantiles([0.0, 1.0])
+    assert abs(low - 0.01) <= 0.02 * 0.01 and abs(high - 60000.0) <= 0.02 * 60000.0
+
+
+def test_window_forgets_the_expired_values():
+    now = [1000.0]
+    sketch = WindowedQuantileSketch(window=300, slots=5, clock=lambda: now[0])
+    sketch.add([200.0] * 100)
+    now[0] += 120
+    sketch.add([10.0] * 100)
+    assert sketch.quantiles([0.99])[1][0] > 190
+
+    now[0] += 300
+    sketch.add([10.0] * 10)
+    count, (p99,) = sketch.quantiles([0.99])
+    assert count == 10 and abs(p99 - 10.0) <= 0.2
+
+
+def test_empty_sketch_has_no_quantiles():
+    count, values = WindowedQuantileSketch().quantiles([0.5])
+    assert count == 0 and np.isnan(values[0])
@@ -0,0 +1,42 @@
+import argparse
+
+from fake_sensor_service import FakeSensorService
+from recorder import PROBESTATUS_CHANNEL, RESULT_CHANNEL, Recorder, read_recording
+from replay import Replay, replay_disco
+from synthetic import probe_rows, probe_status_events
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / "atlas.ndjson.gz")
+    with Recorder(path) as recorder:
+        recorder.record(RESULT_CHANNEL, {"msm_id": 5001, "prb_id": 1, "result": [{"rtt": 1.5}]})
+        recorder.record("latest", [{"prb_id": 2}], msm_id=5001, interval=900)
+    assert recorder.count == 2
+
+    records = list(read_recording(path))
+    assert [record["channel"] for record in records] == [RESULT_CHANNEL, "latest"]
+    assert records[0]["payload"]["result"] == [{"rtt": 1.5}]
+    assert (records[1]["msm_id"], records[1]["interval"]) == (5001, 900)
+    assert records[0]["received"] <= records[1]["received"]
+
+
+def test_replayed_recording_dispatches_as_the_live_messages(tmp_path):
+    args = argparse.Namespace(probes=2000, seed=3, synthetic=5000, recording=None, cache_dir=str(tmp_path / "live"))
+    live = FakeSensorService()
+    replay_disco(args, live, Replay())
+
+    path = str(tmp_path / "disco.ndjson.gz")
+    with Recorder(path) as recorder:
+        recorder.record(RESULT_CHANNEL, {"msm_id": 5001})
+        for event in probe_status_events(probe_rows(args.probes, seed=args.seed), args.synthetic, seed=args.seed):
+            recorder.record(PROBESTATUS_CHANNEL, event)
+    args.recording, args.cache_dir = path, str(tmp_path / "replayed")
+    replayed = FakeSensorService()
+    replay = Replay()
+    replay_disco(args, replayed, replay)
+
+    # the messages of the other channels are left out
+    assert replay.messages == args.synthetic
+    assert len(replay.latencies) == args.synthetic
+    assert sum(live.dispatch_counts.values()) > 0
+    assert replayed.dispatch_counts == live.dispatch_counts
@@ -0,0 +1,42 @@
+import os
+
+from lib.result_cache import ResultCache
+
+
+def test_entries_expire_after_their_ttl(tmp_path):
+    now = [1000.0]
+    cache = ResultCache(str(tmp_path / "results"), clock=lambda: now[0])
+    cache.put((5001, 1), {"rtt": 1.5}, ttl=60)
+    cache.put((5001, 2), {"rtt": 2.5}, ttl=600)
+
+    assert cache.get((5001, 1)) == {"rtt": 1.5}
+    now[0] += 60
+    assert cache.get((5001, 1)) is None
+    assert cache.get((5001, 2)) == {"rtt": 2.5}
+    assert cache.get((5001, 3)) is None
+
+
+def test_least_recently_written_entries_are_pruned(tmp_path):
+    directory = tmp_path / "results"
+    cache = ResultCache(str(directory), max_entries=3)
+    for prb_id in range(5):
+        cache.put((5001, prb_id), prb_id, ttl=60)
+        path = os.path.join(str(directory), "5001-{}.json".format(prb_id))
+        os.utime(path, (1000 + prb_id, 1000 + prb_id))
+
+    assert sorted(os.listdir(str(directory))) == ["5001-2.json", "5001-3.json", "5001-4.json"]
+    assert cache.get((5001, 0)) is None and cache.get((5001, 4)) == 4
+
+
+def test_unusable_directory_is_no_error(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text(u"")
+    cache = ResultCache(str(blocker / "results"))
+    cache.put((5001, 1), 1, ttl=60)
+    assert cache.get((5001, 1)) is None
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    (tmp_path / "5001-1.json").write_text(u"{not json")
+    assert cache.get((5001, 1)) is None
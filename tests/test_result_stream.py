@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from lib.result_stream import iter_results
+
+
+def chunked(body, size=7):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+def test_results_are_parsed_across_chunks():
+    results = [{"prb_id": prb_id, "msm_id": 5001, "result": [{"rtt": 1.5}, {"x": "*"}]}
+               for prb_id in range(50)]
+    body = json.dumps(results).encode("utf-8")
+    assert list(iter_results(chunked(body))) == results
+
+
+def test_multibyte_characters_split_across_chunks():
+    results = [{"prb_id": 1, "description": u"réseau 測定"}]
+    body = json.dumps(results, ensure_ascii=False).encode("utf-8")
+    assert list(iter_results(chunked(body, size=1))) == results
+
+
+def test_empty_array_has_no_results():
+    assert list(iter_results([b"  [ ", b"]"])) == []
+
+
+def test_truncated_body_raises():
+    body = json.dumps([{"prb_id": prb_id} for prb_id in range(50)]).encode("utf-8")
+    results = iter_results(chunked(body[:len(body) // 2]))
+    with pytest.raises(ValueError):
+        list(results)
+
+
+def test_body_that_is_not_an_array_raises():
+    with pytest.raises(ValueError):
+        list(iter_results([b'{"error": {"status": 404}}']))
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from fake_sensor_service import FakeSensorService
+from ripe_atlas_polling import RIPEAtlasPolling
+from synthetic import traceroute_rounds
+
+MSM_ID = 5001
+INTERVAL = 900
+
+
+class RecordingFetcher(object):
+    """MeasurementFetcher answering with the queued results, recording the
+       start of every results request
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.starts = []
+
+    def measurement(self, msm_id):
+        return True, {"id": msm_id, "interval": INTERVAL, "type": "traceroute",
+                      "status": {"id": 2, "name": "Ongoing"}}
+
+    def latest(self, msm_id, probe_ids=None):
+        results, self.pending = self.pending, []
+        return True, results
+
+    def results_since(self, msm_id, start, probe_ids=None):
+        self.starts.append(start)
+        return self.latest(msm_id, probe_ids)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sensor(tmp_path):
+    sensor = RIPEAtlasPolling(FakeSensorService(), {"measurements": [{"measurement_id": MSM_ID}],
+                                                    "cache_dir": str(tmp_path)})
+    sensor.setup()
+    sensor._fetcher = RecordingFetcher()
+    yield sensor
+    sensor.cleanup()
+
+
+def test_second_poll_starts_at_the_high_water_mark(sensor):
+    now = int(time.time())
+    first, second = traceroute_rounds(100, rounds=2, interval=INTERVAL, start=now - INTERVAL - 60)
+    watch = sensor._watches[0]
+
+    sensor._fetcher.pending = first
+    sensor._poll_measurement(watch)
+    high_water_mark = max(result["timestamp"] for result in first)
+    assert watch.high_water_mark == high_water_mark
+
+    sensor._fetcher.pending = second
+    sensor._poll_measurement(watch)
+    start, = sensor._fetcher.starts
+    upload_delay = max(result["stored_timestamp"] - result["timestamp"] for result in first)
+    assert start == high_water_mark - upload_delay - sensor._measurement_delay_tolerance
+    # far less than the whole interval the previous results cover
+    assert high_water_mark - start < INTERVAL / 10
+
+
+def simulate_polls(sensor, monkeypatch, offline=0):
+    """Polls of 1000 probes whose results are stored evenly over the
+       interval, over 4 intervals; the first `offline` probes stopped
+       reporting
+    """
+    import ripe_atlas_polling
+    from probe_state_store import ProbeSummary
+
+    now = [1500000000.0]
+    monkeypatch.setattr(ripe_atlas_polling.time, "time", lambda: now[0])
+    watch = sensor._watches[0]
+    watch.measurement = sensor._measurements.refresh(MSM_ID)[1]
+    for prb_id in range(1000):
+        watch.previous_measurement[prb_id] = ProbeSummary(now[0] - INTERVAL + prb_id * INTERVAL / 1000.0,
+                                                          10, 20.0, False, 0)
+
+    sensor._schedule_next_poll(watch)
+    first_gap = watch.next_poll_at - now[0]
+    polls = 0
+    end = now[0] + 4 * INTERVAL
+    while watch.next_poll_at < end:
+        now[0] = watch.next_poll_at
+        polls += 1
+        # every online probe whose result was due by now uploaded it
+        for prb_id, summary in watch.previous_measurement.items():
+            if prb_id >= offline and summary.stored_timestamp + INTERVAL <= now[0]:
+                summary.stored_timestamp += INTERVAL
+        sensor._schedule_next_poll(watch)
+    return first_gap, polls
+
+
+def test_probes_spread_over_the_interval_are_polled_a_few_times_per_interval(sensor, monkeypatch):
+    first_gap, polls = simulate_polls(sensor, monkeypatch)
+    assert first_gap > INTERVAL / 10
+    assert polls <= 4 * 5
+
+
+def test_offline_probes_do_not_hold_the_polls_back(sensor, monkeypatch):
+    _, polls = simulate_polls(sensor, monkeypatch, offline=300)
+    assert polls <= 4 * 5
+
+
+def test_restarted_sensor_resumes_from_the_checkpoint(sensor, tmp_path):
+    now = int(time.time())
+    first, second = traceroute_rounds(100, rounds=2, interval=INTERVAL, start=now - INTERVAL - 60)
+    watch = sensor._watches[0]
+    sensor._fetcher.pending = first
+    sensor._poll_measurement(watch)
+    sensor._checkpoint_state()
+
+    restarted = RIPEAtlasPolling(FakeSensorService(), {"measurements": [{"measurement_id": MSM_ID}],
+                                                       "cache_dir": str(tmp_path)})
+    restarted.setup()
+    restarted._fetcher = RecordingFetcher()
+    resumed = restarted._watches[0]
+    assert resumed.high_water_mark == watch.high_water_mark
+    assert sorted(resumed.previous_measurement) == sorted(watch.previous_measurement)
+
+    # the first poll after the restart continues from the high water mark
+    restarted._fetcher.pending = second
+    restarted._poll_measurement(resumed)
+    start, = restarted._fetcher.starts
+    assert watch.high_water_mark - start < INTERVAL / 10
+    restarted.cleanup()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from rtt_history import RttHistory
+
+
+def test_window_statistics_cover_the_last_values():
+    history = RttHistory(size=8, initial_rows=2)
+    rng = np.random.RandomState(0)
+    values = rng.uniform(10, 50, size=(30, 5))
+    for row in values[:-1]:
+        history.observe([1, 2, 3, 4, 5], row)
+
+    drift = history.observe([1, 2, 3, 4, 5], values[-1])
+    window = values[-9:-1]
+    assert len(history) == 5
+    assert np.allclose(drift.mean, window.mean(axis=0), atol=1e-4)
+    assert np.allclose(drift.std, window.std(axis=0), atol=1e-3)
+    assert (drift.samples == 8).all()
+
+
+def test_only_the_drifting_probe_is_significant():
+    history = RttHistory(size=24, alpha=0.3)
+    rng = np.random.RandomState(1)
+    for _ in range(24):
+        history.observe([1, 2], 20 + rng.normal(0, 1, size=2))
+
+    for _ in range(3):
+        drift = history.observe([1, 2], [60.0, 20 + rng.normal(0, 1)])
+    assert drift.significant(threshold=3.0, min_samples=10, min_delta=5.0).tolist() == [True, False]
+
+
+def test_new_probe_has_no_history():
+    history = RttHistory()
+    drift = history.observe([1], [25.0])
+    assert drift.samples.tolist() == [0] and np.isnan(drift.mean[0])
+    assert not drift.significant(threshold=3.0, min_samples=1, min_delta=0.0).any()
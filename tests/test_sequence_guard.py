@@ -0,0 +1,41 @@
+from sequence_guard import SequenceGuard
+
+
+def test_duplicate_and_stale_messages_are_dropped():
+    guard = SequenceGuard()
+    assert guard.accept("probe-1", 100)
+    assert not guard.accept("probe-1", 100)
+    assert not guard.accept("probe-1", 90)
+    assert guard.accept("probe-1", 110)
+    assert guard.accept("probe-2", 90)
+    assert (guard.duplicates, guard.stale) == (1, 1)
+
+
+def test_tags_tell_apart_messages_of_the_same_timestamp():
+    guard = SequenceGuard()
+    assert guard.accept(1, 100, "disconnect")
+    assert guard.accept(1, 100, "connect")
+    assert not guard.accept(1, 100, "connect")
+
+
+def test_least_recently_seen_keys_are_evicted_first():
+    guard = SequenceGuard(max_keys=3)
+    for key in (1, 2, 3):
+        guard.accept(key, 100)
+    # key 1 is seen again, key 2 becomes the least recently seen
+    guard.accept(1, 101)
+    guard.accept(4, 100)
+
+    assert len(guard) == 3
+    # the replay of an evicted key goes through, the others are still caught
+    assert guard.accept(2, 100)
+    assert not guard.accept(1, 101)
+    assert not guard.accept(4, 100)
+
+
+def test_memory_is_bounded():
+    guard = SequenceGuard(max_keys=100)
+    for key in range(10000):
+        guard.accept(key, key)
+    assert len(guard) == 100
+    assert not guard.accept(9999, 9999)
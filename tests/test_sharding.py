@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import sharding
+from sharding import Shard, key_hash
+
+KEYS = list(range(1, 20001))
+
+
+def owners(count, keys=KEYS):
+    shard = Shard(0, count)
+    return [shard.owner(key) for key in keys]
+
+
+def test_every_key_has_exactly_one_owner():
+    count = 4
+    masks = [Shard(index, count).owned(KEYS) for index in range(count)]
+    assert (np.sum(masks, axis=0) == 1).all()
+    # the vectorized mask agrees with the scalar owner
+    assert np.flatnonzero(masks[2]).tolist() == [i for i, owner in enumerate(owners(count)) if owner == 2]
+    shares = [mask.sum() for mask in masks]
+    assert min(shares) > 0.22 * len(KEYS) and max(shares) < 0.28 * len(KEYS)
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before, after = owners(4), owners(5)
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+    assert all(new == 4 for _, new in moved)
+    # about the share of the new shard, 1/5 of the keys
+    assert 0.17 * len(KEYS) < len(moved) < 0.23 * len(KEYS)
+
+
+def test_removing_a_shard_only_moves_its_keys():
+    before, after = owners(5), owners(4)
+    assert all(old == 4 for old, new in zip(before, after) if old != new)
+
+
+def test_owners_are_stable_across_processes():
+    # keys are hashed without hash(), whose string seed changes every run
+    keys = [5001, "asn_v4:3333", "country:NL", "probe:disconnect"]
+    script = ("from sharding import Shard; "
+              "print([Shard(0, 3).owner(key) for key in {!r}])".format(keys))
+    env = dict(os.environ, PYTHONHASHSEED="12345",
+               PYTHONPATH=os.pathsep.join([os.path.dirname(sharding.__file__), os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, "-c", script], env=env)
+    assert output.decode().strip() == str([Shard(0, 3).owner(key) for key in keys])
+    assert key_hash(5001) == 5001
+
+
+def test_single_shard_owns_everything():
+    assert Shard().owns("anything") and Shard().owned([1, 2, 3]).all()
+
+
+def test_invalid_shard():
+    with pytest.raises(ValueError):
+        Shard(2, 2)